@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # full-text and trigram search
     'rest_framework', # Django REST Framework
     'rest_framework.authtoken', # For token authentication
     'community',
@@ -127,5 +128,38 @@ REST_FRAMEWORK = {
     'SEARCH_PARAM': 'q', # Use 'q' for search queries
 }
 
-WEBHOOK_TIMEOUT = 30  # seconds
+WEBHOOK_TIMEOUT = 30  # seconds, enforced per delivery attempt
 WEBHOOK_MAX_RETRIES = 3
+WEBHOOK_RETRY_BACKOFF = 10  # seconds before the first retry, doubled for each later one
+WEBHOOK_RETRY_BACKOFF_MAX = 3600  # seconds
+WEBHOOK_CIRCUIT_FAILURE_THRESHOLD = 5  # consecutive failures before an endpoint's circuit opens
+WEBHOOK_CIRCUIT_COOLDOWN = 300  # seconds an open circuit waits before probing again
+WEBHOOK_SUBSCRIPTION_TTL = 60  # seconds a process trusts its in-memory subscription index
+WEBHOOK_MAX_WORKERS = 20  # concurrent deliveries per dispatcher process
+WEBHOOK_RESPONSE_BODY_MAX_BYTES = 2048  # head of each subscriber response kept in WebhookLog
+WEBHOOK_LOG_RETENTION_DAYS = 30  # WebhookLog rows older than this are archived by archive_webhook_logs
+WEBHOOK_ARCHIVE_DIR = BASE_DIR / 'archive' / 'webhook_logs'
+WEBHOOK_REPLAY_RATE = 50  # deliveries per second queued by replay_webhooks and the admin redeliver action
+
+IDEMPOTENCY_KEY_TTL = 86400  # seconds a stored Idempotency-Key response is replayed for
+
+# Cached list and detail responses live in their own cache. The default keeps them in
+# process memory, which is only coherent with a single server process; point
+# RESPONSE_CACHE_BACKEND at a shared backend such as
+# django.core.cache.backends.redis.RedisCache (with RESPONSE_CACHE_LOCATION set to its URL)
+# when running several.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': config('RESPONSE_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('RESPONSE_CACHE_LOCATION', default='responses'),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=300, cast=int)  # seconds; 0 disables caching
+
+SYNC_PAGE_SIZE = 500  # most journal rows read per /sync/ request
+SYNC_JOURNAL_RETENTION_DAYS = 90  # rows older than this are deleted by prune_sync_journal
@@ -6,7 +6,9 @@ from .models import (
     MemberPayment, Deposit, MemberDeposit, DepositPayment, Loan, MemberLoan,
     LoanRefund, Document, Minute, Feedback, Message
 )
-from .webhooks import WebhookEndpoint
+from . import ledger
+from .search import search_members
+from . import webhook_admin  # noqa: F401 - registers the webhook admins
 
 @admin.register(Branch)
 class BranchAdmin(admin.ModelAdmin):
@@ -34,7 +36,7 @@ class MemberAdmin(admin.ModelAdmin):
     #inlines = (MemberInline,)
     #list_display = ['user__username', 'branch', 'phone_number', 'birthday', 'status']
     #list_filter = ['is_staff', 'user__is_active', 'branch', 'status', 'birthday']
-    search_fields = ['username', 'first_name', 'last_name', 'branch_name', 'phone_number']
+    search_fields = ['user__username', 'user__first_name', 'user__last_name', 'branch__branch_name', 'phone_number']
     ordering = ('user__username',)
     fieldsets = (
         (None, {
@@ -48,6 +50,10 @@ class MemberAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        # Answered from the directory search indexes instead of an icontains per field
+        return search_members(queryset, search_term, ranked=False), False
+
     def user_full_name(self, obj):
         return f"{obj.user.first_name} {obj.user.last_name}" if obj.user.first_name else obj.user.username
     user_full_name.short_description = "Full Name"
@@ -85,7 +91,7 @@ class MemberPaymentAdmin(admin.ModelAdmin):
 
 @admin.register(Deposit)
 class DepositAdmin(admin.ModelAdmin):
-    list_display = ['name', 'branch', 'min_amount', 'is_active', 'updated_by', 'updated_at']
+    list_display = ['name', 'branch', 'min_amount', 'interest_rate', 'is_active', 'updated_by', 'updated_at']
     list_filter = ['is_active', 'branch', 'updated_at']
     search_fields = ['name']
     readonly_fields = ['created_at', 'updated_at']
@@ -108,17 +114,34 @@ class MemberDepositAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """Ledger entries are append-only: new ones are posted through the ledger, existing ones are read-only"""
+    readonly_fields = ['sequence', 'previous_balance', 'new_balance', 'posted_at']
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(DepositPayment)
-class DepositPaymentAdmin(admin.ModelAdmin):
-    list_display = ['payment_id', 'deposit', 'deposit_amount', 'previous_balance', 'new_balance']
+class DepositPaymentAdmin(LedgerEntryAdmin):
+    list_display = ['payment_id', 'deposit', 'sequence', 'deposit_amount', 'previous_balance', 'new_balance',
+                    'posted_at']
     list_filter = ['deposit']
     search_fields = ['deposit__name']
 
+    def save_model(self, request, obj, form, change):
+        posted = ledger.post_deposit_payment(obj.deposit, obj.deposit_amount)
+        obj.pk = posted.pk
+
 
 @admin.register(Loan)
 class LoanAdmin(admin.ModelAdmin):
-    list_display = ['loan_name', 'loan_branch', 'interest_rate', 'is_active', 'status', 'updated_at']
-    list_filter = ['is_active', 'status', 'loan_branch', 'updated_at']
+    list_display = ['loan_name', 'loan_branch', 'interest_rate', 'interest_method', 'term_months', 'is_active',
+                    'status', 'updated_at']
+    list_filter = ['is_active', 'status', 'interest_method', 'loan_branch', 'updated_at']
     search_fields = ['loan_name']
     readonly_fields = ['updated_at']
 
@@ -132,7 +155,7 @@ class MemberLoanAdmin(admin.ModelAdmin):
     list_display = ['user', 'loan', 'loan_amount', 'disbursement_date', 'interest_amount', 'balance_remaining']
     list_filter = ['loan', 'disbursement_date', 'created_at']
     search_fields = ['user__user__username', 'loan__loan_name']
-    readonly_fields = ['created_at']
+    readonly_fields = ['accrued_principal', 'accrued_interest', 'created_at']
     date_hierarchy = 'disbursement_date'
 
     def balance_remaining(self, obj):
@@ -147,10 +170,22 @@ class MemberLoanAdmin(admin.ModelAdmin):
 
 
 @admin.register(LoanRefund)
-class LoanRefundAdmin(admin.ModelAdmin):
-    list_display = ['payment_id', 'deposit', 'deposit_amount', 'previous_balance', 'new_balance']
+class LoanRefundAdmin(LedgerEntryAdmin):
+    list_display = ['payment_id', 'deposit', 'sequence', 'deposit_amount', 'previous_balance', 'new_balance',
+                    'posted_at']
     list_filter = ['deposit']
     search_fields = ['deposit__name']
+    raw_id_fields = ['member_loan']
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        if 'member_loan' in form.base_fields:
+            form.base_fields['member_loan'].required = True
+        return form
+
+    def save_model(self, request, obj, form, change):
+        posted = ledger.post_loan_refund(obj.member_loan, obj.deposit_amount, obj.deposit)
+        obj.pk = posted.pk
 
 
 @admin.register(Document)
@@ -232,13 +267,12 @@ class EventAdmin(admin.ModelAdmin):
         obj.updated_by = request.user
         super().save_model(request, obj, form, change)
 
-# Re-register UserAdmin
+# Re-register UserAdmin; MemberAdmin's ordering and search only resolve on Member
 admin.site.unregister(User)
-admin.site.register(User, MemberAdmin)
+admin.site.register(User, BaseUserAdmin)
 
 # Register other models
 admin.site.register(Message)
-admin.site.register(WebhookEndpoint)
 
 # Customize the admin site header and title
 admin.site.site_header = "Community Admin Console"
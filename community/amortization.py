@@ -0,0 +1,180 @@
+import calendar
+import logging
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.db import connection
+
+from .models import Branch, Loan, MemberLoan
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+
+class Installment(NamedTuple):
+    number: int
+    due_date: date
+    principal: Decimal
+    interest: Decimal
+    payment: Decimal
+    balance: Decimal
+
+
+class Curve(NamedTuple):
+    """
+    Cumulative share of a unit principal repaid, and of interest charged on it,
+    after each installment of a loan product: principal[k] and interest[k] for
+    k = 0..term, computed once at full precision.
+
+    A loan's amounts are its principal times these shares, rounded to the cent
+    only at the end. Any installment is then the difference of two rounded
+    cumulative amounts, so a schedule always sums exactly to the principal and
+    batch accruals never have to walk a schedule row by row.
+    """
+    principal: Tuple[Decimal, ...]
+    interest: Tuple[Decimal, ...]
+
+
+@lru_cache(maxsize=256)
+def curve(method: str, annual_rate: Decimal, term_months: int) -> Curve:
+    """
+    Args:
+        method: Loan.InterestMethod value
+        annual_rate: Yearly interest in percent, e.g. Decimal('12.5')
+        term_months: Number of monthly installments
+    """
+    with localcontext() as context:
+        context.prec = 34
+        rate = annual_rate / 1200  # per month
+        principal, interest = [Decimal(0)], [Decimal(0)]
+
+        if method == Loan.InterestMethod.FLAT or rate == 0:
+            for k in range(1, term_months + 1):
+                principal.append(Decimal(k) / term_months)
+                interest.append(rate * k)
+        else:
+            # Reducing balance: equal payments, interest on the outstanding balance
+            payment = rate / (1 - (1 + rate) ** -term_months)
+            balance = Decimal(1)
+            for _ in range(term_months):
+                charged = balance * rate
+                balance -= payment - charged
+                principal.append(principal[-1] + payment - charged)
+                interest.append(interest[-1] + charged)
+            principal[-1] = Decimal(1)
+
+    return Curve(tuple(principal), tuple(interest))
+
+
+def curve_for(loan: Loan) -> Curve:
+    # interest_rate is a float; go through str() so 12.1 means 12.1, not its binary approximation
+    return curve(loan.interest_method, Decimal(str(loan.interest_rate)), loan.term_months)
+
+
+def add_months(start: date, months: int) -> date:
+    month = start.month - 1 + months
+    year, month = start.year + month // 12, month % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def installments_due(disbursed: date, as_of: date, term_months: int) -> int:
+    """Number of monthly installments falling due on or before `as_of`"""
+    months = (as_of.year - disbursed.year) * 12 + as_of.month - disbursed.month
+    if months > 0 and add_months(disbursed, months) > as_of:
+        months -= 1
+    return max(0, min(months, term_months))
+
+
+def _amount(principal: Decimal, share: Decimal) -> Decimal:
+    return (principal * share).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def schedule(member_loan: MemberLoan) -> List[Installment]:
+    """Monthly repayment schedule of a member loan, exact to the cent"""
+    loan = member_loan.loan
+    shares = curve_for(loan)
+    principal = member_loan.loan_amount
+    installments = []
+
+    for k in range(1, loan.term_months + 1):
+        principal_part = _amount(principal, shares.principal[k]) - _amount(principal, shares.principal[k - 1])
+        interest_part = _amount(principal, shares.interest[k]) - _amount(principal, shares.interest[k - 1])
+        installments.append(Installment(
+            number=k,
+            due_date=add_months(member_loan.disbursement_date, k),
+            principal=principal_part,
+            interest=interest_part,
+            payment=principal_part + interest_part,
+            balance=principal - _amount(principal, shares.principal[k])
+        ))
+    return installments
+
+
+def accrue_loans(as_of: date, branch: Optional[Branch] = None, chunk_size: int = 2000) -> Tuple[int, int]:
+    """
+    Set accrued_principal and accrued_interest of every active member loan to the
+    amounts fallen due by `as_of`
+
+    Loans are streamed as bare column tuples. Each loan costs two multiplications
+    against its product's cached curve, and only rows whose amounts changed are
+    written back, so a nightly run over a large book touches few rows.
+
+    Args:
+        as_of: Accrue installments due on or before this date
+        branch: Only loans of this branch and its sub-branches
+        chunk_size: Rows fetched and written per batch
+
+    Returns:
+        (loans examined, loans updated)
+    """
+    loans = Loan.objects.filter(is_active=True)
+    if branch is not None:
+        loans = loans.in_branch_subtree(branch)
+    products: Dict[int, Tuple[int, Curve]] = {loan.pk: (loan.term_months, curve_for(loan)) for loan in loans}
+
+    rows = MemberLoan.objects.filter(loan_id__in=list(products)).values_list(
+        'pk', 'loan_id', 'loan_amount', 'disbursement_date', 'accrued_principal', 'accrued_interest'
+    ).order_by('pk').iterator(chunk_size=chunk_size)
+
+    examined, updated, changed = 0, 0, []
+    for pk, loan_id, principal, disbursed, accrued_principal, accrued_interest in rows:
+        examined += 1
+        term_months, shares = products[loan_id]
+        k = installments_due(disbursed, as_of, term_months)
+
+        due_principal, due_interest = _amount(principal, shares.principal[k]), _amount(principal, shares.interest[k])
+        if (due_principal, due_interest) != (accrued_principal, accrued_interest):
+            changed.append(MemberLoan(pk=pk, accrued_principal=due_principal, accrued_interest=due_interest))
+
+        if len(changed) >= chunk_size:
+            updated += _write(changed)
+            changed = []
+
+    updated += _write(changed)
+    logger.info(f"Accrued {updated} of {examined} member loans as of {as_of}")
+    return examined, updated
+
+
+def _write(member_loans: List[MemberLoan]) -> int:
+    if not member_loans:
+        return 0
+
+    if connection.vendor != 'postgresql':
+        MemberLoan.objects.bulk_update(member_loans, ['accrued_principal', 'accrued_interest'])
+        return len(member_loans)
+
+    # One UPDATE ... FROM (VALUES ...) per chunk; bulk_update's CASE per row is
+    # far slower when a whole book falls due on the same day
+    table = MemberLoan._meta.db_table
+    rows = ', '.join(['(%s, %s::numeric, %s::numeric)'] * len(member_loans))
+    params = [value for loan in member_loans for value in (loan.pk, loan.accrued_principal, loan.accrued_interest)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE "{table}" SET accrued_principal = v.principal, accrued_interest = v.interest '
+            f'FROM (VALUES {rows}) AS v (id, principal, interest) WHERE "{table}".id = v.id',
+            params
+        )
+    return len(member_loans)
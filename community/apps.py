@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CommunityConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'community'
+
+    def ready(self):
+        # Webhook and idempotency models live outside models.py; import them so they are always registered.
+        # search connects the receivers that keep the member directory index current
+        # response_cache and sync act on the changes WebhookManager reports; sync also holds the journal model
+        from . import idempotency, response_cache, search, sync, webhooks  # noqa: F401
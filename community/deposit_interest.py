@@ -0,0 +1,125 @@
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Deposit, DepositAccrualCheckpoint, MemberDeposit
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+
+def next_period(period: date) -> date:
+    return date(period.year + period.month // 12, period.month % 12 + 1, 1)
+
+
+def period_end(period: date) -> datetime:
+    """Start of the month after `period`, as an aware datetime"""
+    return timezone.make_aware(datetime.combine(next_period(period), time.min))
+
+
+def monthly_interest(balance: Decimal, annual_rate: Decimal) -> Decimal:
+    return (balance * annual_rate / 1200).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def accrue_deposit(deposit: Deposit, period: date, chunk_size: int = 1000) -> DepositAccrualCheckpoint:
+    """
+    Accrue interest on every member deposit of a deposit product up to a month
+
+    Interest is compounded monthly on the deposit plus the interest already
+    earned; accrued_principal becomes that interest-bearing balance. Deposits
+    opened after the period are skipped.
+
+    Months are accrued in order, each on the balances the previous one left:
+    months between the last one accrued and `period` are accrued first, and an
+    unfinished month is finished first. The first month ever accrued for a
+    deposit product may be any month.
+
+    Member deposits are processed in primary-key chunks. Each chunk is locked,
+    written back with bulk_update and recorded in the checkpoint in a single
+    transaction, so the run can be interrupted and restarted at any point
+    without double-accruing.
+
+    Args:
+        deposit: Deposit product to accrue
+        period: Any day of the last month to accrue
+        chunk_size: Member deposits per transaction
+
+    Returns:
+        The period's checkpoint, completed
+
+    Raises:
+        ValueError: if the month is earlier than one already accrued, and was
+            not accrued itself
+    """
+    period = period.replace(day=1)
+    while True:
+        checkpoint = _accrue_period(deposit, _next_checkpoint(deposit, period), chunk_size)
+        if checkpoint.period >= period:
+            return checkpoint
+
+
+def _next_checkpoint(deposit: Deposit, period: date) -> DepositAccrualCheckpoint:
+    """Checkpoint of the month to accrue next on the way to `period`"""
+    with transaction.atomic():
+        # Serializes choosing and creating checkpoints, so two runs cannot start different months
+        Deposit.objects.select_for_update().only('pk').get(pk=deposit.pk)
+        checkpoints = deposit.accrual_checkpoints.all()
+
+        checkpoint = checkpoints.filter(period=period).first()
+        if checkpoint is not None:
+            return checkpoint
+        latest = checkpoints.order_by('-period').first()
+        if latest is None:
+            return deposit.accrual_checkpoints.create(period=period)
+        if latest.period > period:
+            raise ValueError(f"Interest on {deposit} was accrued for {latest.period:%Y-%m}; "
+                             f"{period:%Y-%m} was skipped and can no longer be accrued")
+        if not latest.completed_at:
+            return latest
+        return deposit.accrual_checkpoints.create(period=next_period(latest.period))
+
+
+def _accrue_period(deposit: Deposit, checkpoint: DepositAccrualCheckpoint, chunk_size: int) -> DepositAccrualCheckpoint:
+    period = checkpoint.period
+    if checkpoint.completed_at:
+        logger.info(f"Interest on {deposit} for {period:%Y-%m} was already accrued")
+        return checkpoint
+
+    opened_before = period_end(period)
+    while True:
+        with transaction.atomic():
+            checkpoint = DepositAccrualCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+            if checkpoint.completed_at:
+                # Another worker finished this period meanwhile
+                return checkpoint
+
+            chunk = list(
+                MemberDeposit.objects.select_for_update()
+                .filter(deposit=deposit, pk__gt=checkpoint.last_member_deposit, created_at__lt=opened_before)
+                .only('pk', 'total_deposit_amount', 'interest_earned', 'accrued_principal')
+                .order_by('pk')[:chunk_size]
+            )
+            if not chunk:
+                checkpoint.completed_at = timezone.now()
+                checkpoint.save(update_fields=['completed_at'])
+                logger.info(f"Accrued {checkpoint.interest_total} interest on {checkpoint.accrued_count} "
+                            f"member deposits of {deposit} for {period:%Y-%m}")
+                return checkpoint
+
+            chunk_interest = Decimal('0')
+            for member_deposit in chunk:
+                interest = monthly_interest(member_deposit.total_deposit_amount + member_deposit.interest_earned,
+                                            deposit.interest_rate)
+                member_deposit.interest_earned += interest
+                member_deposit.accrued_principal = member_deposit.total_deposit_amount + member_deposit.interest_earned
+                chunk_interest += interest
+            MemberDeposit.objects.bulk_update(chunk, ['interest_earned', 'accrued_principal'])
+
+            checkpoint.last_member_deposit = chunk[-1].pk
+            checkpoint.accrued_count += len(chunk)
+            checkpoint.interest_total += chunk_interest
+            checkpoint.save(update_fields=['last_member_deposit', 'accrued_count', 'interest_total'])
@@ -0,0 +1,258 @@
+import logging
+import re
+import zlib
+from typing import Dict, Iterator, List, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Larger uploads are indexed by name only
+MAX_FILE_BYTES = 20 * 1024 * 1024
+
+TEXT_EXTENSIONS = {'txt', 'md', 'csv', 'tsv', 'json', 'xml', 'html', 'htm', 'log'}
+
+# Most bytes a Flate stream may inflate to, and all streams of one file together,
+# so a small crafted upload cannot expand without bound
+MAX_STREAM_BYTES = 4 * 1024 * 1024
+MAX_INFLATED_BYTES = 32 * 1024 * 1024
+
+# Streams that never hold page text; object streams are read for their fonts only
+_SKIPPED_STREAMS = re.compile(rb'/Subtype\s*/Image|/FontFile|/Length1|/Type\s*/(?:XRef|Metadata|EmbeddedFile)')
+_OBJECT_STREAM = re.compile(rb'/Type\s*/ObjStm')
+_STREAM = re.compile(rb'stream\r?\n')
+_OBJECT = re.compile(rb'(\d+)\s+\d+\s+obj\b(.*?)\bendobj', re.S)
+_TYPE0 = re.compile(rb'/Subtype\s*/Type0\b')
+_FONT_RESOURCES = re.compile(rb'/Font(?![A-Za-z])\s*(?:<<(.*?)>>|(\d+)\s+\d+\s+R)', re.S)
+_FONT_REFERENCE = re.compile(rb'/([^\s/<>\[\]()]+)\s+(\d+)\s+\d+\s+R')
+_DELIMITERS = b'()<>[]{}/%'
+
+
+def extract_text(content: bytes, file_name: str = '', file_type: str = '') -> str:
+    """
+    Plain text of an uploaded document, for the search index
+
+    Text files are decoded as UTF-8, falling back to Latin-1. PDFs go through
+    a small built-in extractor that reads the text operators of each page
+    content stream, uncompressed or Flate-compressed within MAX_STREAM_BYTES.
+    It does not apply font encodings or ToUnicode maps: strings are read as
+    cp1252 or UTF-16, so text in simple fonts with the standard encodings,
+    such as the statements this app writes, comes out right, while custom
+    encodings may come out garbled. Text in composite (Type0) fonts, whose
+    strings are glyph ids, is skipped. Anything it cannot read gives '' rather
+    than an exception. Other types are not extracted.
+
+    Args:
+        content: File contents
+        file_name: Original file name, used to guess the type
+        file_type: Declared MIME type or extension
+
+    Returns:
+        The extracted text, possibly empty
+    """
+    kind = file_type.lower().lstrip('.')
+    extension = file_name.lower().rsplit('.', 1)[-1] if '.' in file_name else ''
+
+    if 'pdf' in kind or extension == 'pdf' or content.startswith(b'%PDF-'):
+        try:
+            return pdf_text(content)
+        except Exception as e:
+            logger.warning(f"Could not extract text from PDF {file_name}: {e}")
+            return ''
+
+    if kind.startswith('text/') or kind in TEXT_EXTENSIONS or extension in TEXT_EXTENSIONS:
+        try:
+            return content.decode('utf-8')
+        except UnicodeDecodeError:
+            return content.decode('latin-1')
+
+    return ''
+
+
+def pdf_text(content: bytes) -> str:
+    objects = {int(number): body for number, body in _OBJECT.findall(content)}
+    page_streams = []
+    for dictionary, data in _streams(content):
+        if _OBJECT_STREAM.search(dictionary):
+            objects.update(_stream_objects(dictionary, data))
+        else:
+            page_streams.append(data)
+
+    composite_fonts = _composite_font_names(objects)
+    pages = []
+    for stream in page_streams:
+        text = _stream_text(stream, composite_fonts)
+        if text.strip():
+            pages.append(text)
+    return '\n'.join(pages)
+
+
+def _streams(content: bytes) -> Iterator[Tuple[bytes, bytes]]:
+    """(dictionary, data) of the streams that may hold text or fonts, Flate streams inflated within the caps"""
+    budget = MAX_INFLATED_BYTES
+    for match in _STREAM.finditer(content):
+        # The stream dictionary sits between the object header and the stream keyword
+        start = content.rfind(b'obj', 0, match.start())
+        dictionary = content[start:match.start()] if start != -1 else b''
+        end = content.find(b'endstream', match.end())
+        if end == -1 or _SKIPPED_STREAMS.search(dictionary):
+            continue
+
+        data = content[match.end():end]
+        if b'/FlateDecode' in dictionary:
+            if budget <= 0:
+                logger.warning(f"PDF streams inflate past {MAX_INFLATED_BYTES} bytes; the rest is not indexed")
+                return
+            try:
+                # Output beyond max_length stays unread in the decompressor and is dropped
+                data = zlib.decompressobj().decompress(data, min(MAX_STREAM_BYTES, budget))
+            except zlib.error:
+                continue
+            budget -= len(data)
+        elif b'/Filter' in dictionary:
+            continue  # Other encodings are not supported
+        yield dictionary, data
+
+
+def _stream_objects(dictionary: bytes, data: bytes) -> Dict[int, bytes]:
+    """Objects packed in an object stream, by object number"""
+    first = re.search(rb'/First\s+(\d+)', dictionary)
+    if first is None:
+        return {}
+    first = int(first.group(1))
+    try:
+        header = [int(value) for value in data[:first].split()]
+    except ValueError:
+        return {}
+    numbers, offsets = header[0::2], header[1::2] + [len(data) - first]
+    return {number: data[first + offsets[i]:first + offsets[i + 1]] for i, number in enumerate(numbers)}
+
+
+def _composite_font_names(objects: Dict[int, bytes]) -> Set[bytes]:
+    """Resource names, e.g. b'/F2', given to a Type0 font anywhere in the document"""
+    composite = {number for number, body in objects.items() if _TYPE0.search(body)}
+    names = set()
+    if not composite:
+        return names
+    for body in objects.values():
+        for inline, reference in _FONT_RESOURCES.findall(body):
+            fonts = objects.get(int(reference), b'') if reference else inline
+            names.update(b'/' + name for name, number in _FONT_REFERENCE.findall(fonts) if int(number) in composite)
+    return names
+
+
+def _stream_text(data: bytes, composite_fonts: Set[bytes] = frozenset()) -> str:
+    """
+    Text shown by the Tj, TJ, ' and " operators of a content stream, with line
+    breaks where text moves down, leaving out text set in `composite_fonts`
+    """
+    out: List[str] = []
+    operands: List[Union[bytes, float, list]] = []
+    array = None
+    name = font = None
+
+    for token in _tokens(data):
+        if isinstance(token, tuple):  # string
+            (array if array is not None else operands).append(token[0])
+        elif token == b'[':
+            array = []
+        elif token == b']':
+            operands.append(array or [])
+            array = None
+        elif isinstance(token, float):
+            (array if array is not None else operands).append(token)
+        elif array is not None or token in (b'<<', b'>>'):
+            continue  # Dictionaries are operands this extractor has no use for
+        elif token.startswith(b'/'):
+            name = token
+            continue
+        elif token == b'Tf':
+            font = name
+        elif font in composite_fonts and token in (b'Tj', b'TJ', b"'", b'"'):
+            pass  # Glyph ids, not text
+        elif token == b'Tj' or token in (b"'", b'"'):
+            if token != b'Tj':
+                out.append('\n')
+            out.extend(_decode(operand) for operand in operands[-1:] if isinstance(operand, bytes))
+        elif token == b'TJ' and operands and isinstance(operands[-1], list):
+            for item in operands[-1]:
+                # Large negative adjustments are word gaps
+                out.append(_decode(item) if isinstance(item, bytes) else ' ' if item < -200 else '')
+        elif token in (b'T*', b'ET'):
+            out.append('\n')
+        elif token in (b'Td', b'TD') and len(operands) >= 2 and isinstance(operands[-1], float):
+            out.append('\n' if operands[-1] else ' ')
+        if isinstance(token, bytes) and token not in (b'[', b']'):
+            operands = []
+
+    return re.sub(r'[ \t]+\n', '\n', ''.join(out))
+
+
+def _tokens(data: bytes) -> Iterator:
+    """Strings as 1-tuples of bytes, numbers as floats, everything else as bytes"""
+    i, length = 0, len(data)
+    while i < length:
+        char = data[i:i + 1]
+        if char.isspace():
+            i += 1
+        elif char == b'%':
+            end = data.find(b'\n', i)
+            i = length if end == -1 else end
+        elif char == b'(':
+            value, i = _literal_string(data, i + 1)
+            yield (value,)
+        elif char == b'<' and data[i + 1:i + 2] != b'<':
+            end = data.find(b'>', i)
+            end = length if end == -1 else end
+            digits = re.sub(rb'[^0-9A-Fa-f]', b'', data[i + 1:end])
+            yield (bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode()),)
+            i = end + 1
+        elif char in (b'[', b']'):
+            yield char
+            i += 1
+        elif char in (b'<', b'>'):
+            yield data[i:i + 2]
+            i += 2
+        else:
+            start = i
+            i += 1
+            while i < length and not data[i:i + 1].isspace() and data[i] not in _DELIMITERS:
+                i += 1
+            word = data[start:i]
+            try:
+                yield float(word)
+            except ValueError:
+                yield word
+
+
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+def _literal_string(data: bytes, i: int):
+    value, depth = bytearray(), 1
+    while i < len(data):
+        char = data[i:i + 1]
+        if char == b'\\':
+            following = data[i + 1:i + 2]
+            octal = re.match(rb'[0-7]{1,3}', data[i + 1:i + 4])
+            if octal:
+                value.append(int(octal.group(), 8) & 0xFF)
+                i += 1 + len(octal.group())
+                continue
+            if following not in (b'\n', b'\r'):
+                value += _ESCAPES.get(following, following)
+            i += 2
+            continue
+        if char == b'(':
+            depth += 1
+        elif char == b')':
+            depth -= 1
+            if depth == 0:
+                return bytes(value), i + 1
+        value += char
+        i += 1
+    return bytes(value), i
+
+
+def _decode(value: bytes) -> str:
+    if value.startswith(b'\xfe\xff') or (len(value) >= 2 and len(value) % 2 == 0 and not any(value[::2])):
+        return value.decode('utf-16-be', errors='ignore').lstrip('\ufeff')
+    return value.decode('cp1252', errors='replace')
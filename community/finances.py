@@ -0,0 +1,71 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import MemberDeposit, MemberFinances, MemberLoan, MemberPayment
+
+logger = logging.getLogger(__name__)
+
+
+def compute_totals(member_ids: List[int]) -> Dict[int, Dict[str, Decimal]]:
+    """
+    Compute MemberFinances totals from the underlying rows, one GROUP BY per source
+
+    Returns:
+        {member id: {'total_savings': ..., 'total_loans': ...}} for every member in `member_ids`
+    """
+    totals = {member_id: defaultdict(Decimal) for member_id in member_ids}
+
+    sources = [
+        (MemberDeposit.objects.filter(member_id__in=member_ids), 'member_id', 'total_savings',
+         Sum('total_deposit_amount')),
+        (MemberPayment.objects.filter(user_id__in=member_ids), 'user_id', 'total_savings',
+         Sum('payment_amount')),
+        (MemberLoan.objects.filter(user_id__in=member_ids), 'user_id', 'total_loans',
+         Sum(F('loan_amount') - F('principal_paid'))),
+    ]
+    for queryset, member_field, total, aggregate in sources:
+        for row in queryset.order_by().values(member_field).annotate(amount=aggregate):
+            totals[row[member_field]][total] += row['amount'] or 0
+
+    return totals
+
+
+def recompute_finances(member_ids: List[int]) -> int:
+    """
+    Overwrite the MemberFinances totals of `member_ids` with freshly computed ones
+
+    The members' existing finance rows are locked first. Incremental adjustments
+    made meanwhile either committed before the totals were read, and so are
+    included, or wait on the lock and apply on top of the rebuilt totals.
+
+    Returns:
+        Number of members whose totals were written
+    """
+    with transaction.atomic():
+        list(MemberFinances.objects.select_for_update().filter(user_id__in=member_ids).values_list('pk'))
+        totals = compute_totals(member_ids)
+
+        now = timezone.now()
+        MemberFinances.objects.bulk_create(
+            [
+                MemberFinances(
+                    user_id=member_id,
+                    total_savings=member_totals['total_savings'],
+                    total_loans=member_totals['total_loans'],
+                    last_updated_at=now
+                )
+                for member_id, member_totals in totals.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['total_savings', 'total_loans', 'last_updated_at']
+        )
+
+    logger.debug(f"Recomputed finances for {len(totals)} members")
+    return len(totals)
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a write made with an `Idempotency-Key` header.
+
+    A retry with the same key gets the stored response back instead of running
+    the handler again. Keys are scoped to the user and expire after
+    IDEMPOTENCY_KEY_TTL seconds; purge_idempotency_keys evicts expired rows.
+    """
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # sha256 of method, path and body, to reject a key reused for a different request
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_key_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
+
+    @staticmethod
+    def fingerprint_for(method: str, path: str, data) -> str:
+        body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, default=str)
+        return hashlib.sha256(f"{method} {path}\n{body}".encode()).hexdigest()
+
+    @staticmethod
+    def expiry() -> datetime:
+        return timezone.now() + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+
+
+def purge_expired_keys(batch_size: int = 5000) -> int:
+    """
+    Delete expired idempotency keys in batches
+
+    Returns:
+        Number of keys deleted
+    """
+    deleted = 0
+    now = timezone.now()
+    while True:
+        pks = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            logger.info(f"Purged {deleted} expired idempotency keys")
+            return deleted
+        IdempotencyKey.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
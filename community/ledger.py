@@ -0,0 +1,117 @@
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Deposit, DepositPayment, LoanRefund, MemberLoan
+
+logger = logging.getLogger(__name__)
+
+
+def post_deposit_payment(deposit: Deposit, amount: Decimal, **fields) -> DepositPayment:
+    """
+    Append a payment to a deposit account
+
+    The deposit row is locked for the rest of the transaction, so concurrent
+    postings to the same account are serialized: each one reads the balance the
+    previous one left and takes the next sequence number.
+
+    Args:
+        deposit: Account to post to
+        amount: Amount paid in; negative for corrections
+        **fields: Any other DepositPayment fields
+
+    Returns:
+        The saved entry
+    """
+    with transaction.atomic():
+        Deposit.objects.select_for_update().only('pk').get(pk=deposit.pk)
+        last = DepositPayment.objects.filter(deposit_id=deposit.pk).order_by('-sequence').first()
+
+        previous_balance = last.new_balance if last else Decimal('0')
+        entry = DepositPayment.objects.create(
+            deposit_id=deposit.pk,
+            sequence=last.sequence + 1 if last else 1,
+            deposit_amount=amount,
+            previous_balance=previous_balance,
+            new_balance=previous_balance + amount,
+            posted_at=timezone.now(),
+            **fields
+        )
+
+    logger.info(f"Posted payment {entry.payment_id} #{entry.sequence} to deposit {deposit.pk}")
+    return entry
+
+
+def post_loan_refund(member_loan: MemberLoan, amount: Decimal, deposit: Deposit, **fields) -> LoanRefund:
+    """
+    Append a refund to a member loan; balances are the principal still outstanding
+
+    The member loan row is locked for the rest of the transaction, as in
+    post_deposit_payment. The loan's principal_paid is the one record of what
+    has been repaid: each refund starts from the principal it leaves
+    outstanding, including repayments recorded before the ledger, and adds its
+    amount to it.
+
+    Args:
+        member_loan: Account to post to
+        amount: Amount refunded; negative for corrections
+        deposit: Deposit the refund is paid from
+        **fields: Any other LoanRefund fields
+
+    Returns:
+        The saved entry
+    """
+    with transaction.atomic():
+        locked = MemberLoan.objects.select_for_update().get(pk=member_loan.pk)
+        last = LoanRefund.objects.filter(member_loan_id=member_loan.pk).order_by('-sequence').first()
+
+        previous_balance = locked.loan_amount - locked.principal_paid
+        entry = LoanRefund.objects.create(
+            member_loan_id=member_loan.pk,
+            deposit_id=deposit.pk,
+            sequence=last.sequence + 1 if last else 1,
+            deposit_amount=amount,
+            previous_balance=previous_balance,
+            new_balance=previous_balance - amount,
+            posted_at=timezone.now(),
+            **fields
+        )
+        # Saved as a FinancesContribution, so MemberFinances follows
+        locked.principal_paid += amount
+        locked.save(update_fields=['principal_paid'])
+        member_loan.principal_paid = locked.principal_paid
+
+    logger.info(f"Posted refund {entry.payment_id} #{entry.sequence} to member loan {member_loan.pk}")
+    return entry
+
+
+def deposit_balance(deposit: Deposit, as_of: Optional[datetime] = None) -> Decimal:
+    """
+    Balance of a deposit account at a moment, from the last entry posted by then
+
+    Every entry carries the running balance, so this is one lookup on the
+    (deposit, posted_at, sequence) index rather than a sum over history.
+    """
+    entries = DepositPayment.objects.filter(deposit_id=deposit.pk)
+    if as_of is not None:
+        entries = entries.filter(posted_at__lte=as_of)
+    balance = entries.order_by('-posted_at', '-sequence').values_list('new_balance', flat=True).first()
+    return balance if balance is not None else Decimal('0')
+
+
+def loan_balance(member_loan: MemberLoan, as_of: Optional[datetime] = None) -> Decimal:
+    """Principal outstanding on a member loan at a moment, as deposit_balance"""
+    entries = LoanRefund.objects.filter(member_loan_id=member_loan.pk)
+    if as_of is None:
+        return MemberLoan.objects.values_list(F('loan_amount') - F('principal_paid'), flat=True).get(pk=member_loan.pk)
+    balance = entries.filter(posted_at__lte=as_of).order_by('-posted_at', '-sequence').values_list(
+        'new_balance', flat=True).first()
+    if balance is None:
+        # Before the first refund: what that refund started from
+        balance = entries.order_by('posted_at', 'sequence').values_list('previous_balance', flat=True).first()
+    return balance if balance is not None else member_loan.loan_amount - member_loan.principal_paid
@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from community.deposit_interest import accrue_deposit
+from community.models import Branch, Deposit
+
+
+def month(value: str) -> date:
+    return date.fromisoformat(f'{value}-01')
+
+
+class Command(BaseCommand):
+    help = 'Accrue monthly interest on member deposits, in month order; resumable, and never accrues a period twice'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', type=month, default=None,
+                            help='Last month to accrue (YYYY-MM), default the last completed month; '
+                                 'months skipped since the last run are accrued first')
+        parser.add_argument('--deposit', type=int, default=None, help='Only this deposit product')
+        parser.add_argument('--branch', type=int, default=None,
+                            help='Only deposit products of this branch and its sub-branches')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Member deposits per transaction')
+        parser.add_argument('--workers', type=int, default=4, help='Deposit products accrued in parallel')
+
+    def handle(self, *args, **options):
+        period = options['period'] or (timezone.localdate().replace(day=1) - timedelta(days=1)).replace(day=1)
+
+        deposits = Deposit.objects.filter(is_active=True, interest_rate__gt=0).order_by('pk')
+        if options['deposit'] is not None:
+            deposits = deposits.filter(pk=options['deposit'])
+        if options['branch'] is not None:
+            try:
+                deposits = deposits.in_branch_subtree(Branch.objects.get(pk=options['branch']))
+            except Branch.DoesNotExist:
+                raise CommandError(f"Branch {options['branch']} does not exist")
+
+        def accrue(deposit):
+            try:
+                return accrue_deposit(deposit, period, options['chunk_size'])
+            finally:
+                if options['workers'] > 1:
+                    connections.close_all()
+
+        deposits = list(deposits)
+        try:
+            if options['workers'] > 1:
+                with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                    checkpoints = list(executor.map(accrue, deposits))
+            else:
+                checkpoints = list(map(accrue, deposits))
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for checkpoint in checkpoints:
+            self.stdout.write(self.style.SUCCESS(
+                f'{checkpoint.deposit}: {checkpoint.interest_total} interest on '
+                f'{checkpoint.accrued_count} member deposits for {period:%Y-%m}'
+            ))
@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from community.amortization import accrue_loans
+from community.models import Branch
+
+
+class Command(BaseCommand):
+    help = 'Update accrued principal and interest of active member loans from their amortization schedules (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', type=date.fromisoformat, default=None,
+                            help='Accrue installments due on or before this date (YYYY-MM-DD), default today')
+        parser.add_argument('--branch', type=int, default=None, help='Only loans of this branch and its sub-branches')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Loans fetched and written per batch')
+
+    def handle(self, *args, **options):
+        as_of = options['as_of'] or timezone.localdate()
+
+        branch = None
+        if options['branch'] is not None:
+            try:
+                branch = Branch.objects.get(pk=options['branch'])
+            except Branch.DoesNotExist:
+                raise CommandError(f"Branch {options['branch']} does not exist")
+
+        examined, updated = accrue_loans(as_of, branch, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Accrued {updated} of {examined} member loans as of {as_of}'))
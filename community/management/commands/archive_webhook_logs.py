@@ -0,0 +1,36 @@
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from community.webhook_retention import (
+    archive_webhook_logs, drop_empty_partitions, is_partitioned, purge_webhook_events
+)
+
+
+class Command(BaseCommand):
+    help = 'Archive old webhook delivery logs to compressed JSONL files and delete them from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.WEBHOOK_LOG_RETENTION_DAYS,
+                            help='Archive logs older than this many days')
+        parser.add_argument('--output-dir', type=str, default=str(settings.WEBHOOK_ARCHIVE_DIR),
+                            help='Directory the .jsonl.gz archive is written to')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows archived and deleted per batch')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        archived, path = archive_webhook_logs(cutoff, Path(options['output_dir']), options['batch_size'])
+        if archived:
+            self.stdout.write(self.style.SUCCESS(f'Archived {archived} webhook logs to {path}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'No webhook logs older than {cutoff:%Y-%m-%d} to archive'))
+
+        purged = purge_webhook_events(cutoff, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {purged} dispatched webhook events'))
+
+        if is_partitioned():
+            for name in drop_empty_partitions(cutoff):
+                self.stdout.write(self.style.SUCCESS(f'Dropped empty partition {name}'))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from community.webhooks import WebhookManager
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued webhook events from the outbox to subscribed endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Events to dispatch per pass')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+
+        if options['once']:
+            total = 0
+            while True:
+                dispatched = WebhookManager.dispatch_pending(batch_size)
+                total += dispatched
+                if dispatched < batch_size:
+                    break
+            self.stdout.write(self.style.SUCCESS(f'Dispatched {total} webhook events'))
+            return
+
+        self.stdout.write(self.style.SUCCESS('Webhook dispatcher started'))
+        try:
+            while True:
+                # A long-running loop gets no request_started signal; drop connections
+                # the database closed or that outlived CONN_MAX_AGE before each pass
+                close_old_connections()
+                if WebhookManager.dispatch_pending(batch_size) < batch_size:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Webhook dispatcher stopped'))
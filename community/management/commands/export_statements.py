@@ -0,0 +1,36 @@
+import os
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from community.models import Branch
+from community.statements import FORMATS, export_branch_statements
+
+
+class Command(BaseCommand):
+    help = 'Render the statements of all members of a branch and its sub-branches into a zip file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('branch', type=int, help='Branch whose members to export')
+        parser.add_argument('--from', dest='start', type=date.fromisoformat, default=None,
+                            help='First day (YYYY-MM-DD), default the whole history')
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, default=None,
+                            help='Last day (YYYY-MM-DD), default today')
+        parser.add_argument('--format', dest='fmt', choices=FORMATS, default='pdf')
+        parser.add_argument('--output', default=None, help='Zip file to write, default statements-<branch>-<to>.zip')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes rendering statements; 1 renders inline')
+
+    def handle(self, *args, **options):
+        try:
+            branch = Branch.objects.get(pk=options['branch'])
+        except Branch.DoesNotExist:
+            raise CommandError(f"Branch {options['branch']} does not exist")
+
+        end = options['end'] or timezone.localdate()
+        if options['start'] and options['start'] > end:
+            raise CommandError('--from must not be after --to')
+        output = options['output'] or f'statements-{branch.pk}-{end}.zip'
+
+        count = export_branch_statements(branch, options['start'], end, options['fmt'], output, options['workers'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} statements to {output}'))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from community.search import extract_pending, reindex_all
+
+
+class Command(BaseCommand):
+    help = 'Extract the text of uploaded documents into the site search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Documents to extract per pass')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when no document is waiting')
+        parser.add_argument('--once', action='store_true', help='Extract waiting documents once and exit')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='First index every minute, announcement, event and document again')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['rebuild']:
+            self.stdout.write(self.style.SUCCESS(f'Indexed {reindex_all()} items'))
+
+        if options['once']:
+            total = 0
+            while True:
+                extracted = extract_pending(batch_size)
+                total += extracted
+                if extracted < batch_size:
+                    break
+            self.stdout.write(self.style.SUCCESS(f'Extracted the text of {total} documents'))
+            return
+
+        self.stdout.write(self.style.SUCCESS('Document indexer started'))
+        try:
+            while True:
+                close_old_connections()
+                if extract_pending(batch_size) < batch_size:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Document indexer stopped'))
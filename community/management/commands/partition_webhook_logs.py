@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from community.webhook_retention import convert_to_partitioned, ensure_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = ('Partition the webhook log table by month (PostgreSQL only). '
+            'Run with --convert once, then regularly (e.g. daily) to create upcoming partitions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Rebuild the existing table as a partitioned table')
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Months of partitions to keep created ahead of time')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Webhook log partitioning requires PostgreSQL')
+
+        if not is_partitioned():
+            if not options['convert']:
+                raise CommandError('The webhook log table is not partitioned yet; run with --convert')
+            convert_to_partitioned(options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS('Converted the webhook log table to monthly partitions'))
+            return
+
+        created = ensure_partitions(timezone.now().date(), options['months_ahead'])
+        for name in created:
+            self.stdout.write(self.style.SUCCESS(f'Created partition {name}'))
+        if not created:
+            self.stdout.write('All partitions already exist')
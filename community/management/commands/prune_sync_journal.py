@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from community.sync import prune
+
+
+class Command(BaseCommand):
+    help = 'Delete old rows of the /sync/ change journal; clients with older tokens must pull everything again'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SYNC_JOURNAL_RETENTION_DAYS,
+                            help='Delete journal rows older than this many days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows deleted per batch')
+
+    def handle(self, *args, **options):
+        deleted = prune(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} sync journal rows'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from community.models import Member
+from community.search import refresh_member_search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the member directory search columns, e.g. after bulk imports or updates that bypass signals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Members read and written per batch')
+
+    def handle(self, *args, **options):
+        refreshed = refresh_member_search(Member.objects.all(), options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed search of {refreshed} members'))
@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from community.finances import recompute_finances
+from community.models import Member
+
+
+class Command(BaseCommand):
+    help = ('Rebuild every MemberFinances total from deposits, payments and the principal outstanding on loans '
+            'to repair drift')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Members recomputed per transaction')
+        parser.add_argument('--workers', type=int, default=4, help='Chunks recomputed in parallel')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        member_ids = list(Member.objects.order_by('pk').values_list('pk', flat=True))
+        chunks = [member_ids[i:i + chunk_size] for i in range(0, len(member_ids), chunk_size)]
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                recomputed = sum(executor.map(self._recompute_chunk, chunks))
+        else:
+            recomputed = sum(map(recompute_finances, chunks))
+
+        self.stdout.write(self.style.SUCCESS(f'Recomputed finances for {recomputed} members'))
+
+    @staticmethod
+    def _recompute_chunk(member_ids):
+        # Each worker thread has its own database connection; close it when done
+        try:
+            return recompute_finances(member_ids)
+        finally:
+            connections.close_all()
@@ -0,0 +1,76 @@
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from community.webhook_replay import EVENT_SOURCES, backfill, replay_logs, select_logs
+from community.webhooks import WebhookEndpoint
+
+
+class Command(BaseCommand):
+    help = 'Redeliver logged webhook deliveries, or backfill an endpoint with *.created events for existing rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', type=int, help='WebhookEndpoint id')
+        parser.add_argument('--event-type', nargs='+', help="Event types to replay; 'member.*' prefixes allowed")
+        parser.add_argument('--since', type=str, help='Replay deliveries created at or after this date/time')
+        parser.add_argument('--until', type=str, help='Replay deliveries created before this date/time')
+        parser.add_argument('--all', action='store_true', help='Replay delivered as well as failed deliveries')
+        parser.add_argument('--backfill', choices=sorted(EVENT_SOURCES),
+                            help='Send a <source>.created event for every existing row to --endpoint')
+        parser.add_argument('--start-after', type=int,
+                            help='With --backfill, only rows with a greater id; resumes an interrupted backfill')
+        parser.add_argument('--rate', type=float, default=settings.WEBHOOK_REPLAY_RATE,
+                            help='Maximum deliveries per second (0 for no limit)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows read and queued per chunk')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many deliveries match')
+
+    def handle(self, *args, **options):
+        endpoint = None
+        if options['endpoint']:
+            try:
+                endpoint = WebhookEndpoint.objects.get(pk=options['endpoint'])
+            except WebhookEndpoint.DoesNotExist:
+                raise CommandError(f"Webhook endpoint {options['endpoint']} does not exist")
+
+        rate = options['rate'] or None
+
+        if options['backfill']:
+            if endpoint is None:
+                raise CommandError('--backfill requires --endpoint')
+            queued = backfill(options['backfill'], endpoint, rate, options['chunk_size'], options['start_after'],
+                              on_chunk=lambda pk: self.stdout.write(f'Queued up to id {pk}'))
+            self.stdout.write(self.style.SUCCESS(
+                f"Queued {queued} {options['backfill']}.created events for {endpoint.url}"
+            ))
+            return
+
+        logs = select_logs(
+            endpoint=endpoint,
+            event_types=options['event_type'],
+            since=self._parse_moment(options['since']),
+            until=self._parse_moment(options['until']),
+            failed_only=not options['all']
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f'{logs.count()} deliveries would be replayed')
+            return
+
+        queued = replay_logs(logs, rate, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Queued {queued} deliveries for replay'))
+
+    def _parse_moment(self, value):
+        if not value:
+            return None
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f'Invalid date/time: {value}')
+            # Start of that day in the current time zone
+            moment = datetime.combine(day, time.min)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
@@ -9,6 +9,9 @@ class Command(BaseCommand):
         parser.add_argument('--url', type=str, help='Webhook URL')
         parser.add_argument('--events', nargs='+', help='Event types to subscribe to')
         parser.add_argument('--secret', type=str, help='Webhook secret')
+        parser.add_argument('--coalesce-window', type=int, default=0,
+                            help='Seconds to merge repeated events for the same object')
+        parser.add_argument('--batch-size', type=int, default=1, help='Maximum events per POST')
 
     def handle(self, *args, **options):
         if not options['url']:
@@ -25,7 +28,9 @@ class Command(BaseCommand):
             url=options['url'],
             defaults={
                 'event_types': events,
-                'secret': options.get('secret', '')
+                'secret': options.get('secret') or '',
+                'coalesce_window': options['coalesce_window'],
+                'batch_size': options['batch_size'],
             }
         )
 
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0008_webhookevent_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhooklog',
+            name='duration_ms',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
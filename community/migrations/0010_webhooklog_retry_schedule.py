@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    # Logs written before retries existed were single, already-finished attempts
+    WebhookLog = apps.get_model('community', 'WebhookLog')
+    WebhookLog.objects.filter(success=True).update(status='delivered')
+    WebhookLog.objects.filter(success=False).update(status='failed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0009_webhooklog_duration_ms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhooklog',
+            name='event',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='community.webhookevent'),
+        ),
+        migrations.AddField(
+            model_name='webhooklog',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhooklog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('delivered', 'Delivered'), ('retried', 'Failed, retry scheduled'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='webhooklog',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='webhook_log_due_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0010_webhooklog_retry_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookendpoint',
+            name='circuit_opened_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhookendpoint',
+            name='circuit_state',
+            field=models.CharField(choices=[('closed', 'Closed'), ('open', 'Open'), ('half_open', 'Half-open')], default='closed', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='webhookendpoint',
+            name='consecutive_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='webhooklog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('delivered', 'Delivered'), ('retried', 'Failed, retry scheduled'), ('failed', 'Failed'), ('parked', 'Parked, circuit open')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='webhooklog',
+            index=models.Index(condition=models.Q(('status', 'parked')), fields=['endpoint'], name='webhook_log_parked_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0011_webhookendpoint_circuit_breaker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookendpoint',
+            name='batch_size',
+            field=models.PositiveIntegerField(default=1, help_text='Maximum events per POST; above 1, events are sent as a JSON array'),
+        ),
+        migrations.AddField(
+            model_name='webhookendpoint',
+            name='coalesce_window',
+            field=models.PositiveIntegerField(default=0, help_text='Seconds to hold events so repeated changes to one object are merged; 0 disables'),
+        ),
+        migrations.AddField(
+            model_name='webhooklog',
+            name='coalesce_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='webhooklog',
+            index=models.Index(condition=models.Q(('coalesce_key__isnull', False)), fields=['endpoint', 'coalesce_key'], name='webhook_log_coalesce_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0012_webhook_coalescing_and_batching'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhooklog',
+            index=models.Index(fields=['created_at'], name='webhook_log_created_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:39
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Branch = apps.get_model('community', 'Branch')
+    branches = list(Branch.objects.only('branch_id', 'branch_parent_id'))
+    parents = {branch.branch_id: branch.branch_parent_id for branch in branches}
+    paths = {}
+
+    def path_of(branch_id, seen=()):
+        if branch_id not in paths:
+            parent_id = parents.get(branch_id)
+            # Treat dangling or cyclic parents as roots
+            if parent_id is None or parent_id not in parents or parent_id in seen:
+                paths[branch_id] = f"/{branch_id}/"
+            else:
+                paths[branch_id] = f"{path_of(parent_id, seen + (branch_id,))}{branch_id}/"
+        return paths[branch_id]
+
+    for branch in branches:
+        branch.path = path_of(branch.branch_id)
+    Branch.objects.bulk_update(branches, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0013_webhooklog_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='branch',
+            index=models.Index(fields=['path'], name='branch_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
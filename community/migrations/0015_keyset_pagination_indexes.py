@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0014_branch_materialized_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['-start_date', '-announcement_id'], name='announcement_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['-start_time', '-event_id'], name='event_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['-created_at', '-feedback_id'], name='feedback_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='memberpayment',
+            index=models.Index(fields=['-created_at', '-payment_id'], name='payment_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', '-created_at', '-id'], name='message_sender_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', '-created_at', '-id'], name='message_receiver_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_sequences(apps, schema_editor):
+    # Number existing entries per account in the order they were recorded
+    for model_name, account_field in [('DepositPayment', 'deposit_id'), ('LoanRefund', 'member_loan_id')]:
+        model = apps.get_model('community', model_name)
+        entries = list(model.objects.filter(**{f"{account_field}__isnull": False}).order_by(account_field, 'pk'))
+        sequences = {}
+        for entry in entries:
+            account = getattr(entry, account_field)
+            sequences[account] = sequences.get(account, 0) + 1
+            entry.sequence = sequences[account]
+        model.objects.bulk_update(entries, ['sequence'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0016_loanrefund_member_loan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='depositpayment',
+            name='posted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='depositpayment',
+            name='sequence',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='loanrefund',
+            name='posted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='loanrefund',
+            name='sequence',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_sequences, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='depositpayment',
+            name='sequence',
+            field=models.PositiveIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='depositpayment',
+            name='new_balance',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=15),
+        ),
+        migrations.AlterField(
+            model_name='depositpayment',
+            name='previous_balance',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=15),
+        ),
+        migrations.AlterField(
+            model_name='loanrefund',
+            name='new_balance',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=15),
+        ),
+        migrations.AlterField(
+            model_name='loanrefund',
+            name='previous_balance',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=15),
+        ),
+        migrations.AddIndex(
+            model_name='depositpayment',
+            index=models.Index(fields=['deposit', 'posted_at', 'sequence'], name='deposit_payment_asof_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanrefund',
+            index=models.Index(fields=['member_loan', 'posted_at', 'sequence'], name='loan_refund_asof_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='depositpayment',
+            constraint=models.UniqueConstraint(fields=('deposit', 'sequence'), name='deposit_payment_sequence_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='loanrefund',
+            constraint=models.UniqueConstraint(fields=('member_loan', 'sequence'), name='loan_refund_sequence_uniq'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0018_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='interest_method',
+            field=models.CharField(choices=[('flat', 'Flat rate'), ('reducing', 'Reducing balance')], default='flat', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='term_months',
+            field=models.PositiveIntegerField(default=12),
+        ),
+        migrations.AddField(
+            model_name='memberloan',
+            name='accrued_interest',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0019_loan_amortization_terms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deposit',
+            name='interest_rate',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=6),
+        ),
+        migrations.CreateModel(
+            name='DepositAccrualCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('last_member_deposit', models.BigIntegerField(default=0)),
+                ('accrued_count', models.PositiveIntegerField(default=0)),
+                ('interest_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('deposit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accrual_checkpoints', to='community.deposit')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('deposit', 'period'), name='deposit_accrual_period_uniq')],
+            },
+        ),
+    ]
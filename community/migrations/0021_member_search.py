@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:03
+
+import re
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+# GIN indexes are PostgreSQL-only, so they are created here rather than declared in Member.Meta.
+# pg_trgm is a contrib module; without it search falls back to full text only
+SEARCH_INDEXES = [
+    ('member_search_document_idx', 'USING gin (search_document)'),
+    ('member_search_text_trgm_idx', 'USING gin (search_text gin_trgm_ops)'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+        has_trigram = cursor.fetchone()[0]
+    if has_trigram:
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    table = apps.get_model('community', 'Member')._meta.db_table
+    for name, definition in SEARCH_INDEXES:
+        if has_trigram or 'gin_trgm_ops' not in definition:
+            schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" {definition}')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def phone_words(phone_number):
+    groups = re.findall(r'\d+', phone_number or '')
+    return ' '.join(groups + [''.join(groups)]) if groups else ''
+
+
+def backfill_search(apps, schema_editor):
+    Member = apps.get_model('community', 'Member')
+
+    if schema_editor.connection.vendor != 'postgresql':
+        members = list(Member.objects.values_list(
+            'pk', 'user__username', 'user__first_name', 'user__last_name', 'phone_number', 'branch__branch_name'
+        ))
+        Member.objects.bulk_update([
+            Member(pk=pk, search_text=' '.join([
+                ' '.join(part for part in (username, first_name, last_name) if part),
+                phone_words(phone_number),
+                branch_name or '',
+            ]).lower())
+            for pk, username, first_name, last_name, phone_number, branch_name in members
+        ], ['search_text'], batch_size=500)
+        return
+
+    # Same columns as community.search.refresh_member_search, in a single statement
+    member = Member._meta.db_table
+    user = Member._meta.get_field('user').related_model._meta.db_table
+    branch = Member._meta.get_field('branch').related_model._meta.db_table
+    schema_editor.execute(
+        f'UPDATE "{member}" SET '
+        f"search_text = lower(concat_ws(' ', v.name, v.phone, v.branch)), "
+        f"search_document = setweight(to_tsvector('simple', v.name), 'A') "
+        f"|| setweight(to_tsvector('simple', v.phone), 'B') "
+        f"|| setweight(to_tsvector('simple', v.branch), 'C') "
+        f"FROM (SELECT m.id, concat_ws(' ', nullif(u.username, ''), nullif(u.first_name, ''), "
+        f"nullif(u.last_name, '')) AS name, "
+        rf"trim(concat_ws(' ', trim(regexp_replace(coalesce(m.phone_number, ''), '\D+', ' ', 'g')), "
+        rf"regexp_replace(coalesce(m.phone_number, ''), '\D', '', 'g'))) AS phone, "
+        f"coalesce(b.branch_name, '') AS branch "
+        f'FROM "{member}" m JOIN "{user}" u ON u.id = m.user_id '
+        f'LEFT JOIN "{branch}" b ON b.branch_id = m.branch_id) AS v '
+        f'WHERE "{member}".id = v.id'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0020_deposit_interest_accrual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='search_text',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
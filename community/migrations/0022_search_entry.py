@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:17
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_document_index(apps, schema_editor):
+    # GIN is PostgreSQL-only, so the index is not declared in SearchEntry.Meta
+    if schema_editor.connection.vendor == 'postgresql':
+        table = apps.get_model('community', 'SearchEntry')._meta.db_table
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS search_entry_document_idx ON "{table}" USING gin (document)')
+
+
+def drop_document_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS search_entry_document_idx')
+
+
+def backfill_entries(apps, schema_editor):
+    SearchEntry = apps.get_model('community', 'SearchEntry')
+    sources = [
+        ('announcement', apps.get_model('community', 'Announcement'),
+         lambda item: (item.title, item.content, item.branch_id)),
+        ('event', apps.get_model('community', 'Event'), lambda item: (item.title, item.description, item.branch_id)),
+        ('minute', apps.get_model('community', 'Minute'),
+         lambda item: (f"{item.venue}, {item.meeting_date}", item.content, None)),
+        # Document text is extracted later by index_documents
+        ('document', apps.get_model('community', 'Document'), lambda item: (item.file_name, '', item.branch_id)),
+    ]
+    for kind, model, fields in sources:
+        entries = []
+        for item in model.objects.iterator(chunk_size=1000):
+            title, body, branch_id = fields(item)
+            entries.append(SearchEntry(kind=kind, object_id=item.pk, title=title[:255], body=body[:500_000],
+                                       branch_id=branch_id, needs_extraction=kind == 'document'))
+        SearchEntry.objects.bulk_create(entries, batch_size=1000)
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'UPDATE "{SearchEntry._meta.db_table}" SET document = '
+            f"setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0021_member_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('announcement', 'Announcement'), ('event', 'Event'), ('minute', 'Minute'), ('document', 'Document')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('document', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+                ('needs_extraction', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='community.branch')),
+            ],
+            options={
+                'verbose_name_plural': 'Search entries',
+                'indexes': [models.Index(condition=models.Q(('needs_extraction', True)), fields=['id'], name='search_entry_extraction_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='search_entry_source_uniq')],
+            },
+        ),
+        migrations.RunPython(create_document_index, drop_document_index),
+        migrations.RunPython(backfill_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0022_search_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('transaction_id', models.BigIntegerField(default=0)),
+                ('model', models.CharField(max_length=32)),
+                ('object_id', models.CharField(max_length=64)),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=8)),
+                ('audience_branch', models.BigIntegerField(blank=True, null=True)),
+                ('audience_user', models.BigIntegerField(blank=True, null=True)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['transaction_id', 'id'], name='sync_change_order_idx'), models.Index(fields=['model', 'object_id'], name='sync_change_object_idx'), models.Index(fields=['changed_at'], name='sync_change_age_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0023_sync_change'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['search_text', 'id'], name='member_search_order_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:12
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def fold_refunds_into_principal_paid(apps, schema_editor):
+    # Refunds posted so far left principal_paid alone; it is now the one record of repayments
+    MemberLoan = apps.get_model('community', 'MemberLoan')
+    LoanRefund = apps.get_model('community', 'LoanRefund')
+    refunded = LoanRefund.objects.filter(member_loan__isnull=False).order_by().values('member_loan_id').annotate(
+        amount=Sum('deposit_amount'))
+    loans = []
+    for row in refunded:
+        loan = MemberLoan.objects.get(pk=row['member_loan_id'])
+        loan.principal_paid += row['amount']
+        loans.append(loan)
+    MemberLoan.objects.bulk_update(loans, ['principal_paid'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0024_member_search_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_refunds_into_principal_paid, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,265 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import response_cache
+from .idempotency import IdempotencyKey
+
+
+class RelatedFieldsMixin:
+    """
+    Applies select_related/prefetch_related declared on the viewset.
+
+    List the relations the serializer reads, so a page costs a fixed number of
+    queries instead of one per row and relation:
+
+        select_related_fields = ['created_by', 'updated_by']
+        prefetch_related_fields = ['attachments']
+    """
+    select_related_fields = []
+    prefetch_related_fields = []
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.select_related_fields:
+            queryset = queryset.select_related(*self.select_related_fields)
+        if self.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*self.prefetch_related_fields)
+        return queryset
+
+
+class AtomicWriteMixin:
+    """
+    Runs create, update and destroy in one transaction.
+
+    The row written by the handler and the WebhookEvent, sync journal row and
+    cache invalidation that its WebhookManager.trigger_webhook call produces
+    then commit together, or not at all if the request fails half way.
+    """
+
+    def create(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().create(request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().update(request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().destroy(request, *args, **kwargs)
+
+
+class IdempotentCreateMixin:
+    """
+    Honours an `Idempotency-Key` header on create (POST to the list URL).
+
+    The first request with a key runs normally and its response is stored in
+    the same transaction as the write it made. A retry with the same key gets
+    the stored response back, costing one lookup on the (user, key) index,
+    without running the handler or triggering webhooks again. A retry that
+    arrives while the first request is still running waits for it to commit.
+    Reusing a key for a different request is rejected with 422.
+    """
+    idempotency_header = 'Idempotency-Key'
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(self.idempotency_header)
+        if not key:
+            return super().create(request, *args, **kwargs)
+
+        user = request.user if request.user.is_authenticated else None
+        fingerprint = IdempotencyKey.fingerprint_for(request.method, request.path, request.data)
+
+        stored = IdempotencyKey.objects.filter(user=user, key=key, expires_at__gt=timezone.now()).first()
+        if stored is None:
+            with transaction.atomic():
+                IdempotencyKey.objects.filter(user=user, key=key, expires_at__lte=timezone.now()).delete()
+                try:
+                    # Blocks while a concurrent request holding this key is uncommitted
+                    with transaction.atomic():
+                        claimed = IdempotencyKey.objects.create(
+                            user=user, key=key, fingerprint=fingerprint, expires_at=IdempotencyKey.expiry()
+                        )
+                except IntegrityError:
+                    claimed = None
+
+                if claimed is not None:
+                    response = super().create(request, *args, **kwargs)
+                    claimed.status_code, claimed.response = response.status_code, response.data
+                    claimed.save(update_fields=['status_code', 'response'])
+                    return response
+
+            stored = IdempotencyKey.objects.get(user=user, key=key)
+
+        if stored.fingerprint != fingerprint:
+            return Response({'error': f'{self.idempotency_header} was already used for a different request'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(stored.response, status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+class ResponseCacheMixin:
+    """
+    Caches the data of list and retrieve responses in the RESPONSE_CACHE_ALIAS cache.
+
+    Responses are keyed on the full request URL, query parameters included, and
+    on the user scope: with `cache_scope = 'shared'` every user gets the same
+    cached response, otherwise each user has their own. Entries are dropped, after
+    commit, whenever WebhookManager.trigger_webhook reports a change to the
+    viewset's model: a change drops every list response and the detail responses
+    of the changed object only. Set `cache_per_object = False` when a detail
+    response shows other objects of the model too, so that any change drops it.
+
+    Every cached response carries `X-Cache: HIT` or `X-Cache: MISS`.
+    """
+    cache_scope = 'user'
+    cache_per_object = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if getattr(cls, 'queryset', None) is not None:
+            response_cache.CACHED_MODELS.add(cls.queryset.model)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def get_cache_scope(self, request) -> str:
+        return 'shared' if self.cache_scope == 'shared' else f'user:{request.user.pk}'
+
+    def get_cache_key(self, request, name: str, **kwargs):
+        """Key of the cached `name` for this request, or None if it must not be cached"""
+        if not settings.RESPONSE_CACHE_TIMEOUT:
+            return None
+        model = self.queryset.model
+        pk = kwargs.get(self.lookup_url_kwarg or self.lookup_field) if self.cache_per_object else None
+        if pk is not None:
+            try:
+                canonical = str(model._meta.pk.to_python(pk))
+            except ValidationError:
+                canonical = None
+            if canonical != pk:
+                # '05' would be cached apart from the '5' that invalidation knows about
+                return None
+        return response_cache.response_key(model._meta.label_lower, name, request.build_absolute_uri(),
+                                           self.get_cache_scope(request), pk)
+
+    def cached_value(self, request, name: str, compute, **kwargs):
+        """Return the cached `name` for this request, computing and caching it on a miss"""
+        key = self.get_cache_key(request, name, **kwargs)
+        if key is None:
+            return compute()
+        cache = response_cache.get_cache()
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, settings.RESPONSE_CACHE_TIMEOUT)
+        return value
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        """
+        Serve `handler(request, *args, **kwargs)` from the cache, calling and caching it on a miss
+
+        Only 200 responses are cached.
+        """
+        name = f'{self.basename}.{self.action}'
+        key = self.get_cache_key(request, name, **kwargs)
+        if key is None:
+            return handler(request, *args, **kwargs)
+
+        cache = response_cache.get_cache()
+        data = cache.get(key)
+        if data is not None:
+            response_cache.record(name, hit=True)
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        response = handler(request, *args, **kwargs)
+        response_cache.record(name, hit=False)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Strong ETag and Last-Modified validators on list and retrieve responses.
+
+    The validators come from one aggregate over the queryset:
+    MAX(last_modified_field), COUNT and MAX(pk), so a client that sends back a
+    current `If-None-Match` gets 304 Not Modified without the page being
+    queried or serialized. Lists aggregate the queryset before filter_queryset(),
+    so a 304 does not pay for filtering either, e.g. the `?branch_subtree=`
+    branch lookup; any change to a row changes the aggregate whatever the
+    filters. The model's response cache generation is part of the state too: it
+    also changes when the branch tree does, which reshapes `?branch_subtree=`
+    lists without touching their rows. On viewsets with ResponseCacheMixin the
+    validators are cached alongside the responses. With
+    `last_modified_field = None` the generation alone is used, at no query cost.
+
+    `If-Modified-Since` is honoured on detail responses only: a deleted row
+    leaves a list's newest timestamp unchanged, so lists revalidate by ETag.
+    """
+    last_modified_field = 'updated_at'
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.get_queryset(), super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        value = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: value})
+        except (ValueError, TypeError, ValidationError):
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(request, queryset, super().retrieve, *args, **kwargs)
+
+    def get_validators(self, queryset):
+        """
+        Returns:
+            (state, last modified datetime or None), where state changes whenever
+            the response may have
+        """
+        if self.last_modified_field is None:
+            return response_cache.generation(queryset.model), None
+
+        aggregates = queryset.aggregate(last_modified=Max(self.last_modified_field), count=Count('pk'),
+                                        last_pk=Max('pk'))
+        state = (sorted(aggregates.items()), response_cache.generation(queryset.model))
+        return repr(state), aggregates['last_modified']
+
+    def conditional_response(self, request, queryset, handler, *args, **kwargs):
+        if isinstance(self, ResponseCacheMixin):
+            # Cached under the same versions as the response, so a cache hit costs no query at all
+            state, last_modified = self.cached_value(request, f'{self.basename}.{self.action}.validators',
+                                                     lambda: self.get_validators(queryset), **kwargs)
+        else:
+            state, last_modified = self.get_validators(queryset)
+        # Different representations, and different users' views, of the same data must not share an ETag
+        digest = hashlib.sha1(
+            f'{request.build_absolute_uri()}\n{request.accepted_media_type}\n{request.user.pk}\n{state}'.encode()
+        ).hexdigest()
+        etag = f'"{digest}"'
+        timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+
+        not_modified = get_conditional_response(request._request, etag=etag,
+                                                last_modified=timestamp if self.action == 'retrieve' else None)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
@@ -1,5 +1,40 @@
+from collections import defaultdict
+from decimal import Decimal
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+
+class BranchQuerySet(models.QuerySet):
+    def descendants_of(self, branch, include_self=True):
+        """Branches in the subtree rooted at `branch`, as a single prefix match on the indexed path"""
+        queryset = self.filter(path__startswith=branch.path)
+        return queryset if include_self else queryset.exclude(pk=branch.pk)
+
+    def ancestors_of(self, branch, include_self=False):
+        """Branches on the path from the root down to `branch`"""
+        ids = [int(pk) for pk in branch.path.strip('/').split('/') if pk]
+        if not include_self:
+            ids = ids[:-1]
+        return self.filter(pk__in=ids)
+
+
+class BranchSubtreeQuerySet(models.QuerySet):
+    """QuerySet for models that belong to a branch, filterable by branch subtree"""
+
+    def in_branch_subtree(self, branch):
+        """Rows whose branch is `branch` or one of its sub-branches"""
+        branch_field = next(
+            field.name for field in self.model._meta.fields
+            if field.is_relation and field.related_model is Branch
+        )
+        return self.filter(**{f"{branch_field}__path__startswith": branch.path})
 
 
 class Branch(models.Model):
@@ -9,13 +44,53 @@ class Branch(models.Model):
     branch_parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='child_branches')
     branch_logo = models.ImageField(upload_to='branch_logos/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Materialized path of ids from the root, e.g. '/1/4/9/'; maintained by save()
+    path = models.CharField(max_length=255, default='', editable=False)
+
+    objects = BranchQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = "Branches"
+        indexes = [
+            # pattern_ops lets PostgreSQL use the index for LIKE 'prefix%'
+            models.Index(fields=['path'], name='branch_path_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.branch_name
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            stored_path = Branch.objects.filter(pk=self.pk).values_list('path', flat=True).get()
+            parent_path = '/'
+            if self.branch_parent_id is not None:
+                parent_path = Branch.objects.filter(pk=self.branch_parent_id).values_list('path', flat=True).get()
+                if stored_path and parent_path.startswith(stored_path):
+                    raise ValueError("A branch cannot be moved under itself or one of its sub-branches")
+
+            self.path = f"{parent_path}{self.pk}/"
+            if self.path != stored_path:
+                Branch.objects.filter(pk=self.pk).update(path=self.path)
+                if stored_path:
+                    # Re-parenting moves the whole subtree
+                    Branch.objects.filter(path__startswith=stored_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(self.path), Substr('path', len(stored_path) + 1))
+                    )
+
+    def is_descendant_of(self, branch) -> bool:
+        return self.path.startswith(branch.path)
+
+
+@receiver(post_delete, sender=Branch)
+def promote_orphaned_branches(sender, instance, **kwargs):
+    """Sub-branches of a deleted branch become roots (branch_parent is SET_NULL); rebase their paths"""
+    if instance.path:
+        Branch.objects.filter(path__startswith=instance.path).update(
+            path=Concat(Value('/'), Substr('path', len(instance.path) + 1))
+        )
+
 
 class Member(models.Model):
     """
@@ -31,6 +106,18 @@ class Member(models.Model):
     status = models.CharField(max_length=50, default='active')
     bio = models.TextField(blank=True, null=True)
     profile_pic = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
+    # Directory search; maintained by community.search. On PostgreSQL both
+    # columns have GIN indexes (full text and trigram), created in migration 0021
+    search_text = models.TextField(default='', editable=False)
+    search_document = SearchVectorField(null=True, editable=False)
+
+    objects = BranchSubtreeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Order of short-prefix directory searches, see community.search.search_members
+            models.Index(fields=['search_text', 'id'], name='member_search_order_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} ({self.user.first_name} {self.user.last_name})"
@@ -46,6 +133,12 @@ class MemberMetadata(models.Model):
 
 
 class MemberFinances(models.Model):
+    """
+    Running totals for a member, kept up to date by FinancesContribution rows:
+    total_savings is the sum of deposits and payments, total_loans the principal
+    still outstanding on loans (loan_amount less principal_paid, which refunds
+    posted through the ledger add to). recompute_finances rebuilds them.
+    """
     user = models.OneToOneField(Member, on_delete=models.CASCADE, primary_key=True)
     total_savings = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     total_loans = models.DecimalField(max_digits=15, decimal_places=2, default=0)
@@ -55,6 +148,81 @@ class MemberFinances(models.Model):
     def __str__(self):
         return f"{self.user.username} - Savings: {self.total_savings}, Loans: {self.total_loans}"
 
+    @classmethod
+    def adjust(cls, member_id, deltas, create=True):
+        """
+        Add amounts to a member's totals, creating the row on first use
+
+        The UPDATE uses F() expressions and holds the row lock until the caller's
+        transaction ends, so concurrent adjustments queue up and none is lost.
+
+        Args:
+            member_id: Member whose totals change
+            deltas: Amount to add per total, e.g. {'total_savings': Decimal('50.00')}
+            create: Create the row if the member has none yet
+        """
+        values = {field: F(field) + amount for field, amount in deltas.items() if amount}
+        if member_id is None or not values:
+            return
+
+        if not cls.objects.filter(user_id=member_id).update(last_updated_at=timezone.now(), **values) and create:
+            cls.objects.get_or_create(user_id=member_id)
+            cls.objects.filter(user_id=member_id).update(last_updated_at=timezone.now(), **values)
+
+
+class FinancesContribution(models.Model):
+    """
+    A row that counts towards its member's MemberFinances totals.
+
+    Saving adds the difference between the row's new and previous contribution to
+    the totals; the row is locked while its previous state is read, so concurrent
+    edits of the same row cannot both apply a delta computed from one old value.
+    Deleting subtracts the contribution. Queryset update() and bulk_create()
+    bypass this; run recompute_finances after bulk changes.
+    """
+
+    class Meta:
+        abstract = True
+
+    def finances_contribution(self):
+        """
+        Abstract: every subclass must override this
+
+        Returns:
+            (member id, {MemberFinances total: amount this row adds to it})
+        """
+        raise NotImplementedError(f"{type(self).__name__} must define finances_contribution()")
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = type(self)._base_manager.select_for_update().filter(pk=self.pk).first()
+
+            super().save(*args, **kwargs)
+
+            changes = defaultdict(lambda: defaultdict(Decimal))
+            if previous is not None:
+                member_id, totals = previous.finances_contribution()
+                for field, amount in totals.items():
+                    changes[member_id][field] -= amount
+            member_id, totals = self.finances_contribution()
+            for field, amount in totals.items():
+                changes[member_id][field] += amount
+
+            for member_id, deltas in changes.items():
+                MemberFinances.adjust(member_id, deltas)
+
+
+@receiver(pre_delete)
+def subtract_finances_contribution(sender, instance, **kwargs):
+    # pre_delete runs for every object of a cascade before any row is gone, so a
+    # refund can still resolve its member even if its loan is deleted first
+    if isinstance(instance, FinancesContribution):
+        member_id, totals = instance.finances_contribution()
+        # Never create a row here: the member itself may be going in the same cascade
+        MemberFinances.adjust(member_id, {field: -amount for field, amount in totals.items()}, create=False)
+
 
 class Announcement(models.Model):
     """
@@ -71,8 +239,13 @@ class Announcement(models.Model):
     updated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='announcements_updated')
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BranchSubtreeQuerySet.as_manager()
+
     class Meta:
         ordering = ['-start_date'] # Order announcements by most recent first
+        indexes = [
+            models.Index(fields=['-start_date', '-announcement_id'], name='announcement_keyset_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -92,13 +265,18 @@ class Event(models.Model):
     updated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='events_updated')
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BranchSubtreeQuerySet.as_manager()
+
     def __str__(self):
         return f"Event {self.title} - {self.branch.branch_name}"
     class Meta:
         ordering = ['-start_time'] # Order announcements by most recent first
+        indexes = [
+            models.Index(fields=['-start_time', '-event_id'], name='event_keyset_idx'),
+        ]
 
 
-class MemberPayment(models.Model):
+class MemberPayment(FinancesContribution):
     payment_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(Member, on_delete=models.CASCADE)
     payment_amount = models.DecimalField(max_digits=15, decimal_places=2)
@@ -106,25 +284,36 @@ class MemberPayment(models.Model):
     created_by = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='created_payments')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-payment_id'], name='payment_keyset_idx'),
+        ]
+
     def __str__(self):
         return f"Payment {self.user.username} - {self.payment_id}"
 
+    def finances_contribution(self):
+        return self.user_id, {'total_savings': self.payment_amount}
+
 
 class Deposit(models.Model):
     deposit_id = models.AutoField(primary_key=True)
     branch = models.ForeignKey(Branch, on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
     min_amount = models.IntegerField()
+    interest_rate = models.DecimalField(max_digits=6, decimal_places=3, default=0)  # yearly, in percent
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_by = models.ForeignKey(Member, on_delete=models.SET_NULL, null=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BranchSubtreeQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
 
-class MemberDeposit(models.Model):
+class MemberDeposit(FinancesContribution):
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
     deposit = models.ForeignKey(Deposit, on_delete=models.CASCADE)
     total_deposit_amount = models.DecimalField(max_digits=15, decimal_places=2)
@@ -139,33 +328,83 @@ class MemberDeposit(models.Model):
     def __str__(self):
         return f"{self.member.username} - {self.deposit.deposit_name}"
 
+    def finances_contribution(self):
+        return self.member_id, {'total_savings': self.total_deposit_amount}
+
+
+class DepositAccrualCheckpoint(models.Model):
+    """
+    Progress of the interest accrual of one deposit product for one month.
+
+    Each chunk of member deposits is accrued in the same transaction that moves
+    last_member_deposit forward, so an interrupted run resumes where it stopped
+    and a completed period is never accrued twice.
+    """
+    deposit = models.ForeignKey(Deposit, on_delete=models.CASCADE, related_name='accrual_checkpoints')
+    period = models.DateField()  # first day of the month accrued
+    last_member_deposit = models.BigIntegerField(default=0)  # highest MemberDeposit id accrued so far
+    accrued_count = models.PositiveIntegerField(default=0)
+    interest_total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['deposit', 'period'], name='deposit_accrual_period_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.deposit} {self.period:%Y-%m} - {'Completed' if self.completed_at else 'In progress'}"
+
 
 class DepositPayment(models.Model):
+    """
+    Ledger entry on a deposit account. Post through community.ledger, which
+    assigns the sequence and balances; entries are never edited afterwards.
+    """
     payment_id = models.AutoField(primary_key=True)
     deposit = models.ForeignKey(Deposit, on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField(editable=False)
     deposit_amount = models.DecimalField(max_digits=15, decimal_places=2)
-    previous_balance = models.DecimalField(max_digits=15, decimal_places=2)
-    new_balance = models.DecimalField(max_digits=15, decimal_places=2)
+    previous_balance = models.DecimalField(max_digits=15, decimal_places=2, editable=False)
+    new_balance = models.DecimalField(max_digits=15, decimal_places=2, editable=False)
+    posted_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['deposit', 'sequence'], name='deposit_payment_sequence_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['deposit', 'posted_at', 'sequence'], name='deposit_payment_asof_idx'),
+        ]
 
     def __str__(self):
         return f"Payment {self.payment_id} - {self.deposit.deposit_name}"
 
 
 class Loan(models.Model):
+    class InterestMethod(models.TextChoices):
+        FLAT = 'flat', 'Flat rate'
+        REDUCING = 'reducing', 'Reducing balance'
+
     loan_id = models.AutoField(primary_key=True)
     loan_name = models.CharField(max_length=200)
     loan_branch = models.ForeignKey(Branch, on_delete=models.CASCADE)
-    interest_rate = models.FloatField()
+    interest_rate = models.FloatField()  # yearly, in percent
+    interest_method = models.CharField(max_length=10, choices=InterestMethod.choices, default=InterestMethod.FLAT)
+    term_months = models.PositiveIntegerField(default=12)
     is_active = models.BooleanField(default=True)
     status = models.CharField(max_length=100)  # e.g. active, closed, default
     updated_by = models.ForeignKey(Member, on_delete=models.SET_NULL, null=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BranchSubtreeQuerySet.as_manager()
+
     def __str__(self):
         return self.loan_name
 
 
-class MemberLoan(models.Model):
+class MemberLoan(FinancesContribution):
     user = models.ForeignKey(Member, on_delete=models.CASCADE)
     loan = models.ForeignKey(Loan, on_delete=models.CASCADE)
     loan_amount = models.DecimalField(max_digits=15, decimal_places=2)
@@ -174,6 +413,7 @@ class MemberLoan(models.Model):
     interest_paid = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     principal_paid = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     accrued_principal = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    accrued_interest = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     created_by = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='created_member_loans')
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -183,13 +423,35 @@ class MemberLoan(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.loan.loan_name}"
 
+    def finances_contribution(self):
+        return self.user_id, {'total_loans': self.loan_amount - self.principal_paid}
+
 
 class LoanRefund(models.Model):
+    """
+    Ledger entry on a member loan; the balances are the principal outstanding.
+    Post through community.ledger, which assigns the sequence and balances and
+    adds the amount to the loan's principal_paid. That field is what counts
+    towards MemberFinances, so refunds do not count a second time.
+    """
     payment_id = models.AutoField(primary_key=True)
     deposit = models.ForeignKey(Deposit, on_delete=models.CASCADE)
+    # The member loan being repaid; refunds without one are not attributed to a member
+    member_loan = models.ForeignKey(MemberLoan, on_delete=models.CASCADE, null=True, blank=True, related_name='refunds')
+    # Only refunds recorded before the ledger, without a member loan, lack a sequence
+    sequence = models.PositiveIntegerField(null=True, editable=False)
     deposit_amount = models.DecimalField(max_digits=15, decimal_places=2)
-    previous_balance = models.DecimalField(max_digits=15, decimal_places=2)
-    new_balance = models.DecimalField(max_digits=15, decimal_places=2)
+    previous_balance = models.DecimalField(max_digits=15, decimal_places=2, editable=False)
+    new_balance = models.DecimalField(max_digits=15, decimal_places=2, editable=False)
+    posted_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['member_loan', 'sequence'], name='loan_refund_sequence_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['member_loan', 'posted_at', 'sequence'], name='loan_refund_asof_idx'),
+        ]
 
     def __str__(self):
         return f"Refund {self.payment_id}"
@@ -235,6 +497,11 @@ class Feedback(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-feedback_id'], name='feedback_keyset_idx'),
+        ]
+
     def __str__(self):
         return f"Feedback {self.feedback_id} by {self.created_by.username}"
 
@@ -252,6 +519,11 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['-created_at'] # Order messages by most recent first
+        indexes = [
+            # Per-participant inbox/outbox pages
+            models.Index(fields=['sender', '-created_at', '-id'], name='message_sender_keyset_idx'),
+            models.Index(fields=['receiver', '-created_at', '-id'], name='message_receiver_keyset_idx'),
+        ]
 
     def __str__(self):
         return f"From {self.sender.username} to {self.receiver.username}: {self.subject or self.content[:50]}"
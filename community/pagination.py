@@ -0,0 +1,38 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination for large, append-heavy endpoints.
+
+    Pages are fetched with a WHERE on the ordering key instead of an OFFSET, so
+    deep pages cost the same as the first, and no COUNT(*) runs unless the
+    client asks for it with `?count=1`. Viewsets set `cursor_ordering`, ending
+    with the primary key as a tiebreaker, e.g. ('-created_at', '-id').
+
+    Clients may choose `?page_size=` up to `max_page_size`.
+    """
+    ordering = ('-created_at', '-pk')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            payload = {'count': self.count, **payload}
+        return Response(payload)
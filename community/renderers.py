@@ -0,0 +1,24 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class StatementRenderer(BaseRenderer):
+    """
+    Makes a statement format selectable with ?format= or the Accept header.
+
+    Statements are streamed by the view itself, so only error responses reach
+    render(); those are sent as JSON.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context['response']['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data, renderer_context=renderer_context)
+
+
+class CSVStatementRenderer(StatementRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFStatementRenderer(StatementRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
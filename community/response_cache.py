@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import threading
+import uuid
+from collections import Counter
+from typing import Dict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Branch, BranchSubtreeQuerySet
+from .webhooks import model_changed
+
+logger = logging.getLogger(__name__)
+
+# Models whose responses are cached, registered by ResponseCacheMixin
+CACHED_MODELS = set()
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _generation_key(label: str) -> str:
+    return f'rc:{label}:generation'
+
+
+def _object_key(label: str, pk) -> str:
+    return f'rc:{label}:object:{pk}'
+
+
+def version(key: str) -> str:
+    """
+    Current version token stored under a generation or object key
+
+    Versions are random tokens rather than counters: one evicted from the cache
+    is replaced by a fresh token, never by a value it may have had before, so an
+    eviction can only cause misses, not bring stale responses back.
+    """
+    cache = get_cache()
+    token = cache.get(key)
+    if token is None:
+        # add() keeps the token another process may have set meanwhile
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        token = cache.get(key)
+    return token
+
+
+def response_key(label: str, name: str, url: str, scope: str, pk=None) -> str:
+    """
+    Cache key of one response
+
+    List responses, and detail responses without a pk, carry the model's
+    generation, which every change to the model replaces. Detail responses with
+    a pk carry that object's version instead, so they survive changes to other
+    objects.
+
+    Args:
+        label: Model label, e.g. 'community.loan'
+        name: Viewset basename and action
+        url: Absolute request URL, query string included
+        scope: Whose view of the data this is, e.g. 'shared' or 'user:7'
+        pk: Object of a detail response
+    """
+    token = version(_object_key(label, pk) if pk is not None else _generation_key(label))
+    digest = hashlib.sha1(f'{scope}\n{url}'.encode()).hexdigest()
+    return f'rc:{label}:{name}:{token}:{digest}'
+
+
+def generation(model) -> str:
+    """Version token of a model, replaced whenever any of its objects changes"""
+    return version(_generation_key(model._meta.label_lower))
+
+
+def invalidate(model, pk=None):
+    """
+    Drop the cached list responses of a model and, given a pk, the detail responses of that object
+
+    Nothing is deleted: the versions in the keys change, and the old entries
+    expire unread.
+    """
+    label = model._meta.label_lower
+    keys = [_generation_key(label)] + ([_object_key(label, pk)] if pk is not None else [])
+    get_cache().set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+
+@receiver(model_changed)
+def invalidate_on_change(sender, instance, **kwargs):
+    if sender not in CACHED_MODELS:
+        return
+    # After commit, so a concurrent reader cannot re-cache the old row under the new version
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate(sender, pk))
+
+
+@receiver([post_save, post_delete], sender=Branch)
+def invalidate_on_branch_change(sender, instance, **kwargs):
+    """
+    Drop the cached lists of branches and of every model filterable by branch subtree
+
+    Moving or deleting a branch changes which rows a `?branch_subtree=` list
+    holds without any of those rows changing. Sent from Branch.save() itself,
+    so moves made outside the API count too.
+    """
+    pk = instance.pk
+    transaction.on_commit(lambda: _invalidate_branch_tree(pk))
+
+
+def _invalidate_branch_tree(pk):
+    models = [Branch] + [model for model in apps.get_app_config('community').get_models()
+                         if issubclass(model._default_manager._queryset_class, BranchSubtreeQuerySet)]
+    keys = [_generation_key(model._meta.label_lower) for model in models]
+    keys.append(_object_key(Branch._meta.label_lower, pk))
+    get_cache().set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+
+def record(name: str, hit: bool):
+    with _stats_lock:
+        _stats[name, 'hits' if hit else 'misses'] += 1
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Hits and misses of each cached endpoint in this process since it started"""
+    with _stats_lock:
+        stats = {}
+        for (name, outcome), count in sorted(_stats.items()):
+            stats.setdefault(name, {'hits': 0, 'misses': 0})[outcome] = count
+        return stats
+
@@ -0,0 +1,387 @@
+import html
+import logging
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import (
+    SearchHeadline, SearchQuery, SearchRank, SearchVector, SearchVectorField, TrigramWordSimilarity
+)
+from django.db import connection, connections, models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.filters import SearchFilter
+
+from .document_text import MAX_FILE_BYTES, extract_text
+from .models import Announcement, Branch, Document, Event, Member, Minute
+
+logger = logging.getLogger(__name__)
+
+# Words of a query; punctuation and underscores separate words, as in to_tsvector
+WORD = re.compile(r'[^\W_]+')
+MAX_QUERY_WORDS = 8
+# A single word this short is answered in directory order rather than ranked
+SHORT_PREFIX_CHARS = 3
+
+# User and Member fields the directory is searched on
+USER_FIELDS = {'username', 'first_name', 'last_name'}
+MEMBER_FIELDS = {'user', 'phone_number', 'branch'}
+
+
+@lru_cache(maxsize=None)
+def trigram_available(alias: str = 'default') -> bool:
+    """Whether pg_trgm is installed; it ships with PostgreSQL's contrib modules, which some servers lack"""
+    if connections[alias].vendor != 'postgresql':
+        return False
+    with connections[alias].cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        return cursor.fetchone()[0]
+
+
+def _phone_words(phone_number) -> str:
+    """Digit groups of a phone number and all its digits, so both '650123' and '237650' find '+237 650123456'"""
+    groups = re.findall(r'\d+', phone_number or '')
+    return ' '.join(groups + [''.join(groups)]) if groups else ''
+
+
+def refresh_member_search(members, chunk_size: int = 2000) -> int:
+    """
+    Rebuild the search columns of some members from their user, phone number and branch
+
+    Args:
+        members: Member queryset to refresh
+        chunk_size: Members read and written per batch
+
+    Returns:
+        Number of members refreshed
+    """
+    rows = members.values_list(
+        'pk', 'user__username', 'user__first_name', 'user__last_name', 'phone_number', 'branch__branch_name'
+    ).order_by('pk').iterator(chunk_size=chunk_size)
+
+    refreshed, chunk = 0, []
+    for pk, username, first_name, last_name, phone_number, branch_name in rows:
+        name = ' '.join(part for part in (username, first_name, last_name) if part)
+        chunk.append((pk, name, _phone_words(phone_number), branch_name or ''))
+        if len(chunk) >= chunk_size:
+            refreshed += _write(chunk)
+            chunk = []
+    return refreshed + _write(chunk)
+
+
+def _write(chunk: List[Tuple[int, str, str, str]]) -> int:
+    if not chunk:
+        return 0
+
+    if connection.vendor != 'postgresql':
+        Member.objects.bulk_update(
+            [Member(pk=pk, search_text=' '.join(parts).lower()) for pk, *parts in chunk], ['search_text']
+        )
+        return len(chunk)
+
+    # Names weigh most in the ranking, then the phone number, then the branch
+    table = Member._meta.db_table
+    rows = ', '.join(['(%s, %s, %s, %s)'] * len(chunk))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE "{table}" SET '
+            f"search_text = lower(concat_ws(' ', v.name, v.phone, v.branch)), "
+            f"search_document = setweight(to_tsvector('simple', v.name), 'A') "
+            f"|| setweight(to_tsvector('simple', v.phone), 'B') "
+            f"|| setweight(to_tsvector('simple', v.branch), 'C') "
+            f'FROM (VALUES {rows}) AS v (id, name, phone, branch) WHERE "{table}".id = v.id',
+            [value for row in chunk for value in row]
+        )
+    return len(chunk)
+
+
+def search_members(queryset, query: str, ranked: bool = True):
+    """
+    Filter members by a directory search
+
+    On PostgreSQL every word of the query must prefix-match a word of the
+    member's name, username, phone number or branch, so partial input works for
+    autocompletion. Members whose search text is trigram-similar to the query
+    also match, which tolerates typos, when pg_trgm is installed. Both
+    conditions are answered from GIN indexes. Elsewhere each word must be a
+    substring of the search text.
+
+    A single word of up to SHORT_PREFIX_CHARS characters, as typed at the
+    start of an autocomplete, matches a large share of the directory: ranking
+    would score and sort every match to show one page, and its trigrams say
+    nothing about typos. Such a query is ordered by search text instead, which
+    the (search_text, id) index hands out in order, so a page reads only about
+    as many rows as it shows.
+
+    Args:
+        queryset: Members to search
+        query: Search input as typed
+        ranked: Order by relevance, best first, or by search text for a short word
+
+    Returns:
+        The filtered queryset; unchanged when the query has no words
+    """
+    words = WORD.findall(query.lower())[:MAX_QUERY_WORDS]
+    if not words:
+        return queryset
+
+    if connection.vendor != 'postgresql':
+        for word in words:
+            queryset = queryset.filter(search_text__contains=word)
+        return queryset.order_by('pk') if ranked else queryset
+
+    text = ' '.join(words)
+    prefixes = SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config='simple')
+    if len(words) == 1 and len(text) <= SHORT_PREFIX_CHARS:
+        queryset = queryset.filter(search_document=prefixes)
+        return queryset.order_by('search_text', 'pk') if ranked else queryset
+
+    rank = SearchRank(F('search_document'), prefixes)
+    if trigram_available(queryset.db):
+        queryset = queryset.filter(Q(search_document=prefixes) | Q(search_text__trigram_word_similar=text))
+        rank += TrigramWordSimilarity(text, 'search_text')
+    else:
+        queryset = queryset.filter(search_document=prefixes)
+    return queryset.annotate(rank=rank).order_by('-rank', 'pk') if ranked else queryset
+
+
+class MemberSearchFilter(SearchFilter):
+    """`?q=` on the member directory, through search_members"""
+
+    def filter_queryset(self, request, queryset, view):
+        return search_members(queryset, request.query_params.get(self.search_param, ''))
+
+
+@receiver(post_save, sender=Member)
+def refresh_saved_member(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or MEMBER_FIELDS & set(update_fields):
+        refresh_member_search(Member.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=User)
+def refresh_saved_user(sender, instance, created, update_fields=None, **kwargs):
+    # New users have no member yet; logins save last_login only
+    if not created and (update_fields is None or USER_FIELDS & set(update_fields)):
+        refresh_member_search(Member.objects.filter(user_id=instance.pk))
+
+
+@receiver(pre_save, sender=Branch)
+def note_branch_rename(sender, instance, **kwargs):
+    instance._renamed = (
+        instance.pk is not None
+        and Branch.objects.filter(pk=instance.pk).exclude(branch_name=instance.branch_name).exists()
+    )
+
+
+@receiver(post_save, sender=Branch)
+def refresh_branch_members(sender, instance, **kwargs):
+    if getattr(instance, '_renamed', False):
+        refreshed = refresh_member_search(Member.objects.filter(branch_id=instance.pk))
+        logger.info(f"Refreshed search of {refreshed} members of renamed branch {instance.pk}")
+
+
+# Site search: minutes, announcements, events and document contents
+
+# Stemming, so "voted" finds "vote"; the column, queries and headlines must all use the same configuration
+TEXT_SEARCH_CONFIG = 'english'
+# to_tsvector rejects documents over 1 MB; longer bodies are indexed up to here
+MAX_BODY_CHARS = 500_000
+
+
+def visible_branch_ids(user) -> List[int]:
+    """Ids of the user's member branch and its parent branches"""
+    path = Member.objects.filter(user_id=user.pk).values_list('branch__path', flat=True).first()
+    # '/1/4/9/' -> the member's branch and its ancestors, read without a join on branches
+    return [int(branch_id) for branch_id in (path or '').strip('/').split('/') if branch_id]
+
+
+class SearchEntryQuerySet(models.QuerySet):
+
+    def visible_to(self, user):
+        """
+        Entries the user may see: staff see everything, members see entries
+        without a branch and those of their own branch and its parent branches
+        """
+        if user.is_staff:
+            return self
+        return self.filter(Q(branch_id__isnull=True) | Q(branch_id__in=visible_branch_ids(user)))
+
+    def search(self, query: str):
+        """
+        Entries matching a web-style query ("quoted phrases", -excluded words, or),
+        best first, with a `headline` of the matching text
+        """
+        if connection.vendor != 'postgresql':
+            words = WORD.findall(query.lower())[:MAX_QUERY_WORDS]
+            queryset = self
+            for word in words:
+                queryset = queryset.filter(Q(title__icontains=word) | Q(body__icontains=word))
+            return queryset.defer('document').order_by('-updated_at', 'pk')
+
+        terms = SearchQuery(query, search_type='websearch', config=TEXT_SEARCH_CONFIG)
+        return self.filter(document=terms).annotate(
+            rank=SearchRank(F('document'), terms),
+            # Only evaluated for the rows of the page, after sorting and LIMIT
+            headline=SearchHeadline('body', terms, config=TEXT_SEARCH_CONFIG, start_sel='<mark>',
+                                    stop_sel='</mark>', max_fragments=2, min_words=8, max_words=24),
+        ).defer('body', 'document').order_by('-rank', '-updated_at', 'pk')
+
+
+class SearchEntry(models.Model):
+    """
+    One searchable item: its title, text and branch, copied from the source
+    row. Kept current by the receivers below, one entry at a time; document
+    text is extracted afterwards by the index_documents command.
+    """
+
+    class Kind(models.TextChoices):
+        ANNOUNCEMENT = 'announcement'
+        EVENT = 'event'
+        MINUTE = 'minute'
+        DOCUMENT = 'document'
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    object_id = models.PositiveIntegerField()
+    # None for items visible to every branch
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    # Maintained on PostgreSQL only, with a GIN index created in migration 0022
+    document = SearchVectorField(null=True, editable=False)
+    needs_extraction = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SearchEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = 'Search entries'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_entry_source_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['id'], condition=Q(needs_extraction=True), name='search_entry_extraction_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}: {self.title}"
+
+    def snippet(self, query: str) -> str:
+        """Highlighted, HTML-escaped excerpt of the body around the query"""
+        headline = getattr(self, 'headline', None)
+        if headline is None:
+            headline = _excerpt(self.body, WORD.findall(query.lower())[:MAX_QUERY_WORDS])
+        return html.escape(headline).replace('&lt;mark&gt;', '<mark>').replace('&lt;/mark&gt;', '</mark>')
+
+
+def _excerpt(body: str, words: List[str], width: int = 160) -> str:
+    """Portable stand-in for ts_headline"""
+    lowered = body.lower()
+    found = [lowered.find(word) for word in words if word in lowered]
+    start = max(0, min(found, default=0) - width // 4)
+    excerpt = body[start:start + width]
+    if not words:
+        return excerpt
+    return re.sub('|'.join(re.escape(word) for word in words), r'<mark>\g<0></mark>', excerpt, flags=re.IGNORECASE)
+
+
+# Source model -> (kind, function returning its title, body and branch id)
+INDEXED_MODELS = {
+    Announcement: (SearchEntry.Kind.ANNOUNCEMENT, lambda item: (item.title, item.content, item.branch_id)),
+    Event: (SearchEntry.Kind.EVENT, lambda item: (item.title, item.description, item.branch_id)),
+    Minute: (SearchEntry.Kind.MINUTE, lambda item: (f"{item.venue}, {item.meeting_date}", item.content, None)),
+    # The body comes from the file, once index_documents has extracted it
+    Document: (SearchEntry.Kind.DOCUMENT, lambda item: (item.file_name, None, item.branch_id)),
+}
+
+
+def index_item(item) -> SearchEntry:
+    """Create or update the search entry of one source row"""
+    kind, fields = INDEXED_MODELS[type(item)]
+    title, body, branch_id = fields(item)
+    defaults = {'title': title[:255], 'branch_id': branch_id}
+    if body is None:
+        defaults['needs_extraction'] = True
+    else:
+        defaults['body'] = body[:MAX_BODY_CHARS]
+
+    with transaction.atomic():
+        entry, _ = SearchEntry.objects.update_or_create(kind=kind, object_id=item.pk, defaults=defaults)
+        _refresh_documents(SearchEntry.objects.filter(pk=entry.pk))
+    return entry
+
+
+def _refresh_documents(entries) -> None:
+    if connection.vendor == 'postgresql':
+        entries.update(document=SearchVector('title', weight='A', config=TEXT_SEARCH_CONFIG)
+                       + SearchVector('body', weight='B', config=TEXT_SEARCH_CONFIG))
+
+
+def extract_pending(batch_size: int = 20) -> int:
+    """
+    Extract the text of documents uploaded or replaced since the last pass
+
+    Entries are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+    workers can run side by side.
+
+    Returns:
+        Number of documents processed
+    """
+    with transaction.atomic():
+        entries = list(SearchEntry.objects.select_for_update(skip_locked=True).filter(
+            needs_extraction=True, kind=SearchEntry.Kind.DOCUMENT
+        ).order_by('pk')[:batch_size])
+        documents = Document.objects.in_bulk([entry.object_id for entry in entries])
+
+        for entry in entries:
+            document = documents.get(entry.object_id)
+            entry.body = _document_text(document)[:MAX_BODY_CHARS] if document else ''
+            entry.needs_extraction = False
+            entry.updated_at = timezone.now()
+        SearchEntry.objects.bulk_update(entries, ['body', 'needs_extraction', 'updated_at'])
+        _refresh_documents(SearchEntry.objects.filter(pk__in=[entry.pk for entry in entries]))
+
+    if entries:
+        logger.info(f"Extracted the text of {len(entries)} documents")
+    return len(entries)
+
+
+def _document_text(document: Document) -> str:
+    if not document.doc_content:
+        return ''
+    try:
+        if document.doc_content.size > MAX_FILE_BYTES:
+            return ''
+        with document.doc_content.open('rb') as file:
+            content = file.read()
+    except OSError as e:
+        logger.warning(f"Could not read document {document.pk}: {e}")
+        return ''
+    return extract_text(content, document.file_name or document.doc_content.name, document.file_type)
+
+
+def reindex_all(chunk_size: int = 1000) -> int:
+    """Index every source row; for a new or rebuilt index, not needed otherwise"""
+    indexed = 0
+    for model in INDEXED_MODELS:
+        for item in model.objects.order_by('pk').iterator(chunk_size=chunk_size):
+            index_item(item)
+            indexed += 1
+    return indexed
+
+
+def index_saved_item(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_item(instance)
+
+
+def unindex_deleted_item(sender, instance, **kwargs):
+    SearchEntry.objects.filter(kind=INDEXED_MODELS[sender][0], object_id=instance.pk).delete()
+
+
+for indexed_model in INDEXED_MODELS:
+    post_save.connect(index_saved_item, sender=indexed_model, dispatch_uid=f'search_index_{indexed_model.__name__}')
+    post_delete.connect(unindex_deleted_item, sender=indexed_model,
+                        dispatch_uid=f'search_unindex_{indexed_model.__name__}')
@@ -5,6 +5,8 @@ from .models import (
     MemberPayment, Deposit, MemberDeposit, DepositPayment, Loan, MemberLoan,
     LoanRefund, Document, Minute, Feedback, Message
 )
+from . import ledger
+from .search import SearchEntry
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -23,8 +25,27 @@ class BranchSerializer(serializers.ModelSerializer):
                   'branch_logo', 'created_at', 'child_branches']
         read_only_fields = ['branch_id', 'created_at']
 
+    def validate_branch_parent(self, value):
+        if value is not None and self.instance is not None and value.is_descendant_of(self.instance):
+            raise serializers.ValidationError("A branch cannot be moved under itself or one of its sub-branches.")
+        return value
+
     def get_child_branches(self, obj):
-        return BranchSerializer(obj.child_branches.all(), many=True).data
+        # Views pass the whole hierarchy as a parent -> children map in the
+        # context, so nesting costs no further queries
+        children_map = self.context.get('children_map')
+        depth = self.context.get('depth')
+        level = self.context.get('level', 0)
+
+        if depth is not None and level >= depth:
+            return []
+
+        if children_map is None:
+            children = obj.child_branches.all()
+        else:
+            children = children_map.get(obj.branch_id, [])
+
+        return BranchSerializer(children, many=True, context={**self.context, 'level': level + 1}).data
 
 
 class MemberSerializer(serializers.ModelSerializer):
@@ -52,6 +73,33 @@ class MemberFinancesSerializer(serializers.ModelSerializer):
         read_only_fields = ['last_updated_at']
 
 
+class FinancesSummarySerializer(serializers.Serializer):
+    total_savings = serializers.DecimalField(max_digits=15, decimal_places=2)
+    total_loans = serializers.DecimalField(max_digits=15, decimal_places=2)
+    last_updated_at = serializers.DateTimeField()
+
+
+class LoansSummarySerializer(serializers.Serializer):
+    open_count = serializers.IntegerField()
+    total_borrowed = serializers.DecimalField(max_digits=15, decimal_places=2)
+    principal_outstanding = serializers.DecimalField(max_digits=15, decimal_places=2)
+    interest_outstanding = serializers.DecimalField(max_digits=15, decimal_places=2)
+
+
+class DepositsSummarySerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    total_deposited = serializers.DecimalField(max_digits=15, decimal_places=2)
+    interest_earned = serializers.DecimalField(max_digits=15, decimal_places=2)
+
+
+class MemberSummarySerializer(serializers.Serializer):
+    """Read-only summary of a member's finances, open loans and deposits, built from aggregates"""
+    member = serializers.IntegerField()
+    finances = FinancesSummarySerializer(allow_null=True)
+    loans = LoansSummarySerializer()
+    deposits = DepositsSummarySerializer()
+
+
 class AnnouncementSerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
     updated_by = UserSerializer(read_only=True)
@@ -85,15 +133,17 @@ class MemberPaymentSerializer(serializers.ModelSerializer):
 class DepositSerializer(serializers.ModelSerializer):
     class Meta:
         model = Deposit
-        fields = ['deposit_id', 'branch', 'name', 'min_amount', 'is_active',
+        fields = ['deposit_id', 'branch', 'name', 'min_amount', 'interest_rate', 'is_active',
                   'created_at', 'updated_by', 'updated_at']
         read_only_fields = ['deposit_id', 'created_at', 'updated_at']
 
 
 class MemberDepositSerializer(serializers.ModelSerializer):
+    deposit_name = serializers.CharField(source='deposit.name', read_only=True)
+
     class Meta:
         model = MemberDeposit
-        fields = ['id', 'member', 'deposit', 'total_deposit_amount', 'interest_earned',
+        fields = ['id', 'member', 'deposit', 'deposit_name', 'total_deposit_amount', 'interest_earned',
                   'accrued_principal', 'created_by', 'created_at']
         read_only_fields = ['id', 'created_at']
 
@@ -101,32 +151,56 @@ class MemberDepositSerializer(serializers.ModelSerializer):
 class DepositPaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = DepositPayment
-        fields = ['payment_id', 'deposit', 'deposit_amount', 'previous_balance', 'new_balance']
-        read_only_fields = ['payment_id']
+        fields = ['payment_id', 'deposit', 'sequence', 'deposit_amount', 'previous_balance',
+                  'new_balance', 'posted_at']
+        read_only_fields = ['payment_id', 'sequence', 'previous_balance', 'new_balance', 'posted_at']
+
+    def create(self, validated_data):
+        # Balances and sequence are assigned by the ledger under a lock on the deposit
+        return ledger.post_deposit_payment(validated_data.pop('deposit'), validated_data.pop('deposit_amount'),
+                                           **validated_data)
 
 
 class LoanSerializer(serializers.ModelSerializer):
     class Meta:
         model = Loan
-        fields = ['loan_id', 'loan_name', 'loan_branch', 'interest_rate',
-                  'is_active', 'status', 'updated_by', 'updated_at']
+        fields = ['loan_id', 'loan_name', 'loan_branch', 'interest_rate', 'interest_method',
+                  'term_months', 'is_active', 'status', 'updated_by', 'updated_at']
         read_only_fields = ['loan_id', 'updated_at']
 
 
 class MemberLoanSerializer(serializers.ModelSerializer):
+    loan_name = serializers.CharField(source='loan.loan_name', read_only=True)
+
     class Meta:
         model = MemberLoan
-        fields = ['id', 'user', 'loan', 'loan_amount', 'disbursement_date',
+        fields = ['id', 'user', 'loan', 'loan_name', 'loan_amount', 'disbursement_date',
                   'interest_amount', 'interest_paid', 'principal_paid',
-                  'accrued_principal', 'created_by', 'created_at']
-        read_only_fields = ['id', 'created_at']
+                  'accrued_principal', 'accrued_interest', 'created_by', 'created_at']
+        read_only_fields = ['id', 'accrued_principal', 'accrued_interest', 'created_at']
+
+
+class InstallmentSerializer(serializers.Serializer):
+    number = serializers.IntegerField()
+    due_date = serializers.DateField()
+    principal = serializers.DecimalField(max_digits=15, decimal_places=2)
+    interest = serializers.DecimalField(max_digits=15, decimal_places=2)
+    payment = serializers.DecimalField(max_digits=15, decimal_places=2)
+    balance = serializers.DecimalField(max_digits=15, decimal_places=2)
 
 
 class LoanRefundSerializer(serializers.ModelSerializer):
     class Meta:
         model = LoanRefund
-        fields = ['payment_id', 'deposit', 'deposit_amount', 'previous_balance', 'new_balance']
-        read_only_fields = ['payment_id']
+        fields = ['payment_id', 'deposit', 'member_loan', 'sequence', 'deposit_amount', 'previous_balance',
+                  'new_balance', 'posted_at']
+        read_only_fields = ['payment_id', 'sequence', 'previous_balance', 'new_balance', 'posted_at']
+        extra_kwargs = {'member_loan': {'required': True, 'allow_null': False}}
+
+    def create(self, validated_data):
+        # Balances and sequence are assigned by the ledger under a lock on the member loan
+        return ledger.post_loan_refund(validated_data.pop('member_loan'), validated_data.pop('deposit_amount'),
+                                       validated_data.pop('deposit'), **validated_data)
 
 
 class DocumentSerializer(serializers.ModelSerializer):
@@ -167,3 +241,18 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'sender', 'receiver', 'subject', 'content',
                   'created_at', 'read_status']
         read_only_fields = ['id', 'created_at']
+
+
+class SearchResultSerializer(serializers.ModelSerializer):
+    snippet = serializers.SerializerMethodField()
+    rank = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SearchEntry
+        fields = ['kind', 'object_id', 'title', 'branch', 'snippet', 'rank', 'updated_at']
+
+    def get_snippet(self, obj):
+        return obj.snippet(self.context.get('query', ''))
+
+    def get_rank(self, obj):
+        return getattr(obj, 'rank', None)
@@ -0,0 +1,314 @@
+import csv
+import heapq
+import logging
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import django
+from django.db import connections
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Branch, LoanRefund, Member, MemberDeposit, MemberLoan, MemberPayment
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'pdf')
+
+# Rows fetched per round trip; on PostgreSQL each source is read through a server-side cursor
+CHUNK_SIZE = 2000
+
+
+class Entry(NamedTuple):
+    day: date
+    kind: str
+    description: str
+    savings: Decimal  # change to the member's savings
+    loans: Decimal  # change to the loan principal the member owes
+
+
+class Statement(NamedTuple):
+    member: Member
+    start: Optional[date]
+    end: date
+    opening_savings: Decimal
+    opening_loans: Decimal
+    entries: Iterator[Entry]
+
+
+def _day_start(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _sources(member_id: int) -> List[Tuple]:
+    """(queryset, date field, datetime field?) of every history source of a member"""
+    return [
+        (MemberPayment.objects.filter(user_id=member_id), 'payment_date', False),
+        (MemberDeposit.objects.filter(member_id=member_id), 'created_at', True),
+        (MemberLoan.objects.filter(user_id=member_id), 'disbursement_date', False),
+        (LoanRefund.objects.filter(member_loan__user_id=member_id), 'posted_at', True),
+    ]
+
+
+def _between(queryset, field: str, is_datetime: bool, start: Optional[date], end: Optional[date]):
+    # Datetime columns are compared against the bounds of local days, not cast to a date, so their indexes apply
+    if start is not None:
+        queryset = queryset.filter(**{f'{field}__gte': _day_start(start) if is_datetime else start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{field}__lt': _day_start(end + timedelta(days=1))} if is_datetime
+                                   else {f'{field}__lte': end})
+    return queryset
+
+
+def _local_day(value) -> date:
+    return timezone.localtime(value).date() if isinstance(value, datetime) else value
+
+
+def _stream(queryset, *fields) -> Iterator[Tuple]:
+    return queryset.values_list(*fields).order_by(fields[0], 'pk').iterator(chunk_size=CHUNK_SIZE)
+
+
+def build_statement(member: Member, start: Optional[date], end: date) -> Statement:
+    """
+    Savings and loan history of a member between two days, inclusive
+
+    Opening balances cost one aggregate per source. The entries are a lazy
+    merge, by day, of the sources read in order as bare tuples, so the
+    statement is produced in constant memory however long the history is.
+
+    Args:
+        member: Member the statement is for
+        start: First day, or None for the whole history
+        end: Last day
+
+    Returns:
+        The statement; its entries are read as they are consumed
+    """
+    payments, deposits, loans, refunds = [
+        _between(queryset, field, is_datetime, start, end) for queryset, field, is_datetime in _sources(member.pk)
+    ]
+
+    opening_savings = opening_loans = Decimal('0.00')
+    if start is not None:
+        before = [_between(queryset, field, is_datetime, None, start - timedelta(days=1))
+                  for queryset, field, is_datetime in _sources(member.pk)]
+        paid, deposited, borrowed, refunded = [
+            queryset.aggregate(total=Sum(amount))['total'] or Decimal('0.00')
+            for queryset, amount in zip(before, ['payment_amount', 'total_deposit_amount', 'loan_amount',
+                                                 'deposit_amount'])
+        ]
+        opening_savings, opening_loans = paid + deposited, borrowed - refunded
+
+    zero = Decimal('0')
+    entries = heapq.merge(
+        (Entry(day, 'Payment', f'Payment {pk}', amount, zero)
+         for day, pk, amount in _stream(payments, 'payment_date', 'pk', 'payment_amount')),
+        (Entry(_local_day(created_at), 'Deposit', name, amount, zero)
+         for created_at, name, amount in _stream(deposits, 'created_at', 'deposit__name', 'total_deposit_amount')),
+        (Entry(day, 'Loan', name, zero, amount)
+         for day, name, amount in _stream(loans, 'disbursement_date', 'loan__loan_name', 'loan_amount')),
+        (Entry(_local_day(posted_at), 'Loan refund', name, zero, -amount)
+         for posted_at, name, amount in _stream(refunds, 'posted_at', 'member_loan__loan__loan_name',
+                                                'deposit_amount')),
+        key=lambda entry: entry.day
+    )
+    return Statement(member, start, end, opening_savings, opening_loans, entries)
+
+
+def _rows(statement: Statement) -> Iterator[List]:
+    """Table rows: date, type, description, savings change, loans change, savings balance, loans balance"""
+    savings, loans = statement.opening_savings, statement.opening_loans
+    yield [statement.start or '', 'Opening balance', '', '', '', savings, loans]
+    for entry in statement.entries:
+        savings += entry.savings
+        loans += entry.loans
+        yield [entry.day, entry.kind, entry.description, entry.savings or '', entry.loans or '', savings, loans]
+    yield [statement.end, 'Closing balance', '', '', '', savings, loans]
+
+
+COLUMNS = ['Date', 'Type', 'Description', 'Savings', 'Loans', 'Savings balance', 'Loans balance']
+
+
+def _title(statement: Statement) -> str:
+    user = statement.member.user
+    name = user.get_full_name() or user.username
+    return f"Statement of {name} (member {statement.member.pk}), {statement.start or 'opening'} to {statement.end}"
+
+
+class _Line:
+    """File-like object whose write() hands the line back, so csv.writer can feed a generator"""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(statement: Statement) -> Iterator[bytes]:
+    writer = csv.writer(_Line())
+    yield writer.writerow([_title(statement)]).encode()
+    yield writer.writerow(COLUMNS).encode()
+    for row in _rows(statement):
+        yield writer.writerow(row).encode()
+
+
+class PDFWriter:
+    """
+    Streams a plain-text PDF page by page.
+
+    Each page is written as soon as it is full; only the byte offset of every
+    object is kept, for the cross-reference table at the end. Text is set in
+    Courier, so columns can be aligned with spaces.
+    """
+    WIDTH, HEIGHT = 595, 842  # A4, in points
+    MARGIN = 40
+    FONT_SIZE, LEADING = 8, 11
+    LINES_PER_PAGE = (HEIGHT - 2 * MARGIN) // LEADING
+
+    # Objects 1 to 3 are the catalog, the page tree and the font; pages follow
+    CATALOG, PAGES, FONT = 1, 2, 3
+
+    def __init__(self):
+        self.offsets = {}
+        self.position = 0
+        self.pages = []
+        self.last_number = self.FONT
+
+    def stream(self, lines: Iterable[str], header: Iterable[str] = ()) -> Iterator[bytes]:
+        """
+        Args:
+            lines: Text lines, laid out over as many pages as needed
+            header: Lines repeated at the top of every page
+        """
+        header = list(header)
+        per_page = self.LINES_PER_PAGE - len(header)
+
+        yield self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        yield self._object(self.FONT, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier '
+                                      b'/Encoding /WinAnsiEncoding >>')
+
+        page = []
+        for line in lines:
+            page.append(line)
+            if len(page) == per_page:
+                yield self._page(header, page)
+                page = []
+        if page or not self.pages:
+            yield self._page(header, page)
+
+        kids = ' '.join(f'{number} 0 R' for number in self.pages)
+        yield self._object(self.PAGES, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>'.encode())
+        yield self._object(self.CATALOG, f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>'.encode())
+        yield self._trailer()
+
+    def _page(self, header: List[str], lines: List[str]) -> bytes:
+        text = b' T* '.join(b'(%s) Tj' % self._escape(line) for line in header + lines)
+        content = b'BT /F1 %d Tf %d TL %d %d Td %s ET' % (
+            self.FONT_SIZE, self.LEADING, self.MARGIN, self.HEIGHT - self.MARGIN, text
+        )
+        content_number = self._next_number()
+        chunk = self._object(content_number, b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+
+        page_number = self._next_number()
+        self.pages.append(page_number)
+        return chunk + self._object(page_number, (
+            f'<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {self.WIDTH} {self.HEIGHT}] '
+            f'/Resources << /Font << /F1 {self.FONT} 0 R >> >> /Contents {content_number} 0 R >>'
+        ).encode())
+
+    def _trailer(self) -> bytes:
+        size = self.last_number + 1
+        xref = [b'xref\n0 %d\n0000000000 65535 f \n' % size]
+        xref += [b'%010d 00000 n \n' % self.offsets[number] for number in range(1, size)]
+        start = self.position
+        return self._write(b''.join(xref) + b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            size, self.CATALOG, start
+        ))
+
+    def _next_number(self) -> int:
+        self.last_number += 1
+        return self.last_number
+
+    def _object(self, number: int, body: bytes) -> bytes:
+        self.offsets[number] = self.position
+        return self._write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+
+    def _write(self, chunk: bytes) -> bytes:
+        self.position += len(chunk)
+        return chunk
+
+    @staticmethod
+    def _escape(text: str) -> bytes:
+        text = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        return text.encode('cp1252', errors='replace')
+
+
+def _pdf_line(row: List) -> str:
+    day, kind, description = (str(value) for value in row[:3])
+    amounts = ''.join(f'{str(value):>13}' for value in row[3:])
+    return f'{day:<10} {kind[:15]:<15} {description[:24]:<24}{amounts}'
+
+
+PDF_COLUMNS = ['Date', 'Type', 'Description', 'Savings', 'Loans', 'Sav. balance', 'Loan balance']
+
+
+def render_pdf(statement: Statement) -> Iterator[bytes]:
+    header = [_title(statement), '', _pdf_line(PDF_COLUMNS), '']
+    return PDFWriter().stream((_pdf_line(row) for row in _rows(statement)), header)
+
+
+def render(statement: Statement, fmt: str) -> Iterator[bytes]:
+    return render_pdf(statement) if fmt == 'pdf' else render_csv(statement)
+
+
+def filename(member: Member, start: Optional[date], end: date, fmt: str) -> str:
+    return f"statement-{member.pk}-{slugify(member.user.username)}-{start or 'opening'}-{end}.{fmt}"
+
+
+def _init_worker():
+    django.setup()
+
+
+def _render_member(args) -> Tuple[str, bytes]:
+    member_id, start, end, fmt = args
+    member = Member.objects.select_related('user').get(pk=member_id)
+    return filename(member, start, end, fmt), b''.join(render(build_statement(member, start, end), fmt))
+
+
+def export_branch_statements(branch: Branch, start: Optional[date], end: date, fmt: str, output,
+                             workers: int = 1) -> int:
+    """
+    Render the statement of every member of a branch and its sub-branches into a zip file
+
+    Statements are rendered in a pool of worker processes, each with its own
+    database connection, and added to the archive as they complete.
+
+    Args:
+        branch: Branch whose members to export
+        start: First day, or None for the whole history
+        end: Last day
+        fmt: 'csv' or 'pdf'
+        output: Path or binary file object for the zip file
+        workers: Number of worker processes; 1 renders in this process
+
+    Returns:
+        Number of statements written
+    """
+    member_ids = list(Member.objects.in_branch_subtree(branch).order_by('pk').values_list('pk', flat=True))
+    jobs = [(member_id, start, end, fmt) for member_id in member_ids]
+
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        if workers <= 1:
+            for job in jobs:
+                archive.writestr(*_render_member(job))
+        else:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                for name, content in executor.map(_render_member, jobs, chunksize=16):
+                    archive.writestr(name, content)
+
+    logger.info(f"Exported {len(jobs)} statements of branch {branch.pk} to a {fmt} zip")
+    return len(jobs)
@@ -0,0 +1,308 @@
+import logging
+from datetime import timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Announcement, Document, Event, MemberDeposit, MemberLoan, MemberPayment, Message
+from .search import visible_branch_ids
+from .serializers import (
+    AnnouncementSerializer, DocumentSerializer, EventSerializer, MemberDepositSerializer, MemberLoanSerializer,
+    MemberPaymentSerializer, MessageSerializer
+)
+from .webhooks import model_changed
+
+logger = logging.getLogger(__name__)
+
+# (branch id, user id) that may see a row: branch rows are seen by members of that
+# branch and its sub-branches (every member when None), user rows by that user only
+Audience = Tuple[Optional[int], Optional[int]]
+
+
+class Synced(NamedTuple):
+    name: str
+    serializer_class: type
+    audiences: Callable[[models.Model], List[Audience]]
+    select_related: Tuple[str, ...] = ()
+
+
+SYNCED: Dict[type, Synced] = {
+    Announcement: Synced('announcement', AnnouncementSerializer, lambda row: [(row.branch_id, None)],
+                         ('created_by', 'updated_by')),
+    Event: Synced('event', EventSerializer, lambda row: [(row.branch_id, None)], ('created_by', 'updated_by')),
+    Document: Synced('document', DocumentSerializer, lambda row: [(row.branch_id, None)]),
+    Message: Synced('message', MessageSerializer, lambda row: [(None, row.sender_id), (None, row.receiver_id)],
+                    ('sender', 'receiver')),
+    MemberPayment: Synced('payment', MemberPaymentSerializer, lambda row: [(None, row.user.user_id)], ('user',)),
+    MemberLoan: Synced('member_loan', MemberLoanSerializer, lambda row: [(None, row.user.user_id)],
+                       ('user', 'loan')),
+    MemberDeposit: Synced('member_deposit', MemberDepositSerializer, lambda row: [(None, row.member.user_id)],
+                          ('member', 'deposit')),
+}
+SYNCED_BY_NAME = {synced.name: model for model, synced in SYNCED.items()}
+
+# A token is the (transaction_id, id) of the last change a client has seen
+EMPTY_TOKEN = (0, 0)
+
+
+class SyncTokenExpired(Exception):
+    """The changes after a token were pruned from the journal; the client must pull everything again"""
+
+
+class SyncChangeQuerySet(models.QuerySet):
+
+    def visible_to(self, user):
+        if user.is_staff:
+            return self
+        return self.filter(
+            Q(audience_user=user.pk)
+            | Q(audience_user__isnull=True, audience_branch__isnull=True)
+            | Q(audience_user__isnull=True, audience_branch__in=visible_branch_ids(user))
+        )
+
+    def after(self, token: Tuple[int, int]):
+        transaction_id, change_id = token
+        return self.filter(Q(transaction_id__gt=transaction_id) | Q(transaction_id=transaction_id, id__gt=change_id))
+
+    def up_to(self, token: Tuple[int, int]):
+        transaction_id, change_id = token
+        return self.filter(Q(transaction_id__lt=transaction_id) | Q(transaction_id=transaction_id, id__lte=change_id))
+
+    def committed(self):
+        """
+        Changes whose writers have all finished
+
+        Ids are taken at insert time but transactions commit in any order, so a
+        client that saw change 10 could later miss a change 9 committed after it.
+        On PostgreSQL changes are ordered by writing transaction instead, and
+        only those of transactions older than every running one are returned:
+        anything committed later belongs to a newer transaction, and so sorts
+        after every token handed out.
+        """
+        if connection.vendor != 'postgresql':
+            return self
+        return self.filter(transaction_id__lt=RawSQL('pg_snapshot_xmin(pg_current_snapshot())::text::bigint', ()))
+
+
+class SyncChange(models.Model):
+    """
+    Change journal read by /sync/: one row per changed object and audience.
+
+    Written in the same transaction as the change, from the
+    WebhookManager.trigger_webhook calls of the synced viewsets. Deletes leave
+    tombstones, and so does a change that takes an object out of an audience's
+    sight, e.g. an announcement moved to another branch.
+    """
+
+    class Action(models.TextChoices):
+        CREATED = 'created'
+        UPDATED = 'updated'
+        DELETED = 'deleted'
+
+    id = models.BigAutoField(primary_key=True)
+    # PostgreSQL transaction of the write; 0 elsewhere
+    transaction_id = models.BigIntegerField(default=0)
+    model = models.CharField(max_length=32)
+    object_id = models.CharField(max_length=64)
+    action = models.CharField(max_length=8, choices=Action.choices)
+    # Plain ids rather than foreign keys, so tombstones outlive what they point at
+    audience_branch = models.BigIntegerField(null=True, blank=True)
+    audience_user = models.BigIntegerField(null=True, blank=True)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    objects = SyncChangeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['transaction_id', 'id'], name='sync_change_order_idx'),
+            models.Index(fields=['model', 'object_id'], name='sync_change_object_idx'),
+            models.Index(fields=['changed_at'], name='sync_change_age_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} {self.action}"
+
+
+def _action(event_type: str) -> str:
+    verb = event_type.rsplit('.', 1)[-1]
+    if verb == 'deleted':
+        return SyncChange.Action.DELETED
+    if verb in ('created', 'sent', 'uploaded'):
+        return SyncChange.Action.CREATED
+    return SyncChange.Action.UPDATED
+
+
+def record_change(instance, action: str):
+    """
+    Journal a change to a synced object for every audience that sees it now,
+    and a tombstone for every audience that saw it before and no longer does
+
+    The object's row is locked first, in the transaction of the write that
+    changed it, so two writers of one object journal one after the other and
+    the second reads the audiences the first recorded.
+
+    Args:
+        instance: The changed object, still holding its pk when deleted
+        action: SyncChange.Action value
+    """
+    synced = SYNCED[type(instance)]
+    object_id = str(instance.pk)
+
+    with transaction.atomic(savepoint=False):
+        list(type(instance).objects.select_for_update().filter(pk=instance.pk).values_list('pk', flat=True))
+
+        latest = {}
+        for audience_branch, audience_user, previous in SyncChange.objects.filter(
+                model=synced.name, object_id=object_id).order_by('id').values_list(
+                'audience_branch', 'audience_user', 'action'):
+            latest[audience_branch, audience_user] = previous
+        seen_by = {audience for audience, previous in latest.items() if previous != SyncChange.Action.DELETED}
+
+        current = set(synced.audiences(instance))
+        if action == SyncChange.Action.DELETED:
+            changes = {audience: action for audience in seen_by | current}
+        else:
+            changes = {audience: SyncChange.Action.DELETED for audience in seen_by - current}
+            changes.update((audience, action) for audience in current)
+
+        transaction_id = RawSQL('pg_current_xact_id()::text::bigint', ()) if connection.vendor == 'postgresql' else 0
+        SyncChange.objects.bulk_create([
+            SyncChange(transaction_id=transaction_id, model=synced.name, object_id=object_id, action=change,
+                       audience_branch=audience_branch, audience_user=audience_user)
+            for (audience_branch, audience_user), change in sorted(changes.items(), key=str)
+        ])
+
+
+@receiver(model_changed)
+def journal_change(sender, instance, event_type, **kwargs):
+    if sender in SYNCED:
+        record_change(instance, _action(event_type))
+
+
+def parse_token(token: str) -> Tuple[int, int]:
+    """
+    Raises:
+        ValueError: if the token is malformed
+    """
+    transaction_id, _, change_id = token.partition('-')
+    return int(transaction_id, 16), int(change_id, 16)
+
+
+def format_token(token: Tuple[int, int]) -> str:
+    return f'{token[0]:x}-{token[1]:x}'
+
+
+def _newest(queryset) -> Optional[Tuple[int, int]]:
+    return queryset.order_by('-transaction_id', '-id').values_list('transaction_id', 'id').first()
+
+
+def changes_since(user, token: Optional[Tuple[int, int]], limit: int, context: Dict) -> Dict:
+    """
+    The changes the user may see after a token, oldest first
+
+    Cost depends on the number of changes after the token, not on the size of
+    the synced tables: one range read of the journal, then one query per
+    synced model present in the page for the current rows.
+
+    Args:
+        user: Requesting user
+        token: Last token the client received, or None to start from now
+        limit: Most journal rows to read
+        context: Serializer context
+
+    Returns:
+        {'token', 'has_more', 'changes'}; each change is {'model', 'id',
+        'action', 'data'}, with data None for deletions
+
+    Raises:
+        SyncTokenExpired: if changes after the token were already pruned
+    """
+    committed = SyncChange.objects.committed()
+    if token is None:
+        return {'token': format_token(_newest(committed) or EMPTY_TOKEN), 'has_more': False, 'changes': []}
+
+    oldest = committed.order_by('transaction_id', 'id').values_list('transaction_id', 'id').first()
+    if token != EMPTY_TOKEN and oldest is not None and token < oldest:
+        raise SyncTokenExpired()
+
+    rows = list(committed.visible_to(user).after(token).order_by('transaction_id', 'id').values_list(
+        'transaction_id', 'id', 'model', 'object_id', 'action')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if has_more:
+        next_token = rows[-1][:2]
+    else:
+        # Skip past other users' changes too, so they are not read again next time
+        next_token = max([token, *(row[:2] for row in rows[-1:]), _newest(committed.after(token)) or token])
+
+    # Only the latest change of each object matters
+    latest = {}
+    for _, _, name, object_id, action in rows:
+        latest.pop((name, object_id), None)
+        latest[name, object_id] = action
+
+    current = {}
+    for name in {name for name, _ in latest}:
+        model = SYNCED_BY_NAME.get(name)
+        if model is None:
+            continue
+        ids = [object_id for (row_name, object_id), action in latest.items()
+               if row_name == name and action != SyncChange.Action.DELETED]
+        for instance in model.objects.select_related(*SYNCED[model].select_related).filter(pk__in=ids):
+            current[name, str(instance.pk)] = instance
+
+    branch_ids = None if user.is_staff else set(visible_branch_ids(user))
+    changes = []
+    for (name, object_id), action in latest.items():
+        instance = current.get((name, object_id))
+        if instance is not None and not _visible(SYNCED[type(instance)].audiences(instance), user, branch_ids):
+            instance = None  # Moved out of sight since; its tombstone follows
+        if instance is None:
+            changes.append({'model': name, 'id': object_id, 'action': SyncChange.Action.DELETED, 'data': None})
+        else:
+            serializer_class = SYNCED[type(instance)].serializer_class
+            changes.append({'model': name, 'id': object_id, 'action': action,
+                            'data': serializer_class(instance, context=context).data})
+
+    return {'token': format_token(next_token), 'has_more': has_more, 'changes': changes}
+
+
+def _visible(audiences: List[Audience], user, branch_ids) -> bool:
+    if branch_ids is None:
+        return True
+    return any(audience_user == user.pk if audience_user is not None
+               else audience_branch is None or audience_branch in branch_ids
+               for audience_branch, audience_user in audiences)
+
+
+def prune(days: int, batch_size: int = 5000) -> int:
+    """
+    Delete journal rows older than `days`, always keeping the newest
+
+    Rows go in journal order, so a token older than the oldest row left is
+    answered with SyncTokenExpired rather than silently skipping changes.
+
+    Args:
+        days: Retention in days
+        batch_size: Rows deleted per statement
+
+    Returns:
+        Number of rows deleted
+    """
+    cutoff = _newest(SyncChange.objects.committed().filter(changed_at__lt=timezone.now() - timedelta(days=days)))
+    if cutoff is None or cutoff == _newest(SyncChange.objects.all()):
+        return 0
+
+    deleted = 0
+    while True:
+        ids = list(SyncChange.objects.up_to(cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted += SyncChange.objects.filter(id__in=ids).delete()[0]
+    logger.info(f"Pruned {deleted} sync journal rows older than {days} days")
+    return deleted
@@ -1 +1,1199 @@
-# Create your tests here.
+import csv
+import gzip
+import json
+import os
+import socket
+import tempfile
+import threading
+import warnings
+import zipfile
+import zlib
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from . import (
+    document_text, ledger, response_cache, search, statements, sync, views, webhook_replay, webhook_retention, webhooks
+)
+from .models import (
+    Branch, Member, MemberFinances, Announcement, Event, MemberPayment, Deposit, MemberDeposit,
+    DepositPayment, DepositAccrualCheckpoint, Loan, MemberLoan, LoanRefund, Document, Minute, Feedback, Message
+)
+from .webhook_delivery import DeliveryEngine, DeliveryRequest, DeliveryResult
+from .webhooks import WebhookEndpoint, WebhookEvent, WebhookLog, WebhookManager
+
+
+class WebhookOutboxTests(APITestCase):
+
+    def setUp(self):
+        WebhookEndpoint.objects.create(url='https://hooks.example.com/', event_types=['announcement.*'])
+        self.client.force_authenticate(User.objects.create_user('editor'))
+        self.branch = Branch.objects.create(branch_name='Branch')
+
+    def tearDown(self):
+        webhooks.invalidate_subscription_index(WebhookEndpoint)
+
+    def test_rolled_back_write_leaves_no_event(self):
+        payload = {'title': 'Meeting', 'content': '...', 'branch': self.branch.pk,
+                   'start_date': str(date.today()), 'end_date': str(date.today())}
+        with mock.patch.object(views.AnnouncementViewSet, 'get_success_headers', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/announcements/', payload, format='json')
+        self.assertFalse(Announcement.objects.exists())
+        self.assertFalse(WebhookEvent.objects.exists())
+
+        announcement_id = self.client.post('/announcements/', payload, format='json').data['announcement_id']
+        with mock.patch.object(Announcement, 'delete', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.delete(f'/announcements/{announcement_id}/')
+        self.assertEqual(list(WebhookEvent.objects.values_list('event_type', flat=True)), ['announcement.created'])
+
+        self.client.delete(f'/announcements/{announcement_id}/')
+        self.assertEqual(list(WebhookEvent.objects.values_list('event_type', flat=True)),
+                         ['announcement.created', 'announcement.deleted'])
+
+
+class StubDeliveryEngine:
+    """Answers every POST with `status_code` and keeps the requests for inspection"""
+    max_workers = 4
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.requests = []
+
+    def deliver(self, delivery_requests):
+        self.requests.extend(delivery_requests)
+        return [DeliveryResult(request.url, self.status_code, '', None, 1) for request in delivery_requests]
+
+
+class SubscriptionIndexTests(TestCase):
+
+    def setUp(self):
+        webhooks.invalidate_subscription_index(WebhookEndpoint)
+        self.addCleanup(webhooks.invalidate_subscription_index, WebhookEndpoint)
+
+    def test_matching(self):
+        index = webhooks.SubscriptionIndex([(1, ['member.created']), (2, ['member.*']), (3, ['*']), (4, [])])
+        self.assertEqual(index.endpoint_ids('member.created'), (1, 2, 3))
+        self.assertEqual(index.endpoint_ids('member.deleted'), (2, 3))
+        self.assertEqual(index.endpoint_ids('loan.created'), (3,))
+
+    def test_endpoint_changes_invalidate_index(self):
+        self.assertEqual(webhooks.get_subscription_index().endpoint_ids('loan.created'), ())
+
+        endpoint = WebhookEndpoint.objects.create(url='https://hooks.example.com/', event_types=['loan.*'])
+        with self.assertNumQueries(1):
+            self.assertEqual(webhooks.get_subscription_index().endpoint_ids('loan.created'), (endpoint.pk,))
+        with self.assertNumQueries(0):
+            webhooks.get_subscription_index()
+
+        endpoint.event_types = ['member.*']
+        endpoint.save()
+        self.assertEqual(webhooks.get_subscription_index().endpoint_ids('loan.created'), ())
+
+        endpoint.event_types = ['loan.created']
+        endpoint.is_active = False
+        endpoint.save()
+        self.assertEqual(webhooks.get_subscription_index().endpoint_ids('loan.created'), ())
+
+        endpoint.is_active = True
+        endpoint.save()
+        self.assertEqual(webhooks.get_subscription_index().endpoint_ids('loan.created'), (endpoint.pk,))
+        endpoint.delete()
+        self.assertEqual(webhooks.get_subscription_index().endpoint_ids('loan.created'), ())
+
+    def test_unsubscribed_event_writes_nothing(self):
+        branch = Branch.objects.create(branch_name='Branch')
+        webhooks.get_subscription_index()
+        with self.assertNumQueries(0):
+            WebhookManager.trigger_webhook('branch.updated', branch)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+class DeliveryEngineTests(SimpleTestCase):
+    """DeliveryEngine against a local HTTP server"""
+
+    def setUp(self):
+        received = self.received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append((self.path, self.headers['X-Event-Type'],
+                                 self.rfile.read(int(self.headers['Content-Length']))))
+                self.send_response(200 if self.path == '/ok' else 500)
+                self.end_headers()
+                self.wfile.write(b'x' * 100)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def test_deliver(self):
+        engine = DeliveryEngine(max_workers=4, max_response_bytes=10)
+        self.addCleanup(engine.close)
+        with socket.socket() as closed:
+            closed.bind(('127.0.0.1', 0))
+            unreachable = f'http://127.0.0.1:{closed.getsockname()[1]}/'
+
+        paths = ['/ok', '/fail', '/ok', '/ok']
+        results = engine.deliver([
+            DeliveryRequest(self.base_url + path, f'{{"n":{n}}}'.encode(), {'X-Event-Type': 'test'}, timeout=5)
+            for n, path in enumerate(paths)
+        ] + [DeliveryRequest(unreachable, b'{}', {}, timeout=5)])
+
+        self.assertEqual([result.url for result in results[:4]], [self.base_url + path for path in paths])
+        self.assertEqual([result.status_code for result in results], [200, 500, 200, 200, None])
+        self.assertEqual([result.success for result in results], [True, False, True, True, False])
+        self.assertEqual({result.response_body for result in results[:4]}, {'x' * 10})
+        self.assertIsNotNone(results[4].error)
+        self.assertEqual(sorted(body for _, _, body in self.received), [b'{"n":0}', b'{"n":1}', b'{"n":2}', b'{"n":3}'])
+        self.assertEqual({event_type for _, event_type, _ in self.received}, {'test'})
+        # One pooled session per subscriber host
+        self.assertEqual(len(engine._sessions), 2)
+
+
+@override_settings(WEBHOOK_MAX_RETRIES=3, WEBHOOK_RETRY_BACKOFF=10, WEBHOOK_RETRY_BACKOFF_MAX=3600,
+                   WEBHOOK_CIRCUIT_FAILURE_THRESHOLD=5, WEBHOOK_CIRCUIT_COOLDOWN=300)
+class WebhookDispatchTests(TestCase):
+    """Dispatcher passes against a stubbed DeliveryEngine on a fixed clock"""
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.engine = StubDeliveryEngine()
+        for patcher in [
+            mock.patch('django.utils.timezone.now', side_effect=lambda: self.now),
+            mock.patch('community.webhooks.get_delivery_engine', side_effect=lambda: self.engine),
+            mock.patch('community.webhooks.random.uniform', return_value=0),
+            mock.patch.object(webhooks.logger, 'disabled', True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(webhooks.invalidate_subscription_index, WebhookEndpoint)
+
+    def event(self, payload, event_type='member.updated', object_id='1'):
+        return WebhookEvent.objects.create(event_type=event_type, model='community.member', object_id=object_id,
+                                           payload=payload)
+
+    def dispatch(self, after=0):
+        self.now += timedelta(seconds=after)
+        return WebhookManager.dispatch_pending()
+
+    def test_failed_attempt_schedules_retry_with_backoff(self):
+        endpoint = WebhookEndpoint.objects.create(url='https://hooks.example.com/', event_types=['member.*'])
+        self.engine.status_code = 503
+        self.event({'n': 1})
+
+        for attempt, delay in [(1, 5), (2, 10), (3, 20)]:
+            sent_at = self.now
+            self.dispatch()
+            retry = WebhookLog.objects.get(endpoint=endpoint, status=WebhookLog.Status.PENDING)
+            self.assertEqual(retry.attempts, attempt + 1)
+            # Full backoff is 10s doubled per attempt, at least half of it always waited
+            self.assertEqual(retry.next_attempt_at, sent_at + timedelta(seconds=delay))
+            self.assertEqual(self.dispatch(after=delay - 1), 0)
+            self.now += timedelta(seconds=1)
+
+        self.dispatch()
+        statuses = list(WebhookLog.objects.order_by('attempts').values_list('attempts', 'status'))
+        self.assertEqual(statuses, [(1, 'retried'), (2, 'retried'), (3, 'retried'), (4, 'failed')])
+        self.assertEqual(len(self.engine.requests), 4)
+
+    @override_settings(WEBHOOK_CIRCUIT_FAILURE_THRESHOLD=2)
+    def test_circuit_breaker(self):
+        endpoint = WebhookEndpoint.objects.create(url='https://hooks.example.com/', event_types=['member.*'])
+        self.engine.status_code = 500
+        self.event({'n': 1}, object_id='1')
+        self.event({'n': 2}, object_id='2')
+
+        self.dispatch()
+        endpoint.refresh_from_db()
+        self.assertEqual(endpoint.circuit_state, WebhookEndpoint.CircuitState.OPEN)
+        self.assertEqual(endpoint.consecutive_failures, 2)
+
+        # Open: due retries are parked, not sent
+        self.dispatch(after=10)
+        self.assertEqual(WebhookLog.objects.filter(status=WebhookLog.Status.PARKED).count(), 2)
+        self.assertEqual(len(self.engine.requests), 2)
+
+        # Polled through the cool-down, retries that come due keep being parked
+        for _ in range(28):
+            self.dispatch(after=10)
+        self.assertEqual(len(self.engine.requests), 2)
+
+        # After it a parked delivery goes out as the probe, with no new event; its failure re-opens the circuit
+        self.dispatch(after=10)
+        endpoint.refresh_from_db()
+        self.assertEqual(len(self.engine.requests), 3)
+        self.assertEqual(endpoint.circuit_state, WebhookEndpoint.CircuitState.OPEN)
+        self.assertEqual(endpoint.circuit_opened_at, self.now)
+
+        # A successful probe closes it and releases the parked deliveries
+        self.engine.status_code = 200
+        for _ in range(30):
+            self.dispatch(after=10)
+        endpoint.refresh_from_db()
+        self.assertEqual(endpoint.circuit_state, WebhookEndpoint.CircuitState.CLOSED)
+        self.assertEqual(endpoint.consecutive_failures, 0)
+        self.assertFalse(WebhookLog.objects.filter(status=WebhookLog.Status.PARKED).exists())
+
+        self.dispatch()
+        self.assertEqual(len(self.engine.requests), 5)
+        self.assertEqual(WebhookLog.objects.filter(status=WebhookLog.Status.DELIVERED).count(), 2)
+        self.assertFalse(WebhookLog.objects.filter(status=WebhookLog.Status.PENDING).exists())
+
+    def test_coalesced_and_batched_payloads(self):
+        WebhookEndpoint.objects.create(url='https://coalesce.example.com/', event_types=['member.*'],
+                                       coalesce_window=60)
+        WebhookEndpoint.objects.create(url='https://batch.example.com/', event_types=['member.*'],
+                                       batch_size=3, secret='s3cret')
+        for n in range(1, 4):
+            self.event({'id': 1, 'n': n}, object_id='1')
+        self.event({'id': 2, 'n': 4}, object_id='2')
+
+        self.dispatch()
+        batches = [request for request in self.engine.requests if request.url == 'https://batch.example.com/']
+        self.assertEqual([json.loads(request.body) for request in batches],
+                         [[{'id': 1, 'n': 1}, {'id': 1, 'n': 2}, {'id': 1, 'n': 3}], [{'id': 2, 'n': 4}]])
+        self.assertEqual([request.headers['X-Webhook-Batch-Size'] for request in batches], ['3', '1'])
+        self.assertEqual({request.headers['X-Event-Type'] for request in batches}, {'batch'})
+        for request in batches:
+            self.assertEqual(request.headers['X-Webhook-Signature'], WebhookManager.sign('s3cret', request.body))
+
+        # Held for the window, then only the latest state of each object goes out
+        self.assertEqual(len(self.engine.requests), 2)
+        self.event({'id': 1, 'n': 5}, object_id='1')
+        self.dispatch(after=59)
+        self.assertEqual(len(self.engine.requests), 3)
+        self.dispatch(after=1)
+        coalesced = [json.loads(request.body) for request in self.engine.requests
+                     if request.url == 'https://coalesce.example.com/']
+        self.assertEqual(sorted(coalesced, key=lambda body: body['id']), [{'id': 1, 'n': 5}, {'id': 2, 'n': 4}])
+
+    def test_payload_signed_once_per_secret(self):
+        for n in range(3):
+            WebhookEndpoint.objects.create(url=f'https://hooks{n}.example.com/', event_types=['member.*'],
+                                           secret='shared')
+        WebhookEndpoint.objects.create(url='https://other.example.com/', event_types=['member.*'], secret='own')
+        self.event({'id': 1})
+
+        with mock.patch.object(WebhookManager, 'encode_payload', wraps=WebhookManager.encode_payload) as encode, \
+                mock.patch.object(WebhookManager, 'sign', wraps=WebhookManager.sign) as sign:
+            self.dispatch()
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(sorted(call.args[0] for call in sign.call_args_list), ['own', 'shared'])
+        self.assertEqual({request.body for request in self.engine.requests}, {b'{"id":1}'})
+        self.assertEqual(len({request.headers['X-Webhook-Signature'] for request in self.engine.requests}), 2)
+
+
+class WebhookRetentionTests(TestCase):
+
+    def setUp(self):
+        self.endpoint = WebhookEndpoint.objects.create(url='https://hooks.example.com/', event_types=['*'])
+        self.cutoff = timezone.now() - timedelta(days=30)
+
+    def log(self, days_old, status=WebhookLog.Status.DELIVERED):
+        log_entry = WebhookLog.objects.create(endpoint=self.endpoint, event_type='member.created',
+                                              payload={'n': days_old}, status=status)
+        WebhookLog.objects.filter(pk=log_entry.pk).update(created_at=timezone.now() - timedelta(days=days_old))
+        return log_entry.pk
+
+    def read_archive(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            return [json.loads(line)['id'] for line in archive]
+
+    def test_archive_in_batches(self):
+        old = [self.log(40 + n) for n in range(5)]
+        kept = [self.log(40, WebhookLog.Status.PENDING), self.log(40, WebhookLog.Status.PARKED), self.log(1)]
+        remaining = []
+
+        def fsync(fd):
+            # Every batch reaches disk while its rows are still in the table
+            remaining.append(WebhookLog.objects.filter(pk__in=old).count())
+
+        with tempfile.TemporaryDirectory() as output_dir, mock.patch.object(webhook_retention.os, 'fsync', fsync):
+            archived, path = webhook_retention.archive_webhook_logs(self.cutoff, Path(output_dir), batch_size=2)
+            self.assertEqual(archived, 5)
+            self.assertEqual(self.read_archive(path), old)
+
+        self.assertEqual(remaining, [5, 3, 1])
+        self.assertEqual(sorted(WebhookLog.objects.values_list('pk', flat=True)), kept)
+
+    def test_interrupted_archive_keeps_unwritten_rows(self):
+        old = [self.log(40 + n) for n in range(5)]
+        calls = []
+
+        def fsync(fd):
+            calls.append(fd)
+            if len(calls) == 2:
+                raise OSError('disk full')
+
+        with tempfile.TemporaryDirectory() as output_dir, mock.patch.object(webhook_retention.os, 'fsync', fsync):
+            with self.assertRaises(OSError):
+                webhook_retention.archive_webhook_logs(self.cutoff, Path(output_dir), batch_size=2)
+            path, = Path(output_dir).iterdir()
+            # The first batch is readable on its own and the second was never deleted
+            self.assertEqual(self.read_archive(path)[:2], old[:2])
+
+        self.assertEqual(sorted(WebhookLog.objects.values_list('pk', flat=True)), old[2:])
+
+    def test_convert_to_partitioned(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Partitioning requires PostgreSQL')
+        table = WebhookLog._meta.db_table
+
+        def schema():
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, table)
+            return {name: (info['columns'], info['primary_key'], info['foreign_key'], info['index'])
+                    for name, info in constraints.items()}
+
+        ids = [self.log(400), self.log(1)]
+        before = schema()
+        with connection.cursor() as cursor:
+            # Check the foreign keys of the rows above now, as the conversion drops their table
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        webhook_retention.convert_to_partitioned(months_ahead=1)
+
+        self.assertTrue(webhook_retention.is_partitioned())
+        after = schema()
+        primary_key, = [name for name, info in after.items() if info[1]]
+        self.assertEqual(after.pop(primary_key)[0], ['id', 'created_at'])
+        self.assertEqual(after, {name: info for name, info in before.items() if not info[1]})
+
+        self.assertEqual(sorted(WebhookLog.objects.values_list('pk', flat=True)), ids)
+        new_id = self.log(0)
+        self.assertGreater(new_id, ids[-1])
+        self.assertEqual(WebhookLog.objects.get(pk=new_id).payload, {'n': 0})
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM "{table}_default"')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class WebhookReplayTests(TestCase):
+
+    def setUp(self):
+        self.endpoint = WebhookEndpoint.objects.create(url='https://hooks.example.com/', event_types=['*'])
+        self.addCleanup(webhooks.invalidate_subscription_index, WebhookEndpoint)
+
+    def log(self, status, event_type='member.created'):
+        return WebhookLog.objects.create(endpoint=self.endpoint, event_type=event_type, payload={'status': status},
+                                         status=status, attempts=4)
+
+    def test_replay_selected_logs(self):
+        for status in ['failed', 'failed', 'delivered', 'retried', 'pending']:
+            self.log(status)
+        self.log('failed', event_type='loan.created')
+
+        logs = webhook_replay.select_logs(endpoint=self.endpoint, event_types=['member.*'])
+        self.assertEqual(logs.count(), 2)
+        self.assertEqual(webhook_replay.select_logs(failed_only=False).count(), 4)
+
+        start = timezone.now()
+        self.assertEqual(webhook_replay.replay_logs(logs, rate=10), 2)
+        replays = list(WebhookLog.objects.filter(created_at__gte=start).order_by('next_attempt_at'))
+        self.assertEqual([(log.status, log.attempts, log.payload) for log in replays],
+                         [('pending', 1, {'status': 'failed'})] * 2)
+        self.assertEqual(replays[1].next_attempt_at - replays[0].next_attempt_at, timedelta(seconds=0.1))
+
+    def test_replay_command_date_bounds(self):
+        old = self.log('failed')
+        self.log('failed')
+        WebhookLog.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=3))
+        since = timezone.localdate() - timedelta(days=1)
+
+        out = StringIO()
+        call_command('replay_webhooks', since=str(since), dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue().strip(), '1 deliveries would be replayed')
+        call_command('replay_webhooks', until=str(since), dry_run=True, stdout=out)
+        self.assertIn('1 deliveries would be replayed', out.getvalue().splitlines()[-1])
+        with self.assertRaises(CommandError):
+            call_command('replay_webhooks', since='yesterday', dry_run=True, stdout=out)
+
+    def test_admin_redeliver(self):
+        failed = self.log('failed')
+        unfinished = [self.log(status) for status in ['pending', 'parked', 'retried']]
+        self.client.force_login(User.objects.create_superuser('admin'))
+        response = self.client.post('/admin/community/webhooklog/', {
+            'action': 'redeliver', '_selected_action': [failed.pk] + [log.pk for log in unfinished]
+        }, follow=True)
+        self.assertContains(response, 'Queued 1 deliveries for redelivery.')
+        self.assertContains(response, 'Skipped 3 deliveries that have not finished yet.')
+        self.assertEqual(WebhookLog.objects.filter(status=WebhookLog.Status.PENDING, event_type='member.created',
+                                                   payload={'status': 'failed'}).count(), 1)
+
+    def test_interrupted_backfill_resumes(self):
+        branch_ids = [Branch.objects.create(branch_name=f'Branch {n}').pk for n in range(5)]
+        reported = []
+
+        def interrupt(pk):
+            reported.append(pk)
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            webhook_replay.backfill('branch', self.endpoint, chunk_size=2, on_chunk=interrupt)
+        self.assertEqual(reported, [branch_ids[1]])
+
+        out = StringIO()
+        call_command('replay_webhooks', backfill='branch', endpoint=self.endpoint.pk, start_after=reported[-1],
+                     chunk_size=2, rate=0, stdout=out)
+        self.assertIn('Queued 3 branch.created events', out.getvalue())
+        backfilled = WebhookLog.objects.filter(event_type='branch.created').order_by('pk')
+        self.assertEqual([log.payload['data']['branch_id'] for log in backfilled], branch_ids)
+
+
+class BranchHierarchyTests(TestCase):
+
+    def setUp(self):
+        self.root = Branch.objects.create(branch_name='Root')
+        self.region = Branch.objects.create(branch_name='Region', branch_parent=self.root)
+        self.district = Branch.objects.create(branch_name='District', branch_parent=self.region)
+        self.local = Branch.objects.create(branch_name='Local', branch_parent=self.district)
+        self.other_root = Branch.objects.create(branch_name='Other root')
+
+    def paths(self):
+        return dict(Branch.objects.values_list('branch_name', 'path'))
+
+    def test_reparent_rewrites_subtree_paths(self):
+        self.region.branch_parent = self.other_root
+        self.region.save()
+
+        moved = f'/{self.other_root.pk}/{self.region.pk}/'
+        self.assertEqual(self.paths(), {
+            'Root': f'/{self.root.pk}/', 'Other root': f'/{self.other_root.pk}/', 'Region': moved,
+            'District': f'{moved}{self.district.pk}/', 'Local': f'{moved}{self.district.pk}/{self.local.pk}/',
+        })
+        self.assertEqual(set(Branch.objects.descendants_of(self.root)), {self.root})
+        self.assertEqual(set(Branch.objects.descendants_of(self.other_root, include_self=False)),
+                         {self.region, self.district, self.local})
+        self.local.refresh_from_db()
+        self.assertEqual(set(Branch.objects.ancestors_of(self.local)), {self.other_root, self.region, self.district})
+
+        deposit = Deposit.objects.create(branch=self.local, name='Fund', min_amount=10)
+        self.assertFalse(Deposit.objects.in_branch_subtree(self.root).exists())
+        self.assertEqual(list(Deposit.objects.in_branch_subtree(self.other_root)), [deposit])
+
+    def test_cannot_move_under_own_subtree(self):
+        before = self.paths()
+        self.region.branch_parent = self.local
+        with self.assertRaises(ValueError):
+            self.region.save()
+        self.assertEqual(self.paths(), before)
+
+    def test_delete_promotes_sub_branches_to_roots(self):
+        self.region.delete()
+        paths = self.paths()
+        self.assertEqual(paths['District'], f'/{self.district.pk}/')
+        self.assertEqual(paths['Local'], f'/{self.district.pk}/{self.local.pk}/')
+
+
+class QueryBudgetTests(APITestCase):
+    """
+    Every list and detail endpoint must cost a fixed number of queries,
+    however many rows and related users a page holds.
+    """
+    ROWS = 3
+
+    # endpoint -> (list budget, detail budget); a page-numbered list is count + page,
+    # a cursor-paginated one is the page alone, and endpoints with ETags add one aggregate
+    BUDGETS = {
+        'branches': (3, 2),
+        'members': (2, 1),
+        'announcements': (2, 2),
+        'events': (2, 2),
+        'payments': (1, 1),
+        'deposits': (3, 2),
+        'member-deposits': (2, 1),
+        'loans': (3, 2),
+        'member-loans': (2, 1),
+        'minutes': (3, 2),
+        'feedback': (1, 1),
+        'messages': (1, 1),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('budget', is_staff=True)
+        root = Branch.objects.create(branch_name='Root')
+        now = timezone.now()
+        today = date.today()
+
+        for i in range(cls.ROWS):
+            author = User.objects.create_user(f'author{i}')
+            editor = User.objects.create_user(f'editor{i}')
+            branch = Branch.objects.create(branch_name=f'Branch {i}', branch_parent=root)
+            member = Member.objects.create(user=author, branch=branch)
+
+            Announcement.objects.create(
+                title=f'Announcement {i}', content='...', branch=branch, start_date=today,
+                end_date=today + timedelta(days=7), created_by=author, updated_by=editor
+            )
+            Event.objects.create(
+                title=f'Event {i}', description='...', branch=branch, start_time=now,
+                end_time=now + timedelta(hours=2), created_by=author, updated_by=editor
+            )
+            MemberPayment.objects.create(user=member, payment_amount=100, payment_date=today, created_by=member)
+            deposit = Deposit.objects.create(branch=branch, name=f'Deposit {i}', min_amount=10, updated_by=member)
+            MemberDeposit.objects.create(member=member, deposit=deposit, total_deposit_amount=100, created_by=member)
+            loan = Loan.objects.create(loan_name=f'Loan {i}', loan_branch=branch, interest_rate=10,
+                                       status='active', updated_by=member)
+            MemberLoan.objects.create(user=member, loan=loan, loan_amount=1000, disbursement_date=today,
+                                      interest_amount=100, created_by=member)
+            Minute.objects.create(meeting_date=today, adopted=True, content='...', venue=f'Hall {i}',
+                                  created_by=author, adopter1=editor, adopter2=cls.user)
+            Feedback.objects.create(feedback_content='...', created_by=author)
+            Message.objects.create(sender=author, receiver=cls.user, content='...')
+
+    def setUp(self):
+        # force_authenticate keeps authentication out of the query count
+        self.client.force_authenticate(self.user)
+        response_cache.get_cache().clear()
+
+    def test_list_endpoints(self):
+        for endpoint, (list_budget, _) in self.BUDGETS.items():
+            with self.subTest(endpoint=endpoint), self.assertNumQueries(list_budget), warnings.catch_warnings():
+                # Paginating an unordered queryset can repeat or skip rows between pages
+                warnings.simplefilter('error', UnorderedObjectListWarning)
+                response = self.client.get(f'/{endpoint}/')
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.data['results'])
+
+    def test_detail_endpoints(self):
+        for endpoint, (_, detail_budget) in self.BUDGETS.items():
+            pk = self.client.get(f'/{endpoint}/').data['results'][0]
+            pk = next(iter(pk.values()))
+            with self.subTest(endpoint=endpoint), self.assertNumQueries(detail_budget):
+                response = self.client.get(f'/{endpoint}/{pk}/')
+                self.assertEqual(response.status_code, 200)
+
+    def test_branch_tree(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/branches/?tree=1')
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data[0]['child_branches']), self.ROWS)
+
+    def test_cursor_pagination(self):
+        seen = []
+        url = '/payments/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [row['payment_id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, sorted(MemberPayment.objects.values_list('payment_id', flat=True), reverse=True))
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/payments/?count=1')
+        self.assertEqual(response.data['count'], self.ROWS)
+
+    def test_member_subresources(self):
+        member = Member.objects.order_by('pk').first()
+
+        for action in ['loans', 'deposits']:
+            with self.subTest(action=action), self.assertNumQueries(2):
+                response = self.client.get(f'/members/{member.pk}/{action}/')
+            self.assertEqual(response.data['count'], 1)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/members/{member.pk}/summary/')
+        self.assertEqual(response.data['finances']['total_savings'], '200.00')
+        self.assertEqual(response.data['finances']['total_loans'], '1000.00')
+        self.assertEqual(response.data['loans']['open_count'], 1)
+        self.assertEqual(response.data['loans']['principal_outstanding'], '1000.00')
+        self.assertEqual(response.data['deposits']['total_deposited'], '100.00')
+
+        self.assertEqual(self.client.get('/members/0/loans/').status_code, 404)
+        self.assertEqual(self.client.get('/members/0/summary/').status_code, 404)
+        for action in ['', 'finances/', 'loans/', 'deposits/', 'summary/']:
+            self.assertEqual(self.client.get(f'/members/abc/{action}').status_code, 404)
+
+
+class MemberFinancesTests(TestCase):
+
+    def test_totals_follow_writes_and_match_recompute(self):
+        branch = Branch.objects.create(branch_name='Branch')
+        member = Member.objects.create(user=User.objects.create_user('saver'), branch=branch)
+        deposit = Deposit.objects.create(branch=branch, name='Savings', min_amount=10)
+        loan = Loan.objects.create(loan_name='Loan', loan_branch=branch, interest_rate=10, status='active')
+
+        member_deposit = MemberDeposit.objects.create(member=member, deposit=deposit, total_deposit_amount=100,
+                                                      created_by=member)
+        MemberPayment.objects.create(user=member, payment_amount=25, payment_date=date.today(), created_by=member)
+        member_loan = MemberLoan.objects.create(user=member, loan=loan, loan_amount=1000, disbursement_date=date.today(),
+                                                interest_amount=100, principal_paid=100, created_by=member)
+        refund = ledger.post_loan_refund(member_loan, Decimal('200'), deposit)
+        member_deposit.total_deposit_amount = 150
+        member_deposit.save()
+
+        # The refund starts from what earlier repayments left, and counts once
+        self.assertEqual((refund.previous_balance, refund.new_balance), (900, 700))
+        member_loan.refresh_from_db()
+        self.assertEqual(member_loan.principal_paid, 300)
+        self.assertEqual(ledger.loan_balance(member_loan), 700)
+        finances = MemberFinances.objects.get(user=member)
+        self.assertEqual((finances.total_savings, finances.total_loans), (175, 700))
+
+        MemberFinances.objects.filter(user=member).update(total_savings=0, total_loans=0)
+        call_command('recompute_finances', '--workers', '1', stdout=StringIO())
+        finances.refresh_from_db()
+        self.assertEqual((finances.total_savings, finances.total_loans), (175, 700))
+
+        member_loan.delete()
+        finances.refresh_from_db()
+        self.assertEqual(finances.total_loans, 0)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class LedgerConcurrencyTests(TransactionTestCase):
+    """Parallel writers on one account must still produce a gapless, consistent ledger"""
+    WRITERS = 8
+    POSTINGS = 10
+
+    def test_parallel_postings(self):
+        branch = Branch.objects.create(branch_name='Branch')
+        member = Member.objects.create(user=User.objects.create_user('borrower'), branch=branch)
+        deposit = Deposit.objects.create(branch=branch, name='Fund', min_amount=10)
+        loan = Loan.objects.create(loan_name='Loan', loan_branch=branch, interest_rate=10, status='active')
+        member_loan = MemberLoan.objects.create(user=member, loan=loan, loan_amount=1000,
+                                                disbursement_date=date.today(), interest_amount=0, created_by=member)
+
+        barrier = threading.Barrier(self.WRITERS)
+        errors = []
+
+        def writer():
+            try:
+                barrier.wait()
+                for _ in range(self.POSTINGS):
+                    ledger.post_deposit_payment(deposit, Decimal('1.50'))
+                    ledger.post_loan_refund(member_loan, Decimal('2.00'), deposit)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.WRITERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        total = self.WRITERS * self.POSTINGS
+        for entries, opening in [
+            (list(DepositPayment.objects.filter(deposit=deposit).order_by('sequence')), Decimal('0')),
+            (list(LoanRefund.objects.filter(member_loan=member_loan).order_by('sequence')), Decimal('1000')),
+        ]:
+            self.assertEqual([entry.sequence for entry in entries], list(range(1, total + 1)))
+            balance = opening
+            for entry in entries:
+                self.assertEqual(entry.previous_balance, balance)
+                balance = entry.new_balance
+
+        self.assertEqual(ledger.deposit_balance(deposit), Decimal('1.50') * total)
+        self.assertEqual(ledger.loan_balance(member_loan), 1000 - Decimal('2.00') * total)
+        self.assertEqual(MemberFinances.objects.get(user=member).total_loans, 1000 - Decimal('2.00') * total)
+
+
+class ResponseCacheTests(APITestCase):
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.user = User.objects.create_user('reader', is_staff=True)
+        self.client.force_authenticate(self.user)
+        self.branch = Branch.objects.create(branch_name='Branch')
+        today = date.today()
+        self.announcements = [
+            Announcement.objects.create(title=f'Announcement {i}', content='...', branch=self.branch,
+                                        start_date=today, end_date=today, created_by=self.user)
+            for i in range(2)
+        ]
+
+    def test_repeated_reads_are_served_from_cache(self):
+        hits = response_cache.cache_stats().get('loan.list', {}).get('hits', 0)
+        Loan.objects.create(loan_name='Loan', loan_branch=self.branch, interest_rate=10, status='active')
+        first = self.client.get('/loans/?page_size=5')
+        with self.assertNumQueries(0):
+            second = self.client.get('/loans/?page_size=5')
+
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.client.get('/loans/?page_size=6')['X-Cache'], 'MISS')
+        self.assertEqual(response_cache.cache_stats()['loan.list']['hits'], hits + 1)
+
+    def test_change_drops_lists_and_changed_object_only(self):
+        changed, other = self.announcements
+        for url in ['/announcements/', f'/announcements/{changed.pk}/', f'/announcements/{other.pk}/']:
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/announcements/{changed.pk}/', {'title': 'Renamed'}, format='json')
+
+        response = self.client.get(f'/announcements/{changed.pk}/')
+        self.assertEqual((response['X-Cache'], response.data['title']), ('MISS', 'Renamed'))
+        self.assertEqual(self.client.get('/announcements/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(f'/announcements/{other.pk}/')['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/announcements/{other.pk}/')
+        self.assertEqual(self.client.get(f'/announcements/{other.pk}/').status_code, 404)
+
+    def test_branch_change_drops_tree(self):
+        child = Branch.objects.create(branch_name='Child', branch_parent=self.branch)
+        self.client.get('/branches/?tree=1')
+        self.assertEqual(self.client.get('/branches/?tree=1')['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/branches/{child.pk}/', {'branch_name': 'Renamed'}, format='json')
+
+        response = self.client.get('/branches/?tree=1')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data[0]['child_branches'][0]['branch_name'], 'Renamed')
+
+    def test_branch_move_drops_subtree_lists(self):
+        other = Branch.objects.create(branch_name='Other')
+        Deposit.objects.create(branch=self.branch, name='Savings', min_amount=10)
+        Loan.objects.create(loan_name='Loan', loan_branch=self.branch, interest_rate=10, status='active')
+        urls = [f'/{name}/?branch_subtree={other.pk}' for name in ['deposits', 'loans', 'announcements']]
+        self.assertEqual([len(self.client.get(url).data['results']) for url in urls], [0, 0, 0])
+
+        # Moved outside the API: none of the listed rows changes, only the tree
+        with self.captureOnCommitCallbacks(execute=True):
+            self.branch.branch_parent = other
+            self.branch.save()
+        responses = [self.client.get(url) for url in urls]
+        self.assertEqual([response['X-Cache'] for response in responses], ['MISS'] * 3)
+        self.assertEqual([len(response.data['results']) for response in responses], [1, 1, 2])
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.user = User.objects.create_user('reader')
+        self.client.force_authenticate(self.user)
+        branch = Branch.objects.create(branch_name='Branch')
+        self.event = Event.objects.create(title='Event', description='...', branch=branch, start_time=timezone.now(),
+                                          end_time=timezone.now() + timedelta(hours=1), created_by=self.user)
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.client.get('/events/')['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get('/events/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.client.patch(f'/events/{self.event.pk}/', {'title': 'Moved'}, format='json')
+        response = self.client.get('/events/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        self.event.delete()
+        self.assertEqual(self.client.get('/events/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_subtree_list_not_modified_without_branch_lookup(self):
+        other = Branch.objects.create(branch_name='Other')
+        url = f'/events/?branch_subtree={other.pk}'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Moving a branch changes the list, though no event changes
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.branch.branch_parent = other
+            self.event.branch.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_detail_validators(self):
+        response = self.client.get(f'/events/{self.event.pk}/')
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.client.get(f'/events/{self.event.pk}/',
+                                         HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(f'/events/{self.event.pk}/?format=api',
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get('/events/0/').status_code, 404)
+
+    def test_branch_etag_follows_cache_generation(self):
+        etag = self.client.get('/branches/?tree=1')['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/branches/?tree=1', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/branches/', {'branch_name': 'New'}, format='json')
+        self.assertEqual(self.client.get('/branches/?tree=1', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class SyncTests(APITransactionTestCase):
+    """Transactional, since on PostgreSQL /sync/ only returns changes of committed transactions"""
+
+    def setUp(self):
+        root = Branch.objects.create(branch_name='Root')
+        self.branch = Branch.objects.create(branch_name='Branch', branch_parent=root)
+        self.other_branch = Branch.objects.create(branch_name='Other', branch_parent=root)
+        self.user = User.objects.create_user('member')
+        Member.objects.create(user=self.user, branch=self.branch)
+        self.sender = User.objects.create_user('sender')
+        self.client.force_authenticate(self.user)
+        self.token = self.client.get('/sync/').data['token']
+
+    def sync(self):
+        response = self.client.get(f'/sync/?since={self.token}')
+        self.token = response.data['token']
+        return {(change['model'], change['action']): change['data'] for change in response.data['changes']}
+
+    def announce(self, branch):
+        response = self.client.post('/announcements/', {
+            'title': 'Meeting', 'content': '...', 'branch': branch.pk,
+            'start_date': str(date.today()), 'end_date': str(date.today())
+        }, format='json')
+        return response.data['announcement_id']
+
+    def test_changes_in_scope_since_token(self):
+        announcement_id = self.announce(self.branch.branch_parent)
+        self.announce(self.other_branch)
+        with transaction.atomic():
+            message = Message.objects.create(sender=self.sender, receiver=self.user, subject='Hi', content='...')
+            WebhookManager.trigger_webhook('message.sent', message)
+
+        changes = self.sync()
+        self.assertEqual(set(changes), {('announcement', 'created'), ('message', 'created')})
+        self.assertEqual(changes['announcement', 'created']['announcement_id'], announcement_id)
+        self.assertEqual(self.sync(), {})
+
+        self.client.patch(f'/announcements/{announcement_id}/', {'branch': self.other_branch.pk}, format='json')
+        self.client.delete(f'/messages/{message.pk}/')
+        self.assertEqual(self.sync(), {('announcement', 'deleted'): None, ('message', 'deleted'): None})
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_journal_writes_of_one_object_serialise(self):
+        announcement = Announcement.objects.get(pk=self.announce(self.branch))
+        locked, release = threading.Event(), threading.Event()
+
+        def holder():
+            try:
+                with transaction.atomic():
+                    Announcement.objects.select_for_update().get(pk=announcement.pk)
+                    locked.set()
+                    release.wait(5)
+            finally:
+                connections.close_all()
+
+        def writer():
+            try:
+                sync.record_change(announcement, sync.SyncChange.Action.UPDATED)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=holder), threading.Thread(target=writer)]
+        threads[0].start()
+        locked.wait(5)
+        threads[1].start()
+        threads[1].join(0.5)
+        self.assertTrue(threads[1].is_alive())
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sync.SyncChange.objects.filter(action=sync.SyncChange.Action.UPDATED).count(), 1)
+
+    def test_paging_and_expired_tokens(self):
+        for _ in range(3):
+            self.announce(self.branch)
+        with override_settings(SYNC_PAGE_SIZE=2):
+            first = self.client.get(f'/sync/?since={self.token}').data
+            second = self.client.get(f'/sync/?since={first["token"]}').data
+        self.assertEqual((len(first['changes']), first['has_more']), (2, True))
+        self.assertEqual((len(second['changes']), second['has_more']), (1, False))
+
+        sync.SyncChange.objects.update(changed_at=timezone.now() - timedelta(days=100))
+        self.announce(self.branch)
+        self.assertEqual(sync.prune(days=90), 3)
+        self.assertEqual(self.client.get(f'/sync/?since={first["token"]}').status_code, 410)
+        self.assertEqual(self.client.get(f'/sync/?since={self.client.get("/sync/").data["token"]}').status_code, 200)
+        self.assertEqual(self.client.get('/sync/?since=nonsense').status_code, 400)
+
+
+class IdempotencyKeyTests(APITestCase):
+
+    def setUp(self):
+        branch = Branch.objects.create(branch_name='Branch')
+        self.user = User.objects.create_user('payer')
+        self.member = Member.objects.create(user=self.user, branch=branch)
+        self.client.force_authenticate(self.user)
+        self.payload = {'user': self.member.pk, 'payment_amount': '50.00', 'payment_date': str(date.today()),
+                        'created_by': self.member.pk}
+
+    def test_retry_replays_stored_response(self):
+        first = self.client.post('/payments/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        with self.assertNumQueries(1):
+            retry = self.client.post('/payments/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(MemberPayment.objects.count(), 1)
+
+    def test_key_reused_for_different_request(self):
+        self.client.post('/payments/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        response = self.client.post('/payments/', {**self.payload, 'payment_amount': '60.00'}, format='json',
+                                    HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(MemberPayment.objects.count(), 1)
+
+
+class AmortizationTests(APITestCase):
+
+    def setUp(self):
+        branch = Branch.objects.create(branch_name='Branch')
+        self.member = Member.objects.create(user=User.objects.create_user('borrower'), branch=branch)
+        self.loan = Loan.objects.create(loan_name='Loan', loan_branch=branch, interest_rate=12.1, status='active',
+                                        interest_method=Loan.InterestMethod.REDUCING, term_months=24)
+        self.member_loan = MemberLoan.objects.create(user=self.member, loan=self.loan, loan_amount=10000,
+                                                     disbursement_date=date(2026, 1, 31), interest_amount=0,
+                                                     created_by=self.member)
+        self.client.force_authenticate(self.member.user)
+
+    def test_schedule_endpoint(self):
+        response = self.client.get(f'/member-loans/{self.member_loan.pk}/schedule/')
+        installments = response.data['installments']
+
+        self.assertEqual(len(installments), 24)
+        self.assertEqual(installments[0]['due_date'], '2026-02-28')
+        self.assertEqual(sum(Decimal(row['principal']) for row in installments), 10000)
+        self.assertEqual(installments[-1]['balance'], '0.00')
+
+    def test_accrual_matches_schedule(self):
+        call_command('accrue_loan_interest', '--as-of', '2026-04-30', stdout=StringIO())
+        self.member_loan.refresh_from_db()
+
+        due = self.client.get(f'/member-loans/{self.member_loan.pk}/schedule/').data['installments'][:3]
+        self.assertEqual(self.member_loan.accrued_principal, sum(Decimal(row['principal']) for row in due))
+        self.assertEqual(self.member_loan.accrued_interest, sum(Decimal(row['interest']) for row in due))
+
+
+class DepositInterestTests(TestCase):
+
+    def test_accrual_is_idempotent_per_period(self):
+        branch = Branch.objects.create(branch_name='Branch')
+        member = Member.objects.create(user=User.objects.create_user('saver'), branch=branch)
+        deposit = Deposit.objects.create(branch=branch, name='Savings', min_amount=10, interest_rate=Decimal('6'))
+        member_deposit = MemberDeposit.objects.create(member=member, deposit=deposit, total_deposit_amount=1000,
+                                                      created_by=member)
+        MemberDeposit.objects.filter(pk=member_deposit.pk).update(created_at=timezone.now() - timedelta(days=400))
+
+        for _ in range(2):
+            call_command('accrue_deposit_interest', '--period', '2026-09', '--workers', '1', stdout=StringIO())
+        member_deposit.refresh_from_db()
+        self.assertEqual(member_deposit.interest_earned, Decimal('5.00'))
+
+        call_command('accrue_deposit_interest', '--period', '2026-10', '--workers', '1', stdout=StringIO())
+        member_deposit.refresh_from_db()
+        self.assertEqual(member_deposit.interest_earned, Decimal('10.03'))
+        self.assertEqual(member_deposit.accrued_principal, Decimal('1010.03'))
+
+        # Skipped months are accrued first, in order; a month before them can no longer be
+        call_command('accrue_deposit_interest', '--period', '2026-12', '--workers', '1', stdout=StringIO())
+        self.assertEqual(list(DepositAccrualCheckpoint.objects.filter(deposit=deposit).order_by('period').values_list(
+            'period', flat=True)), [date(2026, month, 1) for month in range(9, 13)])
+        member_deposit.refresh_from_db()
+        self.assertEqual(member_deposit.interest_earned, Decimal('20.16'))
+
+        call_command('accrue_deposit_interest', '--period', '2026-11', '--workers', '1', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('accrue_deposit_interest', '--period', '2026-08', '--workers', '1', stdout=StringIO())
+        member_deposit.refresh_from_db()
+        self.assertEqual(member_deposit.interest_earned, Decimal('20.16'))
+
+
+class StatementTests(APITestCase):
+
+    def setUp(self):
+        self.branch = Branch.objects.create(branch_name='Branch')
+        self.member = Member.objects.create(user=User.objects.create_user('saver'), branch=self.branch)
+        for day, amount in [(date(2026, 1, 10), 100), (date(2026, 2, 10), 50), (date(2026, 3, 10), 25)]:
+            MemberPayment.objects.create(user=self.member, payment_amount=amount, payment_date=day,
+                                         created_by=self.member)
+        loan = Loan.objects.create(loan_name='Loan', loan_branch=self.branch, interest_rate=10, status='active')
+        member_loan = MemberLoan.objects.create(user=self.member, loan=loan, loan_amount=1000, interest_amount=0,
+                                                disbursement_date=date(2026, 2, 1), created_by=self.member)
+        deposit = Deposit.objects.create(branch=self.branch, name='Savings', min_amount=10)
+        ledger.post_loan_refund(member_loan, Decimal('200'), deposit)
+        self.client.force_authenticate(self.member.user)
+
+    def test_csv_statement(self):
+        response = self.client.get(f'/members/{self.member.pk}/statement/?from=2026-02-01&to=2026-12-31&format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+        self.assertEqual(rows[2][1:], ['Opening balance', '', '', '', '100.00', '0.00'])
+        self.assertEqual([row[1] for row in rows[3:-1]], ['Loan', 'Payment', 'Payment', 'Loan refund'])
+        self.assertEqual(rows[-1][5:], ['175.00', '800.00'])
+
+    def test_pdf_statement(self):
+        response = self.client.get(f'/members/{self.member.pk}/statement/?format=pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        content = b''.join(response.streaming_content)
+
+        self.assertTrue(content.startswith(b'%PDF-1.4'))
+        xref = int(content.rsplit(b'startxref', 1)[1].split()[0])
+        self.assertTrue(content[xref:].startswith(b'xref'))
+
+    def test_invalid_period(self):
+        response = self.client.get(f'/members/{self.member.pk}/statement/?from=2026-13-01&format=csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('from', response.json())
+
+    def test_branch_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'statements.zip')
+            call_command('export_statements', self.branch.pk, '--format', 'csv', '--output', output,
+                         '--workers', '1', stdout=StringIO())
+            with zipfile.ZipFile(output) as archive:
+                self.assertEqual(len(archive.namelist()), 1)
+                self.assertIn(b'Closing balance', archive.read(archive.namelist()[0]))
+
+
+class MemberSearchTests(APITestCase):
+
+    def setUp(self):
+        self.branch = Branch.objects.create(branch_name='Douala')
+        self.margaret = Member.objects.create(
+            user=User.objects.create_user('mngo', first_name='Margaret', last_name='Ngo'),
+            branch=self.branch, phone_number='+237 650123456'
+        )
+        Member.objects.create(user=User.objects.create_user('pfon', first_name='Paul', last_name='Fon'),
+                              branch=Branch.objects.create(branch_name='Yaounde'))
+        self.client.force_authenticate(self.margaret.user)
+
+    def search(self, query):
+        return [member['id'] for member in self.client.get('/members/', {'q': query}).data['results']]
+
+    def test_prefix_and_field_matches(self):
+        self.assertEqual(self.search('marg'), [self.margaret.pk])
+        self.assertEqual(self.search('ngo marg'), [self.margaret.pk])
+        self.assertEqual(self.search('650123'), [self.margaret.pk])
+        self.assertEqual(len(self.search('')), 2)
+
+    def test_admin_search(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        for url, query in [('/admin/community/member/', 'marg'), ('/admin/auth/user/', 'mngo')]:
+            with self.subTest(url=url):
+                response = self.client.get(url, {'q': query})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_index_follows_renames(self):
+        self.branch.branch_name = 'Bamenda'
+        self.branch.save()
+        user = self.margaret.user
+        user.last_name = 'Tanyi'
+        user.save()
+
+        self.assertEqual(self.search('bamenda tanyi'), [self.margaret.pk])
+        self.assertEqual(self.search('douala'), [])
+
+    def test_typo_tolerance(self):
+        if not search.trigram_available():
+            self.skipTest('Typo tolerance needs pg_trgm')
+        self.assertEqual(self.search('margeret'), [self.margaret.pk])
+
+    def test_short_prefix_in_directory_order(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Prefix matching is PostgreSQL-only')
+        paul = self.search('pfon')
+        members = [Member.objects.create(user=User.objects.create_user(name, last_name='Fongang')).pk
+                   for name in ['pfa', 'mfo', 'afon']]
+        # 'fo' prefixes Paul Fon and the Fongangs, in order of search text, which starts with the username
+        self.assertEqual(self.search('fo'), [members[2], members[1], members[0]] + paul)
+
+
+class SiteSearchTests(APITestCase):
+
+    def setUp(self):
+        root = Branch.objects.create(branch_name='Root')
+        branch = Branch.objects.create(branch_name='Branch', branch_parent=root)
+        other = Branch.objects.create(branch_name='Other')
+        self.member = Member.objects.create(user=User.objects.create_user('reader'), branch=branch)
+
+        self.minute = Minute.objects.create(meeting_date=date(2026, 3, 1), adopted=True, venue='Hall',
+                                            content='After discussion we voted on the loan rate for 2026.')
+        Announcement.objects.create(title='Loan rate', content='Regional loan rate update', branch=root,
+                                    start_date=date(2026, 1, 1), end_date=date(2026, 12, 31))
+        Announcement.objects.create(title='Loan rate', content='Not for this branch', branch=other,
+                                    start_date=date(2026, 1, 1), end_date=date(2026, 12, 31))
+        self.client.force_authenticate(self.member.user)
+
+    def search(self, query, **params):
+        response = self.client.get('/search/', {'q': query, **params})
+        return [(result['kind'], result['object_id']) for result in response.data['results']]
+
+    def test_results_are_limited_to_visible_branches(self):
+        results = self.search('loan rate')
+        self.assertEqual(len(results), 2)
+        self.assertIn(('minute', self.minute.pk), results)
+        self.assertEqual(self.search('loan rate', kind='minute'), [('minute', self.minute.pk)])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.minute.content = 'The treasurer presented the budget.'
+        self.minute.save()
+        self.assertEqual(self.search('treasurer'), [('minute', self.minute.pk)])
+
+        self.minute.delete()
+        self.assertEqual(self.search('treasurer'), [])
+
+    def test_document_text_is_extracted(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            document = Document.objects.create(
+                branch=self.member.branch, file_name='bylaws.txt', file_type='text/plain', uploaded_by=self.member,
+                doc_content=SimpleUploadedFile('bylaws.txt', b'Members elect the treasurer every two years.')
+            )
+            self.assertEqual(self.search('treasurer'), [])
+
+            call_command('index_documents', '--once', stdout=StringIO())
+        response = self.client.get('/search/', {'q': 'treasurer'})
+        self.assertEqual(response.data['results'][0]['object_id'], document.pk)
+        self.assertIn('<mark>', response.data['results'][0]['snippet'])
+
+    def test_pdf_text_extraction(self):
+        pdf = b''.join(statements.PDFWriter().stream(['Minutes (draft)', 'Loan rate set to 12%']))
+        text = document_text.extract_text(pdf, 'minutes.pdf')
+        self.assertEqual(text.split(), 'Minutes (draft) Loan rate set to 12%'.split())
+
+    def test_pdf_composite_fonts_skipped(self):
+        content = b'BT /F1 12 Tf (Treasurer) Tj /F2 12 Tf <00360037> Tj ET'
+        pdf = (b'%%PDF-1.5\n'
+               b'1 0 obj << /Type /Page /Resources << /Font 2 0 R >> /Contents 5 0 R >> endobj\n'
+               b'2 0 obj << /F1 3 0 R /F2 4 0 R >> endobj\n'
+               b'3 0 obj << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >> endobj\n'
+               b'6 0 obj << /Type /ObjStm /N 1 /First 4 /Length 60 >>\nstream\n'
+               b'4 0 << /Type /Font /Subtype /Type0 /Encoding /Identity-H >>\nendstream endobj\n'
+               b'5 0 obj << /Length %d >>\nstream\n%s\nendstream endobj\n%%%%EOF' % (len(content), content))
+        self.assertEqual(document_text.extract_text(pdf, 'cid.pdf').split(), ['Treasurer'])
+
+    def test_pdf_inflation_capped(self):
+        stream = zlib.compress(b'(word) Tj ' * 100000)
+        pdf = b'%%PDF-1.4\n1 0 obj << /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream endobj\n' % (
+            len(stream), stream)
+        with mock.patch.object(document_text, 'MAX_STREAM_BYTES', 1000):
+            # 1000 bytes hold 100 of the 10-byte '(word) Tj ' operations
+            self.assertEqual(document_text.extract_text(pdf, 'bomb.pdf'), 'word' * 100)
+        with mock.patch.object(document_text, 'MAX_INFLATED_BYTES', 0), \
+                mock.patch.object(document_text.logger, 'disabled', True):
+            self.assertEqual(document_text.extract_text(pdf, 'bomb.pdf'), '')
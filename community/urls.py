@@ -16,6 +16,9 @@ router.register(r'documents', views.DocumentViewSet)
 router.register(r'minutes', views.MinuteViewSet)
 router.register(r'feedback', views.FeedbackViewSet)
 router.register(r'messages', views.MessageViewSet)
+router.register(r'search', views.SearchViewSet, basename='search')
+router.register(r'sync', views.SyncViewSet, basename='sync')
+router.register(r'cache-stats', views.CacheStatsViewSet, basename='cache-stats')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,22 +1,107 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import viewsets, status, mixins, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from .models import *
 from .serializers import *
 from .webhooks import WebhookManager
+from . import amortization, response_cache, statements, sync
+from .mixins import (
+    AtomicWriteMixin, ConditionalGetMixin, IdempotentCreateMixin, RelatedFieldsMixin, ResponseCacheMixin
+)
+from .pagination import KeysetPagination
+from .renderers import CSVStatementRenderer, PDFStatementRenderer
+from .search import MemberSearchFilter, SearchEntry
 from . import models
 from .models import Announcement, Message
 from .permissions import IsAdminUser, IsOwnerOrAdminForMessage
 from .serializers import UserSerializer, AnnouncementSerializer, MessageSerializer
 
 
-class BranchViewSet(viewsets.ModelViewSet):
-    queryset = Branch.objects.all()
+class BranchSubtreeFilterMixin:
+    """`?branch_subtree=<id>` limits results to that branch and all of its sub-branches"""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        branch_id = self.request.query_params.get('branch_subtree', None)
+        if branch_id is not None:
+            try:
+                branch = Branch.objects.get(pk=branch_id)
+            except (Branch.DoesNotExist, ValueError):
+                raise ValidationError({'branch_subtree': 'Unknown branch.'})
+            queryset = queryset.in_branch_subtree(branch)
+        return queryset
+
+
+class BranchViewSet(IdempotentCreateMixin, AtomicWriteMixin, ConditionalGetMixin, ResponseCacheMixin,
+                    viewsets.ModelViewSet):
+    """
+    Branches with their sub-branches nested under `child_branches`.
+
+    The whole hierarchy is loaded in one query and assembled in memory.
+    `?tree=1` returns only the root branches, unpaginated, with the full tree
+    nested below them; `?depth=N` limits nesting to N levels in either mode.
+    A branch's response shows its sub-branches, so any branch change drops
+    every cached branch response. Branches have no modification time, so
+    their ETag is the response cache generation.
+    """
+    queryset = Branch.objects.order_by('branch_id')
     serializer_class = BranchSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_scope = 'shared'
+    cache_per_object = False
+    last_modified_field = None
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve'):
+            context['children_map'] = self._children_map()
+            context['depth'] = self._requested_depth()
+        return context
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('tree', '').lower() not in ('1', 'true', 'yes'):
+            return super().list(request, *args, **kwargs)
+        return self.conditional_response(request, self.get_queryset(), self._cached_tree, *args, **kwargs)
+
+    def _cached_tree(self, request, *args, **kwargs):
+        return self.cached_response(request, self._tree, *args, **kwargs)
+
+    def _tree(self, request, *args, **kwargs):
+        context = self.get_serializer_context()
+        roots = context['children_map'].get(None, [])
+        return Response(self.get_serializer_class()(roots, many=True, context=context).data)
+
+    def _children_map(self):
+        if not hasattr(self, '_branch_children'):
+            self._branch_children = defaultdict(list)
+            for branch in Branch.objects.order_by('branch_id'):
+                self._branch_children[branch.branch_parent_id].append(branch)
+        return self._branch_children
+
+    def _requested_depth(self):
+        depth = self.request.query_params.get('depth')
+        if depth is None:
+            return None
+        try:
+            depth = int(depth)
+        except ValueError:
+            depth = -1
+        if depth < 0:
+            raise ValidationError({'depth': 'Must be a non-negative integer.'})
+        return depth
 
     def perform_create(self, serializer):
         instance = serializer.save()
@@ -31,10 +116,15 @@ class BranchViewSet(viewsets.ModelViewSet):
         instance.delete()
 
 
-class MemberViewSet(viewsets.ModelViewSet):
-    queryset = Member.objects.all()
+class MemberViewSet(IdempotentCreateMixin, AtomicWriteMixin, RelatedFieldsMixin, BranchSubtreeFilterMixin,
+                    viewsets.ModelViewSet):
+    queryset = Member.objects.order_by('pk')
     serializer_class = MemberSerializer
     permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [MemberSearchFilter]
+    select_related_fields = ['user']
+    # The sub-resource actions use the id as given, so anything but digits must 404 at routing
+    lookup_value_regex = r'\d+'
 
     def perform_create(self, serializer):
         instance = serializer.save()
@@ -44,11 +134,13 @@ class MemberViewSet(viewsets.ModelViewSet):
         instance = serializer.save()
         WebhookManager.trigger_webhook('member.updated', instance)
 
+    # The sub-resource actions filter on the member id directly instead of
+    # loading the member through get_object() first
+
     @action(detail=True, methods=['get'])
     def finances(self, request, pk=None):
-        member = self.get_object()
         try:
-            finances = MemberFinances.objects.get(user=member)
+            finances = MemberFinances.objects.get(user_id=pk)
             serializer = MemberFinancesSerializer(finances)
             return Response(serializer.data)
         except MemberFinances.DoesNotExist:
@@ -56,23 +148,93 @@ class MemberViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def loans(self, request, pk=None):
-        member = self.get_object()
-        loans = MemberLoan.objects.filter(user=member)
-        serializer = MemberLoanSerializer(loans, many=True)
-        return Response(serializer.data)
+        loans = MemberLoan.objects.filter(user_id=pk).select_related('loan').order_by('-disbursement_date', '-id')
+        return self._paginated_subresource(loans, MemberLoanSerializer)
 
     @action(detail=True, methods=['get'])
     def deposits(self, request, pk=None):
-        member = self.get_object()
-        deposits = MemberDeposit.objects.filter(member=member)
-        serializer = MemberDepositSerializer(deposits, many=True)
-        return Response(serializer.data)
+        deposits = MemberDeposit.objects.filter(member_id=pk).select_related('deposit').order_by('-created_at', '-id')
+        return self._paginated_subresource(deposits, MemberDepositSerializer)
 
+    @action(detail=True, methods=['get'])
+    def summary(self, request, pk=None):
+        """Finances, open loans and deposits in one response, from three aggregate queries"""
+        finances = Member.objects.filter(pk=pk).values(
+            'memberfinances__total_savings', 'memberfinances__total_loans', 'memberfinances__last_updated_at'
+        ).first()
+        if finances is None:
+            raise Http404
+
+        zero = Value(Decimal('0'))
+        loans = MemberLoan.objects.filter(user_id=pk, principal_paid__lt=F('loan_amount')).aggregate(
+            open_count=Count('id'),
+            total_borrowed=Coalesce(Sum('loan_amount'), zero),
+            principal_outstanding=Coalesce(Sum(F('loan_amount') - F('principal_paid')), zero),
+            interest_outstanding=Coalesce(Sum(F('interest_amount') - F('interest_paid')), zero),
+        )
+        deposits = MemberDeposit.objects.filter(member_id=pk).aggregate(
+            count=Count('id'),
+            total_deposited=Coalesce(Sum('total_deposit_amount'), zero),
+            interest_earned=Coalesce(Sum('interest_earned'), zero),
+        )
+
+        has_finances = finances['memberfinances__last_updated_at'] is not None
+        serializer = MemberSummarySerializer({
+            'member': int(pk),
+            'finances': {key.split('__')[1]: value for key, value in finances.items()} if has_finances else None,
+            'loans': loans,
+            'deposits': deposits,
+        })
+        return Response(serializer.data)
 
-class AnnouncementViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], renderer_classes=[CSVStatementRenderer, PDFStatementRenderer])
+    def statement(self, request, pk=None):
+        """Savings and loan history from ?from= to ?to= (inclusive), streamed as ?format=csv or pdf"""
+        member = self.get_object()
+        start, end = self._statement_period(request.query_params)
+
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            statements.render(statements.build_statement(member, start, end), renderer.format),
+            content_type=renderer.media_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{statements.filename(member, start, end, renderer.format)}"'
+        )
+        return response
+
+    @staticmethod
+    def _statement_period(params):
+        period = {}
+        for param, default in [('from', None), ('to', timezone.localdate())]:
+            try:
+                period[param] = parse_date(params[param]) if params.get(param) else default
+            except ValueError:
+                period[param] = None
+            if params.get(param) and period[param] is None:
+                raise ValidationError({param: 'Must be a date (YYYY-MM-DD).'})
+
+        if period['from'] and period['from'] > period['to']:
+            raise ValidationError({'from': 'Must not be after to.'})
+        return period['from'], period['to']
+
+    def _paginated_subresource(self, queryset, serializer_class):
+        page = self.paginate_queryset(queryset)
+        # Only an empty page needs telling an unknown member from one without rows
+        if not page and not Member.objects.filter(pk=self.kwargs['pk']).exists():
+            raise Http404
+        return self.get_paginated_response(serializer_class(page, many=True).data)
+
+
+class AnnouncementViewSet(IdempotentCreateMixin, AtomicWriteMixin, ConditionalGetMixin, ResponseCacheMixin,
+                          RelatedFieldsMixin, BranchSubtreeFilterMixin, viewsets.ModelViewSet):
     queryset = Announcement.objects.all()
     serializer_class = AnnouncementSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = ['created_by', 'updated_by']
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-start_date', '-announcement_id')
+    cache_scope = 'shared'
 
     def perform_create(self, serializer):
         instance = serializer.save(created_by=self.request.user)
@@ -82,18 +244,26 @@ class AnnouncementViewSet(viewsets.ModelViewSet):
         instance = serializer.save(updated_by=self.request.user)
         WebhookManager.trigger_webhook('announcement.updated', instance)
 
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('announcement.deleted', instance)
+        instance.delete()
+
     def get_queryset(self):
-        queryset = Announcement.objects.all()
+        queryset = super().get_queryset()
         branch = self.request.query_params.get('branch', None)
         if branch is not None:
             queryset = queryset.filter(branch=branch)
         return queryset
 
 
-class EventViewSet(viewsets.ModelViewSet):
+class EventViewSet(IdempotentCreateMixin, AtomicWriteMixin, ConditionalGetMixin, RelatedFieldsMixin,
+                   BranchSubtreeFilterMixin, viewsets.ModelViewSet):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = ['created_by', 'updated_by']
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-start_time', '-event_id')
 
     def perform_create(self, serializer):
         instance = serializer.save(created_by=self.request.user)
@@ -103,35 +273,51 @@ class EventViewSet(viewsets.ModelViewSet):
         instance = serializer.save(updated_by=self.request.user)
         WebhookManager.trigger_webhook('event.updated', instance)
 
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('event.deleted', instance)
+        instance.delete()
+
     def get_queryset(self):
-        queryset = Event.objects.all()
+        queryset = super().get_queryset()
         branch = self.request.query_params.get('branch', None)
         if branch is not None:
             queryset = queryset.filter(branch=branch)
         return queryset
 
 
-class MemberPaymentViewSet(viewsets.ModelViewSet):
+class MemberPaymentViewSet(IdempotentCreateMixin, AtomicWriteMixin, viewsets.ModelViewSet):
     queryset = MemberPayment.objects.all()
     serializer_class = MemberPaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-payment_id')
 
     def perform_create(self, serializer):
         instance = serializer.save()
         WebhookManager.trigger_webhook('payment.created', instance)
 
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        WebhookManager.trigger_webhook('payment.updated', instance)
+
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('payment.deleted', instance)
+        instance.delete()
+
     def get_queryset(self):
-        queryset = MemberPayment.objects.all()
+        queryset = super().get_queryset()
         user = self.request.query_params.get('user', None)
         if user is not None:
             queryset = queryset.filter(user=user)
         return queryset
 
 
-class DepositViewSet(viewsets.ModelViewSet):
-    queryset = Deposit.objects.all()
+class DepositViewSet(IdempotentCreateMixin, AtomicWriteMixin, ConditionalGetMixin, ResponseCacheMixin,
+                     BranchSubtreeFilterMixin, viewsets.ModelViewSet):
+    queryset = Deposit.objects.order_by('pk')
     serializer_class = DepositSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_scope = 'shared'
 
     def perform_create(self, serializer):
         instance = serializer.save()
@@ -141,21 +327,36 @@ class DepositViewSet(viewsets.ModelViewSet):
         instance = serializer.save(updated_by=self.request.user)
         WebhookManager.trigger_webhook('deposit.updated', instance)
 
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('deposit.deleted', instance)
+        instance.delete()
+
 
-class MemberDepositViewSet(viewsets.ModelViewSet):
-    queryset = MemberDeposit.objects.all()
+class MemberDepositViewSet(IdempotentCreateMixin, AtomicWriteMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
+    queryset = MemberDeposit.objects.order_by('pk')
     serializer_class = MemberDepositSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = ['deposit']
 
     def perform_create(self, serializer):
         instance = serializer.save()
         WebhookManager.trigger_webhook('member_deposit.created', instance)
 
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        WebhookManager.trigger_webhook('member_deposit.updated', instance)
+
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('member_deposit.deleted', instance)
+        instance.delete()
+
 
-class LoanViewSet(viewsets.ModelViewSet):
-    queryset = Loan.objects.all()
+class LoanViewSet(IdempotentCreateMixin, AtomicWriteMixin, ConditionalGetMixin, ResponseCacheMixin,
+                  BranchSubtreeFilterMixin, viewsets.ModelViewSet):
+    queryset = Loan.objects.order_by('pk')
     serializer_class = LoanSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_scope = 'shared'
 
     def perform_create(self, serializer):
         instance = serializer.save()
@@ -165,18 +366,44 @@ class LoanViewSet(viewsets.ModelViewSet):
         instance = serializer.save(updated_by=self.request.user)
         WebhookManager.trigger_webhook('loan.updated', instance)
 
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('loan.deleted', instance)
+        instance.delete()
 
-class MemberLoanViewSet(viewsets.ModelViewSet):
-    queryset = MemberLoan.objects.all()
+
+class MemberLoanViewSet(IdempotentCreateMixin, AtomicWriteMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
+    queryset = MemberLoan.objects.order_by('pk')
     serializer_class = MemberLoanSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = ['loan']
 
     def perform_create(self, serializer):
         instance = serializer.save()
         WebhookManager.trigger_webhook('member_loan.created', instance)
 
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        WebhookManager.trigger_webhook('member_loan.updated', instance)
 
-class DocumentViewSet(viewsets.ModelViewSet):
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('member_loan.deleted', instance)
+        instance.delete()
+
+    @action(detail=True, methods=['get'])
+    def schedule(self, request, pk=None):
+        member_loan = self.get_object()
+        installments = amortization.schedule(member_loan)
+        return Response({
+            'member_loan': member_loan.pk,
+            'interest_method': member_loan.loan.interest_method,
+            'interest_rate': member_loan.loan.interest_rate,
+            'term_months': member_loan.loan.term_months,
+            'total_interest': str(sum((installment.interest for installment in installments), Decimal('0'))),
+            'installments': InstallmentSerializer(installments, many=True).data,
+        })
+
+
+class DocumentViewSet(IdempotentCreateMixin, AtomicWriteMixin, viewsets.ModelViewSet):
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -185,11 +412,21 @@ class DocumentViewSet(viewsets.ModelViewSet):
         instance = serializer.save(uploaded_by=self.request.user)
         WebhookManager.trigger_webhook('document.uploaded', instance)
 
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        WebhookManager.trigger_webhook('document.updated', instance)
+
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('document.deleted', instance)
+        instance.delete()
+
 
-class MinuteViewSet(viewsets.ModelViewSet):
+class MinuteViewSet(IdempotentCreateMixin, AtomicWriteMixin, ConditionalGetMixin, RelatedFieldsMixin,
+                    viewsets.ModelViewSet):
     queryset = Minute.objects.all()
     serializer_class = MinuteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = ['created_by', 'adopter1', 'adopter2']
 
     def perform_create(self, serializer):
         instance = serializer.save(created_by=self.request.user)
@@ -200,36 +437,116 @@ class MinuteViewSet(viewsets.ModelViewSet):
         WebhookManager.trigger_webhook('minute.updated', instance)
 
 
-class FeedbackViewSet(viewsets.ModelViewSet):
+class FeedbackViewSet(IdempotentCreateMixin, AtomicWriteMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     queryset = Feedback.objects.all()
     serializer_class = FeedbackSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = ['created_by']
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-feedback_id')
 
     def perform_create(self, serializer):
         instance = serializer.save(created_by=self.request.user)
         WebhookManager.trigger_webhook('feedback.created', instance)
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(IdempotentCreateMixin, AtomicWriteMixin, RelatedFieldsMixin, viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    select_related_fields = ['sender', 'receiver']
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created_at', '-id')
 
     def perform_create(self, serializer):
         instance = serializer.save(sender=self.request.user)
         WebhookManager.trigger_webhook('message.sent', instance)
 
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        WebhookManager.trigger_webhook('message.updated', instance)
+
+    def perform_destroy(self, instance):
+        WebhookManager.trigger_webhook('message.deleted', instance)
+        instance.delete()
+
     def get_queryset(self):
         user = self.request.user
-        return Message.objects.filter(Q(sender=user) | Q(receiver=user))
+        return super().get_queryset().filter(Q(sender=user) | Q(receiver=user))
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         message = self.get_object()
         if message.receiver == request.user:
-            message.read_status = True
-            message.save()
-            WebhookManager.trigger_webhook('message.read', message)
+            with transaction.atomic():
+                message.read_status = True
+                message.save()
+                WebhookManager.trigger_webhook('message.read', message)
             return Response({'status': 'message marked as read'})
         return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
+
+class SearchViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Site search over minutes, announcements, events and document contents.
+
+    `?q=` takes web-style queries ("quoted phrases", -excluded words, or);
+    `?kind=minute,document` limits the kinds of result. Results the user's
+    branch may not see are filtered out in the query itself.
+    """
+    serializer_class = SearchResultSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = []
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'This query parameter is required.'})
+
+        entries = SearchEntry.objects.visible_to(self.request.user).search(query)
+        kinds = [kind for kind in self.request.query_params.get('kind', '').split(',') if kind]
+        if kinds:
+            unknown = set(kinds) - set(SearchEntry.Kind.values)
+            if unknown:
+                raise ValidationError({'kind': f"Unknown kinds: {', '.join(sorted(unknown))}."})
+            entries = entries.filter(kind__in=kinds)
+        return entries
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'query': self.request.query_params.get('q', '')}
+
+
+class CacheStatsViewSet(viewsets.ViewSet):
+    """Response cache hits and misses per endpoint, as counted by the server process answering"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def list(self, request):
+        return Response(response_cache.cache_stats())
+
+
+class SyncViewSet(viewsets.ViewSet):
+    """
+    Changes since `?since=<token>` to the announcements, events, documents,
+    messages, payments, member loans and member deposits the user may see.
+
+    Each change carries the row as it is now, or `data: null` if it was deleted
+    or moved out of the user's sight. Without `since` only the current token
+    is returned: keep it, pull the collections, then pass it back to receive
+    every later change. Follow `token` while `has_more` is true. A token older
+    than the journal's retention gets 410 Gone, and the client starts over.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request):
+        since = request.query_params.get('since')
+        try:
+            token = sync.parse_token(since) if since else None
+        except ValueError:
+            raise ValidationError({'since': 'Malformed token.'})
+
+        try:
+            changes = sync.changes_since(request.user, token, settings.SYNC_PAGE_SIZE, {'request': request})
+        except sync.SyncTokenExpired:
+            return Response({'error': 'Token expired; pull all collections again and sync from a new token'},
+                            status=status.HTTP_410_GONE)
+        return Response(changes)
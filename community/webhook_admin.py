@@ -1,21 +1,99 @@
-from django.contrib import admin
-from .webhooks import WebhookEndpoint, WebhookLog
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .webhook_replay import FINISHED_STATUSES, replay_logs
+from .webhooks import WebhookEndpoint, WebhookEvent, WebhookLog
 
 
 @admin.register(WebhookEndpoint)
 class WebhookEndpointAdmin(admin.ModelAdmin):
-    list_display = ['url', 'is_active', 'event_types', 'created_at']
-    list_filter = ['is_active', 'created_at']
+    list_display = ['url', 'is_active', 'event_types', 'coalesce_window', 'batch_size', 'circuit_state',
+                    'consecutive_failures', 'parked_deliveries', 'circuit_opened_at', 'created_at']
+    list_filter = ['is_active', 'circuit_state', 'created_at']
     search_fields = ['url']
-    readonly_fields = ['created_at']
+    readonly_fields = ['created_at', 'circuit_state', 'consecutive_failures', 'circuit_opened_at']
+    actions = ['close_circuit']
+
+    def get_queryset(self, request):
+        # Correlated count so only parked rows are touched (served by webhook_log_parked_idx)
+        parked = WebhookLog.objects.filter(
+            endpoint=OuterRef('pk'), status=WebhookLog.Status.PARKED
+        ).order_by().values('endpoint').annotate(count=Count('pk')).values('count')
+        return super().get_queryset(request).annotate(parked_count=Coalesce(Subquery(parked), 0))
+
+    def parked_deliveries(self, obj):
+        return obj.parked_count
+    parked_deliveries.short_description = "Parked"
+    parked_deliveries.admin_order_field = 'parked_count'
+
+    @admin.action(description="Close circuit and release parked deliveries")
+    def close_circuit(self, request, queryset):
+        now = timezone.now()
+        for endpoint in queryset:
+            endpoint.record_success(now)
+        self.message_user(request, f"Closed the circuit for {queryset.count()} endpoint(s).")
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that reads the planner's row estimate instead of running COUNT(*)
+    for the unfiltered changelist on PostgreSQL
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if connection.vendor == 'postgresql' and query is not None and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COALESCE(SUM(reltuples), 0)::bigint FROM pg_class "
+                    "WHERE oid = to_regclass(%s) OR oid IN (SELECT inhrelid FROM pg_inherits "
+                    "WHERE inhparent = to_regclass(%s))",
+                    [self.object_list.model._meta.db_table] * 2
+                )
+                estimate = cursor.fetchone()[0]
+            if estimate > 0:
+                return estimate
+        return super().count
 
 
 @admin.register(WebhookLog)
 class WebhookLogAdmin(admin.ModelAdmin):
-    list_display = ['endpoint', 'event_type', 'success', 'status_code', 'attempts', 'created_at']
-    list_filter = ['success', 'event_type', 'created_at']
+    list_display = ['endpoint', 'event_type', 'status', 'status_code', 'attempts', 'duration_ms',
+                    'next_attempt_at', 'created_at']
+    list_filter = ['status', 'event_type', 'created_at']
+    list_select_related = ['endpoint']
     search_fields = ['endpoint__url', 'event_type']
     readonly_fields = ['created_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['redeliver']
+
+    @admin.action(description="Redeliver selected webhook deliveries")
+    def redeliver(self, request, queryset):
+        # Pending, parked and retried rows still have an attempt queued; replaying them would deliver twice
+        finished = queryset.filter(status__in=FINISHED_STATUSES)
+        skipped = queryset.exclude(status__in=FINISHED_STATUSES).count()
+        queued = replay_logs(finished.order_by('created_at', 'pk'), settings.WEBHOOK_REPLAY_RATE or None)
+        self.message_user(request, f"Queued {queued} deliveries for redelivery.")
+        if skipped:
+            self.message_user(request, f"Skipped {skipped} deliveries that have not finished yet.", messages.WARNING)
+
+    def has_add_permission(self, request):
+        return False  # Prevent manual creation of log entries
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_type', 'model', 'object_id', 'created_at', 'dispatched_at']
+    list_filter = ['event_type', 'created_at', 'dispatched_at']
+    search_fields = ['event_type', 'object_id']
+    readonly_fields = ['created_at', 'dispatched_at']
 
     def has_add_permission(self, request):
-        return False  # Prevent manual creation of log entries
\ No newline at end of file
+        return False  # Events are only produced by WebhookManager.trigger_webhook
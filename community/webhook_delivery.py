@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryRequest(NamedTuple):
+    """A single outbound webhook POST"""
+    url: str
+    body: bytes
+    headers: Dict[str, str]
+    timeout: float
+
+
+class DeliveryResult(NamedTuple):
+    """Outcome of a single webhook POST"""
+    url: str
+    status_code: Optional[int]
+    response_body: str
+    error: Optional[str]
+    duration_ms: int
+
+    @property
+    def success(self) -> bool:
+        return self.error is None and self.status_code is not None and self.status_code < 400
+
+
+class DeliveryEngine:
+    """
+    Fans webhook deliveries out over a bounded thread pool.
+
+    Each endpoint host gets its own requests.Session with a keep-alive connection
+    pool, so repeated deliveries to the same subscriber reuse TCP/TLS connections.
+    Worker threads only do HTTP; callers persist the results on their own thread.
+    """
+
+    def __init__(self, max_workers: int = None, max_response_bytes: int = None):
+        self.max_workers = max_workers or getattr(settings, 'WEBHOOK_MAX_WORKERS', 20)
+        self.max_response_bytes = max_response_bytes or getattr(settings, 'WEBHOOK_RESPONSE_BODY_MAX_BYTES', 2048)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='webhook')
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def deliver(self, delivery_requests: List[DeliveryRequest]) -> List[DeliveryResult]:
+        """
+        Send all requests concurrently
+
+        Args:
+            delivery_requests: Requests to send
+
+        Returns:
+            One DeliveryResult per request, in the same order
+        """
+        futures = [self._executor.submit(self._post, request) for request in delivery_requests]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _session_for(self, url: str) -> requests.Session:
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+            return session
+
+    def _post(self, request: DeliveryRequest) -> DeliveryResult:
+        started = time.perf_counter()
+        deadline = started + request.timeout
+        try:
+            # requests only bounds each socket operation; read the body against an
+            # overall deadline so a trickling subscriber cannot hold a worker longer
+            with self._session_for(request.url).post(
+                request.url,
+                data=request.body,
+                headers=request.headers,
+                timeout=request.timeout,
+                stream=True
+            ) as response:
+                # Only the head of the response is kept for the log; the rest is never read
+                chunks, received = [], 0
+                for chunk in response.iter_content(chunk_size=min(8192, self.max_response_bytes)):
+                    chunks.append(chunk)
+                    received += len(chunk)
+                    if received >= self.max_response_bytes:
+                        break
+                    if time.perf_counter() > deadline:
+                        raise requests.Timeout(f"Response not received within {request.timeout}s")
+
+                status_code, error = response.status_code, None
+                response_body = b''.join(chunks)[:self.max_response_bytes].decode(
+                    response.encoding or 'utf-8', errors='replace'
+                )
+        except Exception as e:
+            status_code, response_body, error = None, '', str(e)
+
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        logger.debug(f"Webhook POST {request.url} finished in {duration_ms}ms")
+        return DeliveryResult(request.url, status_code, response_body, error, duration_ms)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_delivery_engine() -> DeliveryEngine:
+    """Return the process-wide delivery engine, creating it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DeliveryEngine()
+        return _engine
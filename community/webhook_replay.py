@@ -0,0 +1,157 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+from django.apps import apps
+from django.db.models import ForeignKey, Q, QuerySet
+from django.utils import timezone
+
+from .webhooks import WebhookEndpoint, WebhookLog, WebhookManager
+
+logger = logging.getLogger(__name__)
+
+# Event type prefix -> model, as raised by the viewsets in views.py
+EVENT_SOURCES = {
+    'branch': 'community.Branch',
+    'member': 'community.Member',
+    'announcement': 'community.Announcement',
+    'event': 'community.Event',
+    'payment': 'community.MemberPayment',
+    'deposit': 'community.Deposit',
+    'member_deposit': 'community.MemberDeposit',
+    'loan': 'community.Loan',
+    'member_loan': 'community.MemberLoan',
+    'document': 'community.Document',
+    'minute': 'community.Minute',
+    'feedback': 'community.Feedback',
+    'message': 'community.Message',
+}
+
+
+# Attempts with no further attempt queued; only these may be replayed without duplicating a live delivery
+FINISHED_STATUSES = [WebhookLog.Status.FAILED, WebhookLog.Status.DELIVERED]
+
+
+def select_logs(endpoint: WebhookEndpoint = None, event_types: Iterable[str] = None,
+                since: datetime = None, until: datetime = None, failed_only: bool = True) -> QuerySet:
+    """
+    Select finished delivery attempts to replay
+
+    Superseded attempts (`retried`) are never selected, so each delivery is
+    replayed at most once.
+
+    Args:
+        endpoint: Only attempts to this endpoint
+        event_types: Only these event types; 'member.*' style prefixes are allowed
+        since: Only attempts created at or after this moment
+        until: Only attempts created before this moment
+        failed_only: Only attempts that finally failed, rather than failed and delivered
+    """
+    statuses = [WebhookLog.Status.FAILED] if failed_only else FINISHED_STATUSES
+
+    queryset = WebhookLog.objects.filter(status__in=statuses)
+
+    if endpoint is not None:
+        queryset = queryset.filter(endpoint=endpoint)
+    if event_types:
+        query = Q()
+        for event_type in event_types:
+            if event_type.endswith('*'):
+                query |= Q(event_type__startswith=event_type[:-1])
+            else:
+                query |= Q(event_type=event_type)
+        queryset = queryset.filter(query)
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+
+    return queryset.order_by('created_at', 'pk')
+
+
+def replay_logs(queryset: QuerySet, rate: Optional[float] = None, chunk_size: int = 1000) -> int:
+    """
+    Queue a fresh delivery attempt for every selected attempt
+
+    The new attempts go through the dispatcher like any other, so they are sent
+    concurrently and are subject to retries and circuit breakers. With a rate
+    their start times are spread out to at most `rate` deliveries per second.
+
+    Replaying is not idempotent: running it again over the same selection queues
+    every delivery again.
+
+    Returns:
+        Number of attempts queued
+    """
+    rows = queryset.values_list('pk', 'endpoint_id', 'event_id', 'event_type', 'payload').iterator(
+        chunk_size=chunk_size
+    )
+    return _queue(
+        ((pk, WebhookLog(endpoint_id=endpoint_id, event_id=event_id, event_type=event_type, payload=payload,
+                         attempts=1))
+         for pk, endpoint_id, event_id, event_type, payload in rows),
+        rate, chunk_size
+    )
+
+
+def backfill(source: str, endpoint: WebhookEndpoint, rate: Optional[float] = None, chunk_size: int = 1000,
+             start_after: Any = None, on_chunk: Callable[[Any], None] = None) -> int:
+    """
+    Queue a synthesized `<source>.created` event for every existing row of a model
+
+    Rows are streamed with iterator() in pk order and their foreign keys joined
+    in the same query, so whole tables are never held in memory. Each chunk of
+    attempts is committed as soon as it is inserted, so an interrupted run keeps
+    the chunks it queued; pass the last pk reported to `on_chunk` as
+    `start_after` to resume without queueing those rows twice.
+
+    Args:
+        source: Event type prefix, a key of EVENT_SOURCES (e.g. 'member')
+        endpoint: Endpoint to seed
+        rate: Maximum deliveries per second
+        chunk_size: Rows fetched and attempts inserted per chunk
+        start_after: Only rows with a greater pk, to resume an interrupted run
+        on_chunk: Called with the pk of the last row queued, after each chunk is committed
+
+    Returns:
+        Number of attempts queued
+    """
+    model = apps.get_model(EVENT_SOURCES[source])
+    event_type = f"{source}.created"
+    relations = [field.name for field in model._meta.fields if isinstance(field, ForeignKey)]
+    instances = model.objects.select_related(*relations).order_by('pk')
+    if start_after is not None:
+        instances = instances.filter(pk__gt=start_after)
+
+    return _queue(
+        ((instance.pk, WebhookLog(endpoint=endpoint, event_type=event_type, attempts=1,
+                                  payload=WebhookManager.build_payload(event_type, instance)))
+         for instance in instances.iterator(chunk_size=chunk_size)),
+        rate, chunk_size, on_chunk
+    )
+
+
+def _queue(log_entries: Iterable[Tuple[Any, WebhookLog]], rate: Optional[float], chunk_size: int,
+           on_chunk: Callable[[Any], None] = None) -> int:
+    start = timezone.now()
+    queued = 0
+    chunk = []
+    last_key = None
+
+    def flush():
+        WebhookLog.objects.bulk_create(chunk)
+        if on_chunk is not None and chunk:
+            on_chunk(last_key)
+
+    for last_key, log_entry in log_entries:
+        log_entry.next_attempt_at = start + timedelta(seconds=queued / rate) if rate else start
+        chunk.append(log_entry)
+        queued += 1
+
+        if len(chunk) >= chunk_size:
+            flush()
+            chunk = []
+
+    flush()
+    logger.info(f"Queued {queued} webhook deliveries for replay")
+    return queued
@@ -0,0 +1,241 @@
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .webhooks import WebhookEvent, WebhookLog
+
+logger = logging.getLogger(__name__)
+
+# Attempts that may still be sent are never archived
+FINISHED_STATUSES = [WebhookLog.Status.DELIVERED, WebhookLog.Status.RETRIED, WebhookLog.Status.FAILED]
+
+ARCHIVE_FIELDS = [
+    'id', 'endpoint_id', 'event_id', 'event_type', 'payload', 'status', 'status_code',
+    'response_body', 'attempts', 'duration_ms', 'created_at',
+]
+
+
+def archive_webhook_logs(cutoff: datetime, output_dir: Path, batch_size: int = 5000) -> Tuple[int, Path]:
+    """
+    Move finished WebhookLog rows older than `cutoff` into a gzip-compressed JSONL file
+
+    Rows are written and deleted in primary-key batches, each deletion in its own
+    short transaction, so the hot table is never locked for long. Each batch is
+    appended to the file as a complete gzip member and fsynced before its rows
+    are deleted, so an interrupted run leaves a readable archive holding every
+    row it deleted; gzip readers read the members as one stream.
+
+    Args:
+        cutoff: Archive rows created before this moment
+        output_dir: Directory for the archive file
+        batch_size: Rows written and deleted per batch
+
+    Returns:
+        (number of rows archived, path of the archive file)
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / f"webhook_logs_before_{cutoff:%Y%m%dT%H%M%S}_{timezone.now():%Y%m%dT%H%M%S}.jsonl.gz"
+    archived = 0
+
+    with open(path, 'ab') as archive:
+        for batch in _finished_batches(cutoff, batch_size):
+            lines = ''.join(json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n' for row in batch)
+            archive.write(gzip.compress(lines.encode('utf-8')))
+            archive.flush()
+            os.fsync(archive.fileno())
+
+            # Nothing references WebhookLog, so this is a single fast DELETE
+            WebhookLog.objects.filter(pk__in=[row['id'] for row in batch]).delete()
+
+            archived += len(batch)
+            logger.info(f"Archived {archived} webhook log rows to {path}")
+
+    if not archived:
+        path.unlink()
+
+    return archived, path
+
+
+def _finished_batches(cutoff: datetime, batch_size: int) -> Iterator[List[dict]]:
+    last_pk = 0
+    while True:
+        batch = list(WebhookLog.objects.filter(
+            pk__gt=last_pk,
+            created_at__lt=cutoff,
+            status__in=FINISHED_STATUSES
+        ).order_by('pk').values(*ARCHIVE_FIELDS)[:batch_size])
+
+        if not batch:
+            return
+
+        yield batch
+        last_pk = batch[-1]['id']
+
+
+def purge_webhook_events(cutoff: datetime, batch_size: int = 5000) -> int:
+    """
+    Delete dispatched outbox events older than `cutoff` that no attempt refers to
+
+    Returns:
+        Number of events deleted
+    """
+    deleted = 0
+    while True:
+        pks = list(WebhookEvent.objects.filter(
+            created_at__lt=cutoff,
+            dispatched_at__isnull=False,
+            webhooklog__isnull=True
+        ).order_by('pk').values_list('pk', flat=True)[:batch_size])
+
+        if not pks:
+            return deleted
+
+        WebhookEvent.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+
+
+# Monthly range partitioning (PostgreSQL only)
+
+def is_partitioned() -> bool:
+    """Whether the WebhookLog table has been converted to a partitioned table"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [WebhookLog._meta.db_table])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def partition_name(month: date) -> str:
+    return f"{WebhookLog._meta.db_table}_y{month.year}m{month.month:02d}"
+
+
+def _month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def ensure_partitions(first_month: date, months_ahead: int = 3) -> List[str]:
+    """
+    Create the monthly partitions from `first_month` up to `months_ahead` months after the current one
+
+    Returns:
+        Names of the partitions that were created
+    """
+    table = WebhookLog._meta.db_table
+    last_month = _month_start(timezone.now().date())
+    for _ in range(months_ahead):
+        last_month = _next_month(last_month)
+
+    created = []
+    month = _month_start(first_month)
+    with connection.cursor() as cursor:
+        while month <= last_month:
+            name = partition_name(month)
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is None:
+                cursor.execute(
+                    f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+                )
+                created.append(name)
+            month = _next_month(month)
+    return created
+
+
+def drop_empty_partitions(cutoff: datetime) -> List[str]:
+    """
+    Drop monthly partitions that lie entirely before `cutoff` and hold no rows
+
+    Returns:
+        Names of the partitions that were dropped
+    """
+    table = WebhookLog._meta.db_table
+    dropped = []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s AND child.relname LIKE %s ORDER BY child.relname",
+            [table, f"{table}\\_y%"]
+        )
+        for (name,) in cursor.fetchall():
+            year, month = name.rsplit('_y', 1)[1].split('m')
+            if _next_month(date(int(year), int(month), 1)) > cutoff.date():
+                continue
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{name}")')
+            if not cursor.fetchone()[0]:
+                cursor.execute(f'DROP TABLE "{name}"')
+                dropped.append(name)
+    return dropped
+
+
+def convert_to_partitioned(months_ahead: int = 3):
+    """
+    Rebuild the WebhookLog table as a table range-partitioned by month on created_at
+
+    PostgreSQL requires the partition key in every unique constraint, so the
+    table's primary key becomes (id, created_at) while the model keeps declaring
+    id alone. ids still come from a single sequence and stay unique, and the ORM
+    addresses rows by id as before, but a migration that later alters id or
+    created_at has to be written by hand (RunSQL) against the partitioned table.
+
+    ids are drawn from a plain sequence owned by the id column rather than an
+    identity column, whose behaviour on partitioned tables differs between
+    PostgreSQL versions. Foreign keys and indexes are rebuilt from the old
+    table's own definitions under their old names, so later migrations still
+    find them. Existing rows are copied across in one transaction.
+    """
+    table = WebhookLog._meta.db_table
+    old_table = f"{table}_unpartitioned"
+    sequence = f"{table}_id_seq"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(created_at), MAX(id) FROM "{table}"')
+        oldest, max_id = cursor.fetchone()
+
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f' ORDER BY conname", [table]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+            "WHERE indrelid = %s::regclass AND NOT indisprimary ORDER BY indexrelid", [table]
+        )
+        # Each definition names the table, which the partitioned table takes over
+        indexes = [definition for (definition,) in cursor.fetchall()]
+
+        cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old_table}"')
+        cursor.execute(
+            f'CREATE TABLE "{table}" (LIKE "{old_table}" INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+        ensure_partitions(oldest.date() if oldest else timezone.now().date(), months_ahead)
+
+        cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{old_table}"')
+        # Dropping the old table frees its sequence, constraint and index names for reuse below
+        cursor.execute(f'DROP TABLE "{old_table}"')
+
+        cursor.execute(f'CREATE SEQUENCE "{sequence}" OWNED BY "{table}".id')
+        cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN id SET DEFAULT nextval(%s::regclass)', [sequence])
+        if max_id:
+            cursor.execute("SELECT setval(%s::regclass, %s)", [sequence, max_id])
+
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY (id, created_at)')
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+        for definition in indexes:
+            cursor.execute(definition)
@@ -1,39 +1,253 @@
+import hashlib
+import hmac
 import json
-import requests
+import random
+import threading
+import time
+from datetime import timedelta
+from fnmatch import fnmatchcase
 from django.conf import settings
 from django.core.serializers import serialize
-from django.db import models
-from typing import Any, Dict, List
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from typing import Any, Dict, Iterable, List, Tuple
 import logging
 
+from .webhook_delivery import DeliveryRequest, DeliveryResult, get_delivery_engine
+
 logger = logging.getLogger(__name__)
 
+# Sent by WebhookManager.trigger_webhook for every event, subscribed to or not,
+# with the instance's model as sender and `instance` and `event_type` as arguments
+model_changed = Signal()
+
 
 class WebhookEndpoint(models.Model):
-    """Model to store webhook endpoints"""
+    """
+    Model to store webhook endpoints
+
+    Each endpoint carries a circuit breaker: after WEBHOOK_CIRCUIT_FAILURE_THRESHOLD
+    consecutive failures the circuit opens and deliveries are parked instead of sent.
+    Once WEBHOOK_CIRCUIT_COOLDOWN has passed a single probe is let through
+    (half-open), taken from the parked deliveries if no new one is due; success
+    closes the circuit and releases the parked deliveries, failure opens it
+    again.
+    """
+
+    class CircuitState(models.TextChoices):
+        CLOSED = 'closed', 'Closed'
+        OPEN = 'open', 'Open'
+        HALF_OPEN = 'half_open', 'Half-open'
+
     url = models.URLField()
     event_types = models.JSONField(default=list)  # List of event types to subscribe to
     is_active = models.BooleanField(default=True)
     secret = models.CharField(max_length=255, blank=True)
+    circuit_state = models.CharField(max_length=20, choices=CircuitState.choices, default=CircuitState.CLOSED)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    circuit_opened_at = models.DateTimeField(null=True, blank=True)  # When the circuit opened or last probed
+    coalesce_window = models.PositiveIntegerField(
+        default=0, help_text="Seconds to hold events so repeated changes to one object are merged; 0 disables")
+    batch_size = models.PositiveIntegerField(
+        default=1, help_text="Maximum events per POST; above 1, events are sent as a JSON array")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.url} - {self.event_types}"
 
+    def acquire_probe(self, now) -> bool:
+        """
+        Try to move an open circuit whose cool-down has elapsed to half-open
+
+        The conditional UPDATE makes sure only one dispatcher wins the probe. A
+        half-open circuit whose probe never reported back is probed again after
+        another cool-down.
+
+        Returns:
+            True if the caller may send one probe delivery
+        """
+        cooldown = now - timedelta(seconds=settings.WEBHOOK_CIRCUIT_COOLDOWN)
+        acquired = WebhookEndpoint.objects.filter(
+            pk=self.pk,
+            circuit_state__in=[self.CircuitState.OPEN, self.CircuitState.HALF_OPEN],
+            circuit_opened_at__lte=cooldown
+        ).update(circuit_state=self.CircuitState.HALF_OPEN, circuit_opened_at=now)
+        return acquired == 1
+
+    def record_success(self, now):
+        """Close the circuit and release every delivery parked while it was open"""
+        if self.circuit_state != self.CircuitState.CLOSED or self.consecutive_failures:
+            WebhookEndpoint.objects.filter(pk=self.pk).update(
+                circuit_state=self.CircuitState.CLOSED,
+                consecutive_failures=0,
+                circuit_opened_at=None
+            )
+            logger.info(f"Circuit closed for webhook endpoint {self.url}")
+
+        WebhookLog.objects.filter(endpoint_id=self.pk, status=WebhookLog.Status.PARKED).update(
+            status=WebhookLog.Status.PENDING,
+            next_attempt_at=now
+        )
+
+    def record_failures(self, count: int, now):
+        """
+        Count failed attempts and open the circuit when the threshold is reached
+
+        A failed half-open probe re-opens the circuit straight away.
+        """
+        WebhookEndpoint.objects.filter(pk=self.pk).update(
+            consecutive_failures=models.F('consecutive_failures') + count
+        )
+        self.refresh_from_db(fields=['circuit_state', 'consecutive_failures'])
+
+        if (self.circuit_state == self.CircuitState.HALF_OPEN or
+                self.consecutive_failures >= settings.WEBHOOK_CIRCUIT_FAILURE_THRESHOLD):
+            WebhookEndpoint.objects.filter(pk=self.pk).update(
+                circuit_state=self.CircuitState.OPEN,
+                circuit_opened_at=now
+            )
+            if self.circuit_state != self.CircuitState.OPEN:
+                logger.warning(f"Circuit opened for webhook endpoint {self.url} after "
+                               f"{self.consecutive_failures} consecutive failures")
+
 
 class WebhookLog(models.Model):
-    """Model to log webhook delivery attempts"""
+    """
+    Model to log webhook delivery attempts.
+
+    Each row is one attempt. A failed attempt that will be retried is marked
+    `retried` and a new pending row is scheduled for the next attempt.
+
+    On PostgreSQL the table may be partitioned by month with partition_webhook_logs,
+    after which its database primary key is (id, created_at); see
+    webhook_retention.convert_to_partitioned before migrating id or created_at.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        DELIVERED = 'delivered', 'Delivered'
+        RETRIED = 'retried', 'Failed, retry scheduled'
+        FAILED = 'failed', 'Failed'
+        PARKED = 'parked', 'Parked, circuit open'
+
     endpoint = models.ForeignKey(WebhookEndpoint, on_delete=models.CASCADE)
+    event = models.ForeignKey('WebhookEvent', on_delete=models.SET_NULL, null=True, blank=True)
     event_type = models.CharField(max_length=100)
-    payload = models.JSONField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
     status_code = models.IntegerField(null=True)
     response_body = models.TextField(blank=True)
     success = models.BooleanField(default=False)
-    attempts = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)  # Attempt number of this row, starting at 1
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    coalesce_key = models.CharField(max_length=255, null=True, blank=True)  # Set while held for coalescing
+    duration_ms = models.IntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='webhook_log_created_idx'),
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'),
+                         name='webhook_log_due_idx'),
+            models.Index(fields=['endpoint'], condition=models.Q(status='parked'),
+                         name='webhook_log_parked_idx'),
+            models.Index(fields=['endpoint', 'coalesce_key'], condition=models.Q(coalesce_key__isnull=False),
+                         name='webhook_log_coalesce_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.endpoint.url} - {self.event_type} - {'Success' if self.success else 'Failed'}"
+        return f"{self.endpoint.url} - {self.event_type} - {self.get_status_display()}"
+
+
+class WebhookEvent(models.Model):
+    """
+    Transactional outbox of webhook events.
+
+    Rows are written in the same transaction as the change that raised them, so the
+    dispatcher only ever sees events whose originating write has committed.
+    """
+    event_type = models.CharField(max_length=100)
+    model = models.CharField(max_length=100, blank=True)  # e.g. 'community.member'
+    object_id = models.CharField(max_length=64, blank=True)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(dispatched_at__isnull=True),
+                         name='webhook_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.pk} - {'Dispatched' if self.dispatched_at else 'Pending'}"
+
+
+class SubscriptionIndex:
+    """
+    Immutable map of event type to the ids of the active endpoints subscribed to it.
+
+    Subscriptions are exact event types (`member.created`) or shell-style
+    wildcards (`member.*`, `*`). Lookups are memoised per event type.
+    """
+
+    def __init__(self, subscriptions: Iterable[Tuple[int, List[str]]]):
+        self._exact: Dict[str, List[int]] = {}
+        self._wildcards: List[Tuple[str, int]] = []
+        self._resolved: Dict[str, Tuple[int, ...]] = {}
+
+        for endpoint_id, event_types in subscriptions:
+            for event_type in event_types or []:
+                if any(char in event_type for char in '*?['):
+                    self._wildcards.append((event_type, endpoint_id))
+                else:
+                    self._exact.setdefault(event_type, []).append(endpoint_id)
+
+    @classmethod
+    def load(cls) -> 'SubscriptionIndex':
+        return cls(WebhookEndpoint.objects.filter(is_active=True).values_list('pk', 'event_types'))
+
+    def endpoint_ids(self, event_type: str) -> Tuple[int, ...]:
+        resolved = self._resolved.get(event_type)
+        if resolved is None:
+            matches = set(self._exact.get(event_type, ()))
+            matches.update(endpoint_id for pattern, endpoint_id in self._wildcards
+                           if fnmatchcase(event_type, pattern))
+            resolved = self._resolved[event_type] = tuple(sorted(matches))
+        return resolved
+
+
+_subscription_index = None
+_subscription_index_loaded_at = 0.0
+_subscription_index_lock = threading.Lock()
+
+
+def get_subscription_index() -> SubscriptionIndex:
+    """
+    Return this process's subscription index, loading it if needed
+
+    The index is dropped whenever a WebhookEndpoint is saved or deleted in this
+    process, and reloaded at least every WEBHOOK_SUBSCRIPTION_TTL seconds to pick
+    up changes made by other processes.
+    """
+    global _subscription_index, _subscription_index_loaded_at
+    with _subscription_index_lock:
+        expired = time.monotonic() - _subscription_index_loaded_at > settings.WEBHOOK_SUBSCRIPTION_TTL
+        if _subscription_index is None or expired:
+            _subscription_index = SubscriptionIndex.load()
+            _subscription_index_loaded_at = time.monotonic()
+        return _subscription_index
+
+
+@receiver([post_save, post_delete], sender=WebhookEndpoint)
+def invalidate_subscription_index(sender, **kwargs):
+    global _subscription_index
+    with _subscription_index_lock:
+        _subscription_index = None
 
 
 class WebhookManager:
@@ -42,34 +256,50 @@ class WebhookManager:
     @staticmethod
     def trigger_webhook(event_type: str, instance: Any, extra_data: Dict = None):
         """
-        Trigger webhooks for a specific event type
+        Queue a webhook event for a specific event type
+
+        The event is written to the WebhookEvent outbox inside the caller's transaction;
+        delivery to subscribers happens later in the `dispatch_webhooks` command, so the
+        request never waits on subscriber endpoints. Events nobody subscribes to are
+        dropped using the in-memory subscription index, without touching the database.
+
+        Call it inside the transaction.atomic() block that writes the change (viewsets
+        get one from AtomicWriteMixin), so the change and its event commit together.
 
         Args:
             event_type: Type of event (e.g., 'member.created', 'payment.created')
             instance: The model instance that triggered the event
             extra_data: Additional data to include in the payload
+
+        Returns:
+            The queued WebhookEvent, or None if there are no subscribers
         """
-        # Get all active endpoints subscribed to this event type
-        endpoints = WebhookEndpoint.objects.filter(
-            is_active=True,
-            event_types__contains=[event_type]
-        )
+        if not transaction.get_connection().in_atomic_block:
+            logger.warning(f"{event_type} was triggered outside a transaction; the event may "
+                           f"commit without the change that raised it, or be lost")
+
+        model_changed.send(sender=type(instance), instance=instance, event_type=event_type)
+
+        if not get_subscription_index().endpoint_ids(event_type):
+            return None
 
-        for endpoint in endpoints:
-            WebhookManager._send_webhook(endpoint, event_type, instance, extra_data)
+        return WebhookEvent.objects.create(
+            event_type=event_type,
+            model=instance._meta.label_lower,
+            object_id=str(instance.pk),
+            payload=WebhookManager.build_payload(event_type, instance, extra_data)
+        )
 
     @staticmethod
-    def _send_webhook(endpoint: WebhookEndpoint, event_type: str, instance: Any, extra_data: Dict = None):
+    def build_payload(event_type: str, instance: Any, extra_data: Dict = None) -> Dict:
         """
-        Send webhook to a specific endpoint
+        Build the webhook payload for a model instance
 
         Args:
-            endpoint: WebhookEndpoint instance
             event_type: Type of event
-            instance: The model instance
-            extra_data: Additional data
+            instance: The model instance the event is about
+            extra_data: Additional data to include in the payload
         """
-        # Prepare payload
         payload = {
             'event_type': event_type,
             'timestamp': instance.created_at.isoformat() if hasattr(instance, 'created_at') else None,
@@ -79,55 +309,386 @@ class WebhookManager:
         if extra_data:
             payload.update(extra_data)
 
-        # Create webhook log entry
-        log_entry = WebhookLog.objects.create(
-            endpoint=endpoint,
-            event_type=event_type,
-            payload=payload
-        )
+        return payload
+
+    @staticmethod
+    def dispatch_pending(batch_size: int = 100) -> int:
+        """
+        Run one dispatcher pass: fan new outbox events out into per-endpoint
+        deliveries, then send every delivery whose attempt is due
+
+        Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+        dispatcher processes can drain the queue side by side without sending
+        the same attempt twice.
+
+        Args:
+            batch_size: Maximum number of events and of deliveries handled in this pass
+
+        Returns:
+            The larger of the two counts, so callers can tell whether work remains
+        """
+        queued = WebhookManager._queue_events(batch_size)
+        delivered = WebhookManager._deliver_due(batch_size)
+        return max(queued, delivered)
+
+    @staticmethod
+    def _queue_events(batch_size: int) -> int:
+        """
+        Turn pending outbox events into one pending WebhookLog per subscribed endpoint
+
+        For endpoints with a coalesce_window, the attempt is held for that many
+        seconds and later events for the same (event_type, model, pk) replace its
+        payload instead of adding attempts, so only the latest state goes out.
+
+        Args:
+            batch_size: Maximum number of events to queue
+
+        Returns:
+            Number of events queued
+        """
+        with transaction.atomic():
+            events = list(WebhookEvent.objects.select_for_update(skip_locked=True).filter(
+                dispatched_at__isnull=True
+            )[:batch_size])
+
+            if not events:
+                return 0
+
+            now = timezone.now()
+            # A fresh snapshot per pass, so the dispatcher never routes on a stale index
+            subscriptions = SubscriptionIndex.load()
+            coalescing = dict(WebhookEndpoint.objects.filter(
+                is_active=True, coalesce_window__gt=0
+            ).values_list('pk', 'coalesce_window'))
+            log_entries = []
+            held = {}
+            merged = []
+
+            for event in events:
+                for endpoint_id in subscriptions.endpoint_ids(event.event_type):
+                    window = coalescing.get(endpoint_id)
+                    if not window:
+                        log_entries.append(WebhookLog(
+                            endpoint_id=endpoint_id, event=event, event_type=event.event_type,
+                            payload=event.payload, attempts=1, next_attempt_at=now
+                        ))
+                        continue
+
+                    coalesce_key = f"{event.event_type}:{event.model}:{event.object_id}"
+                    log_entry = held.get((endpoint_id, coalesce_key))
+
+                    if log_entry is None:
+                        # An attempt still inside its window absorbs the event; one already
+                        # claimed for delivery is locked or has left the window, so it is skipped
+                        log_entry = WebhookLog.objects.select_for_update(skip_locked=True).filter(
+                            endpoint_id=endpoint_id,
+                            coalesce_key=coalesce_key,
+                            status=WebhookLog.Status.PENDING
+                        ).first()
+
+                        if log_entry is None:
+                            log_entry = WebhookLog(
+                                endpoint_id=endpoint_id, event_type=event.event_type, attempts=1,
+                                coalesce_key=coalesce_key, next_attempt_at=now + timedelta(seconds=window)
+                            )
+                            log_entries.append(log_entry)
+                        else:
+                            merged.append(log_entry)
+
+                        held[(endpoint_id, coalesce_key)] = log_entry
+
+                    # Only the latest state of the object is delivered
+                    log_entry.event = event
+                    log_entry.payload = event.payload
+
+            WebhookLog.objects.bulk_create(log_entries)
+            WebhookLog.objects.bulk_update(merged, ['event', 'payload'])
+            WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(dispatched_at=now)
+
+        return len(events)
+
+    @staticmethod
+    def _deliver_due(batch_size: int) -> int:
+        """
+        Send due delivery attempts concurrently and schedule retries for failures
+
+        Claimed attempts are leased by pushing next_attempt_at past the time the
+        batch can take, then the lock is released before any HTTP is done. If the
+        dispatcher dies mid-batch the lease expires and another one picks them up.
+
+        Args:
+            batch_size: Maximum number of attempts to send
+
+        Returns:
+            Number of attempts claimed, whether sent or parked
+        """
+        engine = get_delivery_engine()
+        timeout = settings.WEBHOOK_TIMEOUT
+        now = timezone.now()
+        WebhookManager._release_probes(now)
+
+        with transaction.atomic():
+            log_entries = list(WebhookLog.objects.select_for_update(skip_locked=True, of=('self',)).select_related(
+                'endpoint'
+            ).filter(
+                status=WebhookLog.Status.PENDING,
+                next_attempt_at__lte=now
+            ).order_by('next_attempt_at')[:batch_size])
+
+            if not log_entries:
+                return 0
+
+            claimed = len(log_entries)
+            log_entries, parked = WebhookManager._apply_circuit_breakers(log_entries, now)
+
+            if parked:
+                WebhookLog.objects.filter(pk__in=[log_entry.pk for log_entry in parked]).update(
+                    status=WebhookLog.Status.PARKED,
+                    next_attempt_at=None
+                )
+
+            # Leaving the coalescing window: later events must not merge into an attempt in flight
+            lease = timeout * (len(log_entries) // engine.max_workers + 2)
+            WebhookLog.objects.filter(pk__in=[log_entry.pk for log_entry in log_entries]).update(
+                next_attempt_at=now + timedelta(seconds=lease),
+                coalesce_key=None
+            )
+
+        if not log_entries:
+            return claimed
+
+        deliveries = WebhookManager._build_requests(log_entries)
+        results = engine.deliver([delivery_request for delivery_request, _ in deliveries])
+
+        now = timezone.now()
+        log_entries = []
+        retries = []
+        endpoints = {}
+        failures = {}
+        succeeded = set()
+
+        for (delivery_request, batch), result in zip(deliveries, results):
+            endpoint = endpoints.setdefault(batch[0].endpoint_id, batch[0].endpoint)
+            if result.success:
+                succeeded.add(endpoint.pk)
+            else:
+                failures[endpoint.pk] = failures.get(endpoint.pk, 0) + 1
+
+            for log_entry in batch:
+                log_entries.append(log_entry)
+                WebhookManager._record_result(log_entry, result, now, retries)
+
+        with transaction.atomic():
+            WebhookLog.objects.bulk_update(log_entries, [
+                'status', 'status_code', 'response_body', 'success', 'duration_ms', 'next_attempt_at'
+            ])
+            WebhookLog.objects.bulk_create(retries)
+
+        for endpoint in endpoints.values():
+            if endpoint.pk in succeeded:
+                endpoint.record_success(now)
+            else:
+                endpoint.record_failures(failures[endpoint.pk], now)
+
+        return claimed
+
+    @staticmethod
+    def _record_result(log_entry: 'WebhookLog', result: DeliveryResult, now, retries: List['WebhookLog']):
+        """
+        Apply a delivery result to an attempt, scheduling the next attempt on failure
+
+        Args:
+            log_entry: The attempt that was sent
+            result: Outcome of the POST that carried it
+            now: Current time
+            retries: List the scheduled retry attempt, if any, is appended to
+        """
+        endpoint = log_entry.endpoint
+        log_entry.status_code = result.status_code
+        log_entry.response_body = (result.error or result.response_body)[:settings.WEBHOOK_RESPONSE_BODY_MAX_BYTES]
+        log_entry.success = result.success
+        log_entry.duration_ms = result.duration_ms
+        log_entry.next_attempt_at = None
+
+        if result.success:
+            log_entry.status = WebhookLog.Status.DELIVERED
+            logger.info(f"Webhook sent successfully to {endpoint.url} for {log_entry.event_type} "
+                        f"in {result.duration_ms}ms")
+        else:
+            reason = result.error or f"HTTP {result.status_code}"
+            if log_entry.attempts <= settings.WEBHOOK_MAX_RETRIES:
+                delay = WebhookManager._retry_delay(log_entry.attempts)
+                log_entry.status = WebhookLog.Status.RETRIED
+                retries.append(WebhookLog(
+                    endpoint=endpoint,
+                    event_id=log_entry.event_id,
+                    event_type=log_entry.event_type,
+                    payload=log_entry.payload,
+                    attempts=log_entry.attempts + 1,
+                    next_attempt_at=now + timedelta(seconds=delay)
+                ))
+                logger.warning(f"Webhook to {endpoint.url} for {log_entry.event_type} failed "
+                               f"(attempt {log_entry.attempts}): {reason}; retrying in {delay:.0f}s")
+            else:
+                log_entry.status = WebhookLog.Status.FAILED
+                logger.error(f"Failed to send webhook to {endpoint.url} for {log_entry.event_type} "
+                             f"after {log_entry.attempts} attempts: {reason}")
+
+    @staticmethod
+    def _release_probes(now):
+        """
+        Move one parked attempt of every circuit due for a probe back to pending
+
+        Attempts that come due while a circuit is open are parked, so an endpoint
+        without new events would otherwise never be probed again. The released
+        attempt is claimed in the same pass and becomes the half-open probe.
+        """
+        cooldown = now - timedelta(seconds=settings.WEBHOOK_CIRCUIT_COOLDOWN)
+        endpoint_ids = list(WebhookEndpoint.objects.filter(
+            circuit_state__in=[WebhookEndpoint.CircuitState.OPEN, WebhookEndpoint.CircuitState.HALF_OPEN],
+            circuit_opened_at__lte=cooldown
+        ).values_list('pk', flat=True))
+
+        for endpoint_id in endpoint_ids:
+            with transaction.atomic():
+                probe = WebhookLog.objects.select_for_update(skip_locked=True).filter(
+                    endpoint_id=endpoint_id,
+                    status=WebhookLog.Status.PARKED
+                ).order_by('id').values_list('id', flat=True).first()
+                if probe is not None:
+                    WebhookLog.objects.filter(id=probe).update(status=WebhookLog.Status.PENDING, next_attempt_at=now)
+
+    @staticmethod
+    def _apply_circuit_breakers(log_entries: List['WebhookLog'], now) -> Tuple[List['WebhookLog'], List['WebhookLog']]:
+        """
+        Split claimed attempts into those to send and those to park
+
+        Attempts for closed circuits are sent. For an open circuit whose cool-down
+        has elapsed, exactly one attempt is sent as the half-open probe; everything
+        else for a non-closed circuit is parked until the circuit closes.
+
+        Returns:
+            (attempts to send, attempts to park)
+        """
+        sendable, parked = [], []
+        probing, blocked = set(), set()
+
+        for log_entry in log_entries:
+            endpoint = log_entry.endpoint
+
+            if endpoint.circuit_state == WebhookEndpoint.CircuitState.CLOSED:
+                sendable.append(log_entry)
+            elif endpoint.pk in probing or endpoint.pk in blocked:
+                parked.append(log_entry)
+            elif endpoint.acquire_probe(now):
+                probing.add(endpoint.pk)
+                sendable.append(log_entry)
+            else:
+                blocked.add(endpoint.pk)
+                parked.append(log_entry)
+
+        return sendable, parked
+
+    @staticmethod
+    def _retry_delay(attempt: int) -> float:
+        """
+        Exponential backoff with jitter for the retry following `attempt`
+
+        The delay doubles with every attempt up to WEBHOOK_RETRY_BACKOFF_MAX; half of
+        it is randomised so retries for a recovering subscriber do not arrive in step.
+        """
+        delay = min(settings.WEBHOOK_RETRY_BACKOFF_MAX, settings.WEBHOOK_RETRY_BACKOFF * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _build_requests(log_entries: List['WebhookLog']) -> List[Tuple[DeliveryRequest, List['WebhookLog']]]:
+        """
+        Build the signed HTTP requests for a batch of delivery attempts
+
+        The body of each event is encoded to bytes once and shared by every endpoint
+        receiving it, and each signature is computed over exactly those bytes, which
+        are posted as-is. Endpoints sharing a secret share the signature too.
+
+        Attempts for an endpoint with batch_size > 1 are grouped, up to batch_size
+        at a time, into a single POST whose body is a JSON array of the event bodies.
+
+        Args:
+            log_entries: WebhookLog attempts, with their endpoints loaded
+
+        Returns:
+            (request, attempts carried by that request) pairs
+        """
+        bodies = {}
+        signatures = {}
+        groups = []
+        open_batches = {}
+
+        for log_entry in log_entries:
+            endpoint = log_entry.endpoint
+            if endpoint.batch_size > 1:
+                batch = open_batches.get(endpoint.pk)
+                if batch is None or len(batch) >= endpoint.batch_size:
+                    batch = open_batches[endpoint.pk] = []
+                    groups.append(batch)
+                batch.append(log_entry)
+            else:
+                groups.append([log_entry])
+
+        def body_for(log_entry):
+            body_key = ('event', log_entry.event_id) if log_entry.event_id else ('log', log_entry.pk)
+            if body_key not in bodies:
+                bodies[body_key] = WebhookManager.encode_payload(log_entry.payload)
+            return body_key, bodies[body_key]
+
+        delivery_requests = []
+
+        for batch in groups:
+            endpoint = batch[0].endpoint
+
+            if endpoint.batch_size > 1:
+                parts = [body_for(log_entry) for log_entry in batch]
+                body_key = ('batch', tuple(key for key, _ in parts))
+                body = b'[' + b','.join(part for _, part in parts) + b']'
+                event_type = 'batch'
+            else:
+                body_key, body = body_for(batch[0])
+                event_type = batch[0].event_type
 
-        try:
             # Prepare headers
             headers = {
                 'Content-Type': 'application/json',
                 'X-Event-Type': event_type,
             }
 
+            if endpoint.batch_size > 1:
+                headers['X-Webhook-Batch-Size'] = str(len(batch))
+
             if endpoint.secret:
-                import hmac
-                import hashlib
-                signature = hmac.new(
-                    endpoint.secret.encode('utf-8'),
-                    json.dumps(payload).encode('utf-8'),
-                    hashlib.sha256
-                ).hexdigest()
-                headers['X-Webhook-Signature'] = f'sha256={signature}'
-
-            # Send webhook
-            response = requests.post(
-                endpoint.url,
-                json=payload,
-                headers=headers,
-                timeout=30
+                signature_key = (body_key, endpoint.secret)
+                if signature_key not in signatures:
+                    signatures[signature_key] = WebhookManager.sign(endpoint.secret, body)
+                headers['X-Webhook-Signature'] = signatures[signature_key]
+
+            delivery_requests.append(
+                (DeliveryRequest(endpoint.url, body, headers, timeout=settings.WEBHOOK_TIMEOUT), batch)
             )
 
-            # Update log entry
-            log_entry.status_code = response.status_code
-            log_entry.response_body = response.text
-            log_entry.success = response.status_code < 400
-            log_entry.attempts = 1
-            log_entry.save()
+        return delivery_requests
 
-            logger.info(f"Webhook sent successfully to {endpoint.url} for {event_type}")
+    @staticmethod
+    def encode_payload(payload: Any) -> bytes:
+        """Encode a webhook payload to the exact bytes that are signed and posted"""
+        return json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
 
-        except Exception as e:
-            # Update log entry with error
-            log_entry.success = False
-            log_entry.attempts = 1
-            log_entry.response_body = str(e)
-            log_entry.save()
+    @staticmethod
+    def sign(secret: str, body: bytes) -> str:
+        """
+        Compute the X-Webhook-Signature header value for a request body
 
-            logger.error(f"Failed to send webhook to {endpoint.url} for {event_type}: {str(e)}")
+        Receivers verify by computing the same HMAC over the raw request body.
+        """
+        signature = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        return f'sha256={signature}'
 
     @staticmethod
     def _serialize_instance(instance: Any) -> Dict:
@@ -156,9 +717,7 @@ class WebhookManager:
                 # Add related object info
                 if hasattr(value, '__str__'):
                     data[f"{field.name}_display"] = str(value)
-            elif isinstance(field, models.FileField) and value:
-                data[field.name] = value.url if value else None
-            elif isinstance(field, models.ImageField) and value:
+            elif isinstance(field, models.FileField):
                 data[field.name] = value.url if value else None
             else:
                 data[field.name] = value